@@ -0,0 +1,13 @@
+"""
+Benchmarks for the hot paths in :mod:`sprockets_influxdb`. Each module can be
+run on its own from the root of the repository, for example::
+
+    python -m benchmarks.buffer
+
+and prints its results as JSON. To run all of them, or a subset, and print the
+results with the Python, Tornado and library versions they were run with::
+
+    python -m benchmarks.run -o results.json
+    python -m benchmarks.run marshall ingest mixin flush
+
+"""
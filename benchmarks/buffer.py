@@ -0,0 +1,75 @@
+"""
+Measure the cost of taking a batch off of a database's measurement buffer and
+building its request body as the backlog grows, comparing
+:class:`sprockets_influxdb._MeasurementBuffer` with slicing a list of
+marshalled strings and joining and encoding the slice.
+
+"""
+import json
+import timeit
+
+import sprockets_influxdb as influxdb
+
+BACKLOGS = (10000, 25000, 50000, 100000, 200000)
+BATCH_SIZE = 5000
+LINE = 'measurement,hostname=host,method=GET duration=0.0123 1500000000000'
+
+
+def _fill_list(backlog):
+    return [LINE] * backlog
+
+
+def _fill_buffer(backlog):
+    pending = influxdb._MeasurementBuffer()
+    value = LINE.encode('utf-8')
+    for _iteration in range(0, backlog):
+        pending.append(value)
+    return pending
+
+
+def _drain_list(pending):
+    while pending:
+        batch = '\n'.join(pending[:BATCH_SIZE]).encode('utf-8')
+        pending = pending[BATCH_SIZE:]
+    return batch
+
+
+def _drain_buffer(pending):
+    while pending:
+        batch = pending.take(BATCH_SIZE)
+    return batch
+
+
+def _per_batch(fill, drain, backlog):
+    """Return the fastest observed seconds spent per batch when draining a
+    buffer holding ``backlog`` measurements.
+
+    """
+    timings = []
+    for _iteration in range(0, 5):
+        pending = fill(backlog)
+        start = timeit.default_timer()
+        drain(pending)
+        timings.append(timeit.default_timer() - start)
+    return min(timings) / (backlog // BATCH_SIZE)
+
+
+def run():
+    """Run the benchmark, returning the per-batch drain cost in microseconds
+    for each backlog size.
+
+    :rtype: dict
+
+    """
+    results = {'batch_size': BATCH_SIZE, 'backlogs': {}}
+    for backlog in BACKLOGS:
+        results['backlogs'][backlog] = {
+            'list_us_per_batch': round(
+                _per_batch(_fill_list, _drain_list, backlog) * 1e6, 2),
+            'buffer_us_per_batch': round(
+                _per_batch(_fill_buffer, _drain_buffer, backlog) * 1e6, 2)}
+    return results
+
+
+if __name__ == '__main__':
+    print(json.dumps(run(), indent=2, sort_keys=True))
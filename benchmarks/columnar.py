@@ -0,0 +1,77 @@
+"""
+Compare the per-point cost of adding measurements with
+:meth:`sprockets_influxdb.add_measurements_columnar` against creating and
+adding a :class:`sprockets_influxdb.Measurement` for each row, with the
+columns stored as lists and as NumPy arrays.
+
+"""
+import json
+import random
+import timeit
+
+import sprockets_influxdb as influxdb
+
+COUNT = 100000
+
+
+def _columns():
+    random.seed(COUNT)
+    return ({'duration': [random.random() for _i in range(0, COUNT)],
+             'rows': [random.randint(0, 1000) for _i in range(0, COUNT)]},
+            [1500000000.0 + index / 1000.0 for index in range(0, COUNT)])
+
+
+def _reset():
+    influxdb._buffer_size = 0
+    influxdb._measurements = {}
+
+
+def _measurements(fields, timestamps):
+    _reset()
+    for index, timestamp in enumerate(timestamps):
+        measurement = influxdb.Measurement('batch', 'job')
+        measurement.set_tag('table', 'users')
+        measurement.set_field('duration', fields['duration'][index])
+        measurement.set_field('rows', fields['rows'][index])
+        measurement.set_timestamp(timestamp)
+        influxdb.add_measurement(measurement)
+
+
+def _columnar(fields, timestamps):
+    _reset()
+    influxdb.add_measurements_columnar(
+        'batch', 'job', {'table': 'users'}, fields, timestamps)
+
+
+def _per_point(function, *args):
+    return round(min(timeit.repeat(
+        lambda: function(*args), repeat=3, number=1)) * 1e6 / COUNT, 3)
+
+
+def run():
+    """Run the benchmark, returning the microseconds spent per point.
+
+    :rtype: dict
+
+    """
+    influxdb.set_max_buffer_size(COUNT * 2)
+    influxdb.set_trigger_size(COUNT * 2)
+    fields, timestamps = _columns()
+    numpy = influxdb.numpy
+    results = {'count': COUNT,
+               'measurement_us_per_point': _per_point(
+                   _measurements, fields, timestamps),
+               'columnar_us_per_point': _per_point(
+                   _columnar, fields, timestamps)}
+    if numpy is not None:
+        results['columnar_numpy_us_per_point'] = _per_point(
+            _columnar, dict((key, numpy.array(values))
+                            for key, values in fields.items()),
+            numpy.array(timestamps))
+    _reset()
+    influxdb._maybe_stop_timeout()
+    return results
+
+
+if __name__ == '__main__':
+    print(json.dumps(run(), indent=2, sort_keys=True))
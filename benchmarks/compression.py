@@ -0,0 +1,78 @@
+"""
+Compare the CPU cost of gzip compressing batch submissions with the number of
+bytes saved, for batches of measurements like those submitted by
+:class:`sprockets_influxdb.InfluxDBMixin`.
+
+"""
+import json
+import random
+import timeit
+
+import sprockets_influxdb as influxdb
+
+BATCH_SIZES = (1000, 5000, 10000)
+LEVELS = (1, 3, 6, 9)
+
+
+def _mixin_measurements(count):
+    """Return a body of marshalled measurements with the tags and fields
+    the mixin submits for a request.
+
+    """
+    endpoints = ['/', '/users/(?P<id>\\d+)', '/orders', '/status']
+    values = []
+    for _iteration in range(0, count):
+        measurement = influxdb.Measurement('requests', 'my-service')
+        measurement.set_tags({
+            'hostname': 'web-1.example.com',
+            'environment': 'production',
+            'handler': 'my_service.handlers.RequestHandler',
+            'method': random.choice(['GET', 'POST']),
+            'endpoint': random.choice(endpoints),
+            'status_code': random.choice([200, 200, 200, 204, 404]),
+            'remote_ip': '10.0.{}.{}'.format(random.randint(0, 255),
+                                             random.randint(0, 255))})
+        measurement.set_field('content_length', random.randint(0, 4096))
+        measurement.set_field('duration', random.random() / 10)
+        values.append(measurement.marshall(True) + b'\n')
+    return b''.join(values)
+
+
+def run():
+    """Run the benchmark, returning the compressed size and the time spent
+    building the request body for each batch size and compression level.
+
+    :rtype: dict
+
+    """
+    results = {}
+    for batch_size in BATCH_SIZES:
+        measurements = _mixin_measurements(batch_size)
+        influxdb.set_compression(0)
+        raw_size = len(influxdb._request_body(measurements)[0])
+        raw_time = min(timeit.repeat(
+            lambda: influxdb._request_body(measurements),
+            repeat=5, number=3)) / 3
+        result = {'uncompressed_bytes': raw_size,
+                  'uncompressed_ms': round(raw_time * 1000, 3),
+                  'levels': {}}
+        for level in LEVELS:
+            influxdb.set_compression(level, 0)
+            size = len(influxdb._request_body(measurements)[0])
+            elapsed = min(timeit.repeat(
+                lambda: influxdb._request_body(measurements),
+                repeat=5, number=3)) / 3
+            result['levels'][level] = {
+                'bytes': size,
+                'ratio': round(raw_size / float(size), 2),
+                'ms': round(elapsed * 1000, 3),
+                'us_per_kb_saved': round(
+                    (elapsed - raw_time) * 1e6 /
+                    ((raw_size - size) / 1024.0), 3)}
+        results[batch_size] = result
+    influxdb.set_compression(0)
+    return results
+
+
+if __name__ == '__main__':
+    print(json.dumps(run(), indent=2, sort_keys=True))
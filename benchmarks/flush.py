@@ -0,0 +1,104 @@
+"""
+Measure the end-to-end throughput of :func:`sprockets_influxdb.flush`,
+marshalling, batching, and submitting measurements to an in-process Tornado
+``/write`` endpoint that stands in for InfluxDB, for different batch sizes
+and numbers of batches in flight.
+
+"""
+import json
+import timeit
+
+from tornado import gen, httpserver, ioloop, testing, web
+
+import sprockets_influxdb as influxdb
+
+COUNT = 100000
+CONFIGURATIONS = ((1000, 1), (5000, 1), (5000, 4), (10000, 10))
+
+
+class _WriteHandler(web.RequestHandler):
+    """Accept a batch of measurements, counting the lines like InfluxDB
+    would parse them.
+
+    """
+    lines = 0
+
+    def post(self):
+        _WriteHandler.lines += self.request.body.count(b'\n')
+        self.set_status(204)
+
+
+def _add_measurements():
+    for iteration in range(0, COUNT):
+        measurement = influxdb.Measurement('requests', 'my-service')
+        measurement.set_tags({'handler': 'my_service.handlers.Handler',
+                              'method': 'GET', 'status_code': 200})
+        measurement.set_field('content_length', iteration)
+        measurement.set_field('duration', 0.0123)
+        influxdb.add_measurement(measurement)
+
+
+@gen.coroutine
+def _flush(batch_size, inflight_batches):
+    """Add ``COUNT`` measurements and flush them, returning the seconds
+    spent.
+
+    """
+    influxdb.set_max_batch_size(batch_size)
+    influxdb.set_max_inflight_batches(inflight_batches)
+    _WriteHandler.lines = 0
+    start = timeit.default_timer()
+    _add_measurements()
+    yield influxdb.flush()
+    elapsed = timeit.default_timer() - start
+    if _WriteHandler.lines != COUNT:
+        raise AssertionError('Wrote {} of {} measurements'.format(
+            _WriteHandler.lines, COUNT))
+    raise gen.Return(elapsed)
+
+
+@gen.coroutine
+def _run():
+    sock, port = testing.bind_unused_port()
+    server = httpserver.HTTPServer(
+        web.Application([('/write', _WriteHandler)]))
+    server.add_sockets([sock])
+    influxdb.set_base_url('http://127.0.0.1:{}/write'.format(port))
+    influxdb.set_max_buffer_size(COUNT + 1)
+    influxdb.set_trigger_size(COUNT + 1)
+    results = {'count': COUNT, 'configurations': {}}
+    try:
+        for batch_size, inflight_batches in CONFIGURATIONS:
+            timings = []
+            for _iteration in range(0, 3):
+                timings.append((yield _flush(batch_size, inflight_batches)))
+            elapsed = min(timings)
+            key = '{}_batch_size_{}_in_flight'.format(
+                batch_size, inflight_batches)
+            results['configurations'][key] = {
+                'seconds': round(elapsed, 4),
+                'measurements_per_second': int(COUNT / elapsed)}
+    finally:
+        server.stop()
+        influxdb._maybe_stop_timeout()
+        influxdb.set_base_url('http://localhost:8086/write')
+        influxdb.set_max_batch_size(10000)
+        influxdb.set_max_buffer_size(25000)
+        influxdb.set_max_inflight_batches(10)
+        influxdb.set_trigger_size(5000)
+    raise gen.Return(results)
+
+
+def run():
+    """Run the benchmark, returning the seconds spent and the number of
+    measurements written per second for each batch size and number of
+    batches in flight.
+
+    :rtype: dict
+
+    """
+    return ioloop.IOLoop.current().run_sync(_run, timeout=300)
+
+
+if __name__ == '__main__':
+    print(json.dumps(run(), indent=2, sort_keys=True))
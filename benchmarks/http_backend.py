@@ -0,0 +1,102 @@
+"""
+Measure the per-batch latency of submitting batches to an in-process Tornado
+``/write`` endpoint with each HTTP backend, comparing the ``simple`` backend,
+which opens a connection for each batch, with the ``curl`` backend with and
+without reusing its pooled connections.
+
+"""
+import json
+
+from tornado import gen, httpserver, ioloop, testing, web
+
+import sprockets_influxdb as influxdb
+
+BATCHES = 500
+BATCH_SIZE = 100
+
+
+class _Server(httpserver.HTTPServer):
+    """Count the connections that are opened to the server."""
+    connections = 0
+
+    def handle_stream(self, stream, address):
+        _Server.connections += 1
+        return super(_Server, self).handle_stream(stream, address)
+
+
+class _WriteHandler(web.RequestHandler):
+    def post(self):
+        self.set_status(204)
+
+
+def _forbid_reuse(curl):
+    curl.setopt(influxdb.pycurl.FORBID_REUSE, 1)
+
+
+@gen.coroutine
+def _submit(backend, reuse):
+    """Submit ``BATCHES`` batches one at a time, returning the batch
+    latency quantiles in milliseconds and the number of connections used.
+
+    """
+    influxdb.set_http_backend(backend)
+    prepare_curl = influxdb._prepare_curl
+    if not reuse:
+        influxdb._prepare_curl = _forbid_reuse
+    influxdb._create_http_client()
+    influxdb._prepare_curl = prepare_curl
+    influxdb._stats_durations.clear()
+    _Server.connections = 0
+    for _iteration in range(0, BATCHES):
+        for iteration in range(0, BATCH_SIZE):
+            measurement = influxdb.Measurement('requests', 'my-service')
+            measurement.set_tag('method', 'GET')
+            measurement.set_field('duration', 0.0123)
+            measurement.set_field('content_length', iteration)
+            influxdb.add_measurement(measurement)
+        yield influxdb.flush()
+    sketch = influxdb._stats_durations['batch']
+    result = {'connections': _Server.connections}
+    for suffix, quantile in [('p50', 0.5), ('p90', 0.9), ('p99', 0.99)]:
+        result['{}_ms'.format(suffix)] = round(
+            sketch.quantile(quantile) * 1000, 3)
+    raise gen.Return(result)
+
+
+@gen.coroutine
+def _run():
+    sock, port = testing.bind_unused_port()
+    server = _Server(web.Application([('/write', _WriteHandler)]))
+    server.add_sockets([sock])
+    influxdb.set_base_url('http://127.0.0.1:{}/write'.format(port))
+    influxdb.set_max_batch_size(BATCH_SIZE)
+    influxdb.set_trigger_size(BATCH_SIZE + 1)
+    results = {'batches': BATCHES, 'batch_size': BATCH_SIZE}
+    try:
+        results['simple'] = yield _submit('simple', False)
+        if influxdb.pycurl is not None:
+            results['curl_without_reuse'] = yield _submit('curl', False)
+            results['curl'] = yield _submit('curl', True)
+    finally:
+        server.stop()
+        influxdb._maybe_stop_timeout()
+        influxdb.set_base_url('http://localhost:8086/write')
+        influxdb.set_http_backend('simple')
+        influxdb.set_max_batch_size(10000)
+        influxdb.set_trigger_size(5000)
+    raise gen.Return(results)
+
+
+def run():
+    """Run the benchmark, returning the p50, p90 and p99 batch latency in
+    milliseconds and the number of connections opened for each backend.
+    The ``curl`` results are omitted when :mod:`pycurl` is not installed.
+
+    :rtype: dict
+
+    """
+    return ioloop.IOLoop.current().run_sync(_run, timeout=300)
+
+
+if __name__ == '__main__':
+    print(json.dumps(run(), indent=2, sort_keys=True))
@@ -0,0 +1,74 @@
+"""
+Measure the throughput of :func:`sprockets_influxdb.add_measurement` as the
+number of measurements already waiting in the buffer grows, to make sure
+adding a measurement does not slow down with the depth of the backlog.
+
+"""
+import json
+import timeit
+
+import sprockets_influxdb as influxdb
+
+COUNT = 50000
+DEPTHS = (0, 10000, 100000, 500000)
+LINE = b'my-service,hostname=host,method=GET duration=0.0123 1500000000000'
+
+
+def _measurements():
+    values = []
+    for iteration in range(0, COUNT):
+        measurement = influxdb.Measurement('requests', 'my-service')
+        measurement.set_tags({'handler': 'my_service.handlers.Handler',
+                              'method': 'GET', 'status_code': 200})
+        measurement.set_field('content_length', iteration)
+        measurement.set_field('duration', 0.0123)
+        values.append(measurement)
+    return values
+
+
+def _fill(depth):
+    """Reset the buffer so it holds ``depth`` measurements."""
+    influxdb._measurements = {'requests': influxdb._MeasurementBuffer()}
+    for _iteration in range(0, depth):
+        influxdb._measurements['requests'].append(LINE)
+    influxdb._buffer_size = depth
+
+
+def _add(measurements):
+    for measurement in measurements:
+        influxdb.add_measurement(measurement)
+
+
+def run():
+    """Run the benchmark, returning the cost in microseconds and the number
+    of measurements added per second for each buffer depth.
+
+    :rtype: dict
+
+    """
+    limit = max(DEPTHS) + COUNT + 1
+    influxdb.set_max_buffer_size(limit)
+    influxdb.set_trigger_size(limit)
+    measurements = _measurements()
+    results = {'count': COUNT, 'depths': {}}
+    for depth in DEPTHS:
+        timings = []
+        for _iteration in range(0, 3):
+            _fill(depth)
+            start = timeit.default_timer()
+            _add(measurements)
+            timings.append(timeit.default_timer() - start)
+        elapsed = min(timings)
+        results['depths'][depth] = {
+            'us_per_measurement': round(elapsed * 1e6 / COUNT, 3),
+            'measurements_per_second': int(COUNT / elapsed)}
+    influxdb._maybe_stop_timeout()
+    influxdb._measurements = {}
+    influxdb._buffer_size = 0
+    influxdb.set_max_buffer_size(25000)
+    influxdb.set_trigger_size(5000)
+    return results
+
+
+if __name__ == '__main__':
+    print(json.dumps(run(), indent=2, sort_keys=True))
@@ -0,0 +1,107 @@
+"""
+Measure the cost of marshalling measurements like those created by
+:class:`sprockets_influxdb.InfluxDBMixin`, with and without the series key
+cache, for traffic with a limited number of distinct tag sets, and the cost
+of marshalling measurements with different numbers of tags and fields.
+
+"""
+import json
+import random
+import timeit
+
+import sprockets_influxdb as influxdb
+
+COUNT = 100000
+SERIES = (100, 2000)
+SHAPES = ((0, 1), (4, 2), (4, 8), (16, 2), (16, 16))
+SHAPE_COUNT = 10000
+
+
+def _measurements(series):
+    """Return ``COUNT`` measurements spread over ``series`` distinct tag
+    sets.
+
+    """
+    random.seed(series)
+    tags = [{'handler': 'my_service.handlers.Handler{}'.format(index % 50),
+             'method': random.choice(['GET', 'POST', 'PUT']),
+             'endpoint': '/resource/{}/(?P<id>\\d+)'.format(index),
+             'status_code': random.choice([200, 204, 404])}
+            for index in range(0, series)]
+    values = []
+    for _iteration in range(0, COUNT):
+        measurement = influxdb.Measurement('requests', 'my-service')
+        measurement.set_tags(random.choice(tags))
+        measurement.set_field('content_length', random.randint(0, 4096))
+        measurement.set_field('duration', random.random() / 10)
+        values.append(measurement)
+    return values
+
+
+def _shape_measurements(tags, fields):
+    """Return ``SHAPE_COUNT`` measurements that each have their own tag set of
+    ``tags`` tags and ``fields`` fields of mixed types.
+
+    """
+    values = []
+    for iteration in range(0, SHAPE_COUNT):
+        measurement = influxdb.Measurement('requests', 'my-service')
+        for index in range(0, tags):
+            measurement.set_tag('tag{}'.format(index),
+                                'value-{}-{}'.format(index, iteration))
+        for index in range(0, fields):
+            measurement.set_field('field{}'.format(index), [
+                random.random(), random.randint(0, 1 << 20),
+                'text value', True][index % 4])
+        values.append(measurement)
+    return values
+
+
+def _marshall(measurements):
+    for measurement in measurements:
+        measurement.marshall(True)
+
+
+def run():
+    """Run the benchmark, returning the marshalling cost in microseconds
+    per measurement and the cache hit rate for each number of distinct
+    series, and the uncached marshalling cost for each number of tags and
+    fields.
+
+    :rtype: dict
+
+    """
+    influxdb._base_tags = {'environment': 'production',
+                           'hostname': 'web-1.example.com'}
+    results = {'count': COUNT, 'series': {}}
+    for series in SERIES:
+        measurements = _measurements(series)
+        result = {}
+        for key, size in [('uncached', 0), ('cached', 10000)]:
+            influxdb.set_series_cache_size(size)
+            influxdb._series_cache_hits = influxdb._series_cache_misses = 0
+            elapsed = min(timeit.repeat(
+                lambda: _marshall(measurements), repeat=3, number=1))
+            result[key] = {
+                'us_per_measurement': round(elapsed * 1e6 / COUNT, 3),
+                'hit_rate': round(
+                    influxdb._series_cache_hits /
+                    float(influxdb._series_cache_hits +
+                          influxdb._series_cache_misses), 4)}
+        results['series'][series] = result
+
+    influxdb.set_series_cache_size(0)
+    results['shapes'] = {}
+    for tags, fields in SHAPES:
+        measurements = _shape_measurements(tags, fields)
+        elapsed = min(timeit.repeat(
+            lambda: _marshall(measurements), repeat=3, number=1))
+        results['shapes']['{}_tags_{}_fields'.format(tags, fields)] = {
+            'us_per_measurement': round(elapsed * 1e6 / SHAPE_COUNT, 3)}
+    influxdb._base_tags = {}
+    influxdb.set_series_cache_size(10000)
+    return results
+
+
+if __name__ == '__main__':
+    print(json.dumps(run(), indent=2, sort_keys=True))
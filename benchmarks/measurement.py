@@ -0,0 +1,88 @@
+"""
+Measure the cost of creating measurements like those created by
+:class:`sprockets_influxdb.InfluxDBMixin` and the memory held by 100,000 of
+them, comparing :class:`sprockets_influxdb.Measurement` with a measurement
+that copies the base tags into an instance ``__dict__``.
+
+"""
+import gc
+import json
+import time
+import timeit
+try:
+    import tracemalloc
+except ImportError:  # Python 2
+    tracemalloc = None
+
+import sprockets_influxdb as influxdb
+
+BASE_TAGS = {'environment': 'production', 'hostname': 'web-1.example.com',
+             'service': 'my-service'}
+COUNT = 100000
+
+
+class _DictMeasurement(object):
+    """A measurement that copies the base tags when it is created."""
+    def __init__(self, database, name):
+        self.database = database
+        self.name = name
+        self.fields = {}
+        self.tags = dict(influxdb._base_tags)
+        self.timestamp = time.time()
+
+    def set_field(self, name, value):
+        if not any([isinstance(value, t) for t in {int, float, bool, str}]):
+            raise ValueError('Value must be a str, bool, integer, or float')
+        self.fields[name] = value
+
+    def set_tag(self, name, value):
+        self.tags[name] = value
+
+
+def _create(cls):
+    measurement = cls('requests', 'my-service')
+    measurement.set_tag('handler', 'my_service.handlers.RequestHandler')
+    measurement.set_tag('method', 'GET')
+    measurement.set_tag('endpoint', '/users/(?P<id>\\d+)')
+    measurement.set_tag('status_code', 200)
+    measurement.set_field('content_length', 1024)
+    measurement.set_field('duration', 0.0123)
+    return measurement
+
+
+def _resident_bytes(cls):
+    """Return the bytes allocated to hold ``COUNT`` measurements."""
+    if tracemalloc is None:
+        return None
+    gc.collect()
+    tracemalloc.start()
+    measurements = [_create(cls) for _iteration in range(0, COUNT)]
+    size = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    del measurements
+    return size
+
+
+def run():
+    """Run the benchmark, returning the construction cost in microseconds
+    and the memory held by ``COUNT`` measurements in megabytes.
+
+    :rtype: dict
+
+    """
+    influxdb._base_tags = dict(BASE_TAGS)
+    results = {'count': COUNT}
+    for key, cls in [('dict', _DictMeasurement),
+                     ('slots', influxdb.Measurement)]:
+        elapsed = min(timeit.repeat(
+            lambda: _create(cls), repeat=5, number=COUNT)) / COUNT
+        size = _resident_bytes(cls)
+        results[key] = {
+            'us_per_measurement': round(elapsed * 1e6, 3),
+            'mb_per_100k': round(size / 1048576.0, 2) if size else None}
+    influxdb._base_tags = {}
+    return results
+
+
+if __name__ == '__main__':
+    print(json.dumps(run(), indent=2, sort_keys=True))
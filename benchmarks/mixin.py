@@ -0,0 +1,90 @@
+"""
+Measure the per-request overhead of :class:`sprockets_influxdb.InfluxDBMixin`,
+creating a handler for a request and finishing it, compared with a plain
+:class:`tornado.web.RequestHandler`, with and without aggregating the request
+measurements.
+
+"""
+import json
+import timeit
+
+from tornado import httputil, web
+
+import sprockets_influxdb as influxdb
+
+ROUTES = 50
+
+
+class _Connection(object):
+    def set_close_callback(self, callback):
+        pass
+
+
+class _PlainHandler(web.RequestHandler):
+    pass
+
+
+class _InfluxDBHandler(influxdb.InfluxDBMixin, web.RequestHandler):
+    pass
+
+
+def _application():
+    """Return an application with ``ROUTES`` routes, the last of which is
+    routed to both handlers.
+
+    """
+    handlers = [web.url('/resource{}/(?P<id>\\d+)'.format(index),
+                        _PlainHandler) for index in range(0, ROUTES - 1)]
+    handlers.append(web.url('/users/(?P<id>\\d+)', _InfluxDBHandler))
+    return web.Application(handlers, **{influxdb.REQUEST_DATABASE: 'bench'})
+
+
+def _request(application, cls):
+    """Create a handler for a request and finish it the way
+    :class:`tornado.web.RequestHandler` does once the response is sent.
+
+    """
+    request = httputil.HTTPServerRequest(
+        'GET', '/users/100',
+        headers=httputil.HTTPHeaders({'Host': 'localhost'}),
+        connection=_Connection())
+    handler = cls(application, request)
+    handler.set_status(200)
+    handler.on_finish()
+
+
+def _per_request(application, cls):
+    return min(timeit.repeat(lambda: _request(application, cls),
+                             repeat=5, number=10000)) / 10000
+
+
+def run():
+    """Run the benchmark, returning the microseconds spent per request for
+    a plain handler and the mixin, and the overhead the mixin adds.
+
+    :rtype: dict
+
+    """
+    application = _application()
+    influxdb.set_max_buffer_size(1 << 30)
+    influxdb.set_trigger_size(1 << 30)
+    plain = _per_request(application, _PlainHandler)
+    results = {'routes': ROUTES, 'plain_us': round(plain * 1e6, 3)}
+    for key, interval in [('mixin', 0), ('aggregated', 60000)]:
+        influxdb.set_aggregation_interval(interval)
+        elapsed = _per_request(application, _InfluxDBHandler)
+        results[key] = {
+            'us_per_request': round(elapsed * 1e6, 3),
+            'overhead_us': round((elapsed - plain) * 1e6, 3)}
+        influxdb._flush_rollups(True)
+    influxdb.set_aggregation_interval(0)
+    influxdb._maybe_stop_timeout()
+    influxdb._measurements = {}
+    influxdb._buffer_size = 0
+    influxdb.set_max_buffer_size(25000)
+    influxdb.set_trigger_size(5000)
+    return results
+
+
+if __name__ == '__main__':
+    print(json.dumps(run(), indent=2, sort_keys=True))
@@ -0,0 +1,74 @@
+"""
+Measure the cost of resolving the route pattern for a request in
+:class:`sprockets_influxdb.InfluxDBMixin` for applications with many routes,
+comparing the cached patterns with matching the request against every route.
+
+"""
+import json
+import timeit
+
+from tornado import httputil, web
+
+import sprockets_influxdb as influxdb
+
+ROUTES = (10, 50, 150, 500)
+
+
+class _Connection(object):
+    def set_close_callback(self, callback):
+        pass
+
+
+def _application(routes):
+    """Return an application with ``routes`` routes, each with its own
+    handler class.
+
+    """
+    handlers = []
+    for index in range(0, routes):
+        handler = type('Handler{}'.format(index),
+                       (influxdb.InfluxDBMixin, web.RequestHandler), {})
+        handlers.append(web.url(
+            '/resource{}/(?P<id>\\d+)'.format(index), handler))
+    return web.Application(handlers, **{influxdb.REQUEST_DATABASE: 'bench'})
+
+
+def _handler(application, routes):
+    """Return a handler for a request to the last route of the
+    application.
+
+    """
+    request = httputil.HTTPServerRequest(
+        'GET', '/resource{}/100'.format(routes - 1),
+        headers=httputil.HTTPHeaders({'Host': 'localhost'}),
+        connection=_Connection())
+    return application.find_handler(request).handler_class(
+        application, request)
+
+
+def _per_request(function):
+    return min(timeit.repeat(function, repeat=5, number=1000)) / 1000
+
+
+def run():
+    """Run the benchmark, returning the microseconds spent resolving the
+    route pattern of a request for each number of routes.
+
+    :rtype: dict
+
+    """
+    results = {'routes': {}}
+    for routes in ROUTES:
+        application = _application(routes)
+        handler = _handler(application, routes)
+        results['routes'][routes] = {
+            'cached_us': round(_per_request(
+                handler._get_path_pattern_tornado45) * 1e6, 3),
+            'scan_us': round(_per_request(
+                lambda: handler._get_path_pattern_tornado45(
+                    application.default_router)) * 1e6, 3)}
+    return results
+
+
+if __name__ == '__main__':
+    print(json.dumps(run(), indent=2, sort_keys=True))
@@ -0,0 +1,74 @@
+"""
+Run the benchmarks and print their results with the versions they were run
+with as a single JSON document, so runs can be saved and compared::
+
+    python -m benchmarks.run > before.json
+    python -m benchmarks.run marshall ingest flush > after.json
+
+"""
+import argparse
+import importlib
+import json
+import platform
+import sys
+import time
+
+import tornado
+
+import sprockets_influxdb as influxdb
+
+BENCHMARKS = ('buffer', 'columnar', 'compression', 'flush', 'http_backend',
+              'ingest', 'marshall', 'measurement', 'mixin', 'routing',
+              'sketch', 'spill')
+
+
+def run(names=BENCHMARKS):
+    """Run the named benchmarks, returning their results keyed by name with
+    the seconds each benchmark took to run.
+
+    :param list names: The benchmark module names
+    :rtype: dict
+
+    """
+    results = {
+        'environment': {
+            'numpy': getattr(influxdb.numpy, '__version__', None),
+            'platform': platform.platform(),
+            'python': platform.python_version(),
+            'sprockets_influxdb': influxdb.__version__,
+            'tornado': tornado.version},
+        'benchmarks': {}}
+    for name in names:
+        module = importlib.import_module('benchmarks.{}'.format(name))
+        start = time.time()
+        result = module.run()
+        elapsed = time.time() - start
+        results['benchmarks'][name] = {'elapsed': round(elapsed, 2),
+                                       'results': result}
+        sys.stderr.write('{} done in {:.2f}s\n'.format(name, elapsed))
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description='Run the sprockets_influxdb benchmarks')
+    parser.add_argument('names', nargs='*', metavar='name',
+                        help='The benchmarks to run, any of {}. Default: '
+                             'all of them'.format(', '.join(BENCHMARKS)))
+    parser.add_argument('-o', '--output',
+                        help='Write the results to a file instead of stdout')
+    args = parser.parse_args()
+    for name in args.names:
+        if name not in BENCHMARKS:
+            parser.error('unknown benchmark: {}'.format(name))
+    output = json.dumps(run(args.names or BENCHMARKS), indent=2,
+                        sort_keys=True)
+    if args.output:
+        with open(args.output, 'w') as handle:
+            handle.write(output + '\n')
+    else:
+        print(output)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,54 @@
+"""
+Measure the per-observation cost of the quantile sketch used for aggregated
+timings, the cost of merging sketches, and the accuracy of the estimated
+quantiles against the exact quantiles of the observed values.
+
+"""
+import json
+import random
+import timeit
+
+import sprockets_influxdb as influxdb
+
+COUNT = 100000
+QUANTILES = (0.5, 0.9, 0.99, 0.999)
+
+
+def run():
+    """Run the benchmark, returning the cost of adding a value and merging
+    two sketches in microseconds, the number of buckets used, and the
+    relative error of each quantile.
+
+    :rtype: dict
+
+    """
+    random.seed(COUNT)
+    values = [random.lognormvariate(-3, 1) for _iteration in range(0, COUNT)]
+
+    def add():
+        sketch = influxdb._QuantileSketch()
+        for value in values:
+            sketch.add(value)
+        return sketch
+
+    sketch = add()
+    other = add()
+    ordered = sorted(values)
+    errors = {}
+    for quantile in QUANTILES:
+        exact = ordered[int(quantile * (COUNT - 1))]
+        errors[quantile] = round(
+            abs(sketch.quantile(quantile) - exact) / exact, 5)
+    return {
+        'count': COUNT,
+        'buckets': len(sketch.buckets),
+        'add_us': round(min(timeit.repeat(
+            add, repeat=3, number=1)) * 1e6 / COUNT, 3),
+        'merge_us': round(min(timeit.repeat(
+            lambda: influxdb._QuantileSketch().merge(other),
+            repeat=3, number=100)) * 1e6 / 100, 3),
+        'relative_errors': errors}
+
+
+if __name__ == '__main__':
+    print(json.dumps(run(), indent=2, sort_keys=True))
@@ -0,0 +1,63 @@
+"""
+Measure the throughput of spilling marshalled measurements to disk and
+replaying them in batches with :class:`sprockets_influxdb._SpillQueue`.
+
+"""
+import json
+import shutil
+import tempfile
+import timeit
+
+import sprockets_influxdb as influxdb
+
+COUNTS = (100000, 500000)
+BATCH_SIZE = 5000
+LINE = (b'my-service,endpoint=/users/(?P<id>\\d+),environment=production,'
+        b'handler=my_service.handlers.RequestHandler,hostname=web-1,'
+        b'method=GET,status_code=200 content_length=1024i,duration=0.0123 '
+        b'1500000000000')
+
+
+def _spill_and_replay(count):
+    """Spill and then replay ``count`` measurements, returning the seconds
+    spent on each.
+
+    """
+    directory = tempfile.mkdtemp()
+    try:
+        queue = influxdb._SpillQueue(directory)
+        start = timeit.default_timer()
+        for _iteration in range(0, count):
+            queue.append(LINE)
+        queue.close()
+        spilled = timeit.default_timer()
+        while queue:
+            queue.read(BATCH_SIZE)
+        return spilled - start, timeit.default_timer() - spilled
+    finally:
+        shutil.rmtree(directory)
+
+
+def run():
+    """Run the benchmark, returning the spill and replay throughput in
+    measurements and megabytes per second.
+
+    :rtype: dict
+
+    """
+    results = {'batch_size': BATCH_SIZE, 'counts': {}}
+    megabytes = (len(LINE) + 1) / 1048576.0
+    for count in COUNTS:
+        timings = [_spill_and_replay(count) for _iteration in range(0, 3)]
+        spill = min(timing[0] for timing in timings)
+        replay = min(timing[1] for timing in timings)
+        results['counts'][count] = {
+            'spill_per_second': int(count / spill),
+            'spill_mb_per_second': round(count * megabytes / spill, 1),
+            'replay_per_second': int(count / replay),
+            'replay_mb_per_second': round(count * megabytes / replay, 1)}
+    return results
+
+
+if __name__ == '__main__':
+    print(json.dumps(run(), indent=2, sort_keys=True))
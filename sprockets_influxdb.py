@@ -14,38 +14,94 @@ measurements is only started when there isn't an active timer, there is not a
 batch currently being written, and a measurement is added to the buffer.
 
 """
+import bisect
+import collections
+import binascii
 import contextlib
+import functools
 import logging
+import math
+import mmap
 import os
 import random
 import select
 import socket
 import ssl
+import struct
 import time
 import uuid
+import weakref
+import zlib
 
 try:
-    from tornado import concurrent, httpclient, ioloop
+    from tornado import (concurrent, gen, httpclient, httputil, ioloop,
+                         iostream, netutil)
 except ImportError:  # pragma: no cover
     logging.critical('Could not import Tornado')
-    concurrent, httpclient, ioloop = None, None, None
+    concurrent, gen, httpclient, httputil, ioloop, iostream, netutil = \
+        None, None, None, None, None, None, None
 
 try:
     from tornado import routing
 except ImportError:  # Not needed for Tornado<4.5
     pass
 
+try:
+    from tornado import version_info as _tornado_version
+except ImportError:  # pragma: no cover
+    _tornado_version = ()
+
+try:
+    import asyncio
+except ImportError:  # Python<3.4, where IOLoops do not run on asyncio
+    asyncio = None
+
+try:
+    import numpy
+except ImportError:  # Only needed for NumPy arrays in columnar measurements
+    numpy = None
+
+try:
+    import pycurl
+    from tornado import curl_httpclient
+except ImportError:  # Only needed for the curl HTTP backend
+    curl_httpclient, pycurl = None, None
+
+try:
+    from time import perf_counter as _timer
+except ImportError:  # Python<3.3
+    from time import time as _timer
+
+try:
+    from threading import get_ident as _thread_ident
+except ImportError:  # Python<3.3
+    from thread import get_ident as _thread_ident
+
+try:
+    from time import time_ns as _time_ns
+except ImportError:  # Python<3.7
+    def _time_ns():
+        return int(time.time() * 1000000000)
+
 
 version_info = (2, 2, 1)
 __version__ = '.'.join(str(v) for v in version_info)
-__all__ = ['__version__', 'version_info', 'add_measurement', 'flush',
-           'install', 'shutdown', 'Measurement']
+__all__ = ['__version__', 'version_info', 'add_measurement',
+           'add_measurements_columnar', 'circuit_state', 'flush', 'install',
+           'shutdown', 'start_sender', 'stats', 'Measurement']
 
 LOGGER = logging.getLogger(__name__)
 
 REQUEST_DATABASE = 'sprockets_influxdb.database'
 USER_AGENT = 'sprockets-influxdb/v{}'.format(__version__)
 
+CIRCUIT_CLOSED = 'closed'
+CIRCUIT_HALF_OPEN = 'half-open'
+CIRCUIT_OPEN = 'open'
+
+ROUTING_DATABASE = 'database'
+ROUTING_SERIES = 'series'
+
 try:
     TimeoutError
 except NameError:  # Python 2.7 compatibility
@@ -53,25 +109,78 @@ except NameError:  # Python 2.7 compatibility
         pass
 
 
+_aggregation_interval = 0
+_backoff_interval = 1000
 _base_tags = {}
 _base_url = 'http://localhost:8086/write'
 _batch_future = None
 _buffer_size = 0
+_circuit_breakers = {}
+_compression_level = 0
+_compression_threshold = 1024
 _credentials = None, None
 _dirty = False
 _enabled = True
+_endpoint_backlog = collections.Counter()
+_endpoint_in_flight = collections.Counter()
+_failure_threshold = 3
+_http_backend = 'simple'
 _http_client = None
+_http_client_requests = collections.Counter()
+_http_clients = {}
+_in_flight = {}
+_in_flight_total = 0
+_install_thread = None
 _installed = False
+_io_loop = None
+_io_loop_thread = None
 _last_warning = None
+_database_precisions = {}
 _measurements = {}
+_max_backoff_interval = 60000
 _max_batch_size = 10000
 _max_buffer_size = 25000
 _max_clients = 10
+_max_inflight_batches = 10
+_max_latency = 0
+_max_series_cache_size = 10000
+_max_spill_bytes = 268435456
+_precision = 'ms'
+_precision_configured = False
+_precision_divisors = {'ns': 1, 'us': 1000, 'ms': 1000000, 's': 1000000000}
+_rejected_callback = None
+_replicas = []
+_retired_http_clients = set()
+_ring = []
+_ring_points = []
+_rollup_timeout = None
+_rollups = {}
+_route_patterns = weakref.WeakKeyDictionary()
+_routing = ROUTING_DATABASE
 _sample_probability = 1.0
+_sender_socket = None
+_sender_transport = None
+_series_cache = collections.OrderedDict()
+_series_cache_hits = 0
+_series_cache_misses = 0
+_spill_bytes = 0
+_spill_directory = None
+_spill_size = 0
+_spills = {}
+_stats = collections.Counter()
+_stats_database = None
+_stats_durations = {}
+_stats_interval = 60000
+_stats_timeout = None
 _stopping = False
+_tag_key_orders = {}
+_thread_queue = collections.deque()
+_thread_queue_scheduled = False
 _timeout_interval = 60000
 _timeout = None
 _trigger_size = 5000
+_udp_transport = None
+_urls = []
 _warn_threshold = 15000
 _writing = False
 
@@ -123,6 +232,10 @@ class InfluxDBMixin(object):
 
         :rtype: str
         """
+        pattern = _path_patterns_tornado4(self.application).get(
+            self.__class__)
+        if pattern:
+            return pattern
         for host, handlers in self.application.handlers:
             if host.match(self.request.host):
                 for handler in handlers:
@@ -138,6 +251,10 @@ class InfluxDBMixin(object):
         :rtype: str
         """
         if router is None:
+            pattern = _path_patterns_tornado45(self.application).get(
+                self.__class__)
+            if pattern:
+                return pattern
             router = self.application.default_router
         for rule in router.rules:
             if rule.matcher.match(self.request) is not None:
@@ -151,9 +268,13 @@ class InfluxDBMixin(object):
             self.influxdb.set_field(
                 'content_length', int(self._headers.get('Content-Length', 0)))
             self.influxdb.set_field('duration', self.request.request_time())
+            self.influxdb._add_duration('duration')
             self.influxdb.set_tag('status_code', self._status_code)
-            self.influxdb.set_tag('remote_ip', self.request.remote_ip)
-            add_measurement(self.influxdb)
+            if _aggregation_interval:
+                _aggregate_measurement(self.influxdb)
+            else:
+                self.influxdb.set_tag('remote_ip', self.request.remote_ip)
+                add_measurement(self.influxdb)
 
 
 def add_measurement(measurement):
@@ -172,44 +293,156 @@ def add_measurement(measurement):
 
         influxdb.add_measurement(measurement)
 
+    Measurements may be added from any thread. Measurements added on a
+    thread other than the IOLoop's are queued and added to the buffer on the
+    IOLoop, see :meth:`~sprockets_influxdb.set_io_loop`.
+
     :param :class:`~sprockets_influxdb.Measurement` measurement: The
         measurement to add to the buffer for submission to InfluxDB.
+    :raises: ValueError
+    :raises: RuntimeError
 
     """
-    global _buffer_size
-
     if not _enabled:
         LOGGER.debug('Discarding measurement for %s while not enabled',
                      measurement.database)
         return
 
+    if not measurement.fields:
+        raise ValueError('Measurement does not contain a field')
+
+    if _install_thread is not None and _thread_ident() != _io_loop_thread \
+            and not _on_io_loop():
+        return _add_from_thread(measurement)
+    _buffer_measurement(measurement)
+
+
+def add_measurements_columnar(database, name, tags, fields, timestamps=None):
+    """Add measurements that are stored as columns of field values to the
+    submission buffer, marshalling them in bulk instead of creating a
+    :class:`~sprockets_influxdb.Measurement` for each row. Columns may be
+    lists, tuples, or NumPy arrays. Each value is marshalled with the same
+    type rules as :meth:`~sprockets_influxdb.Measurement.set_field`, so the
+    field types do not depend on how the column is stored.
+
+    Example:
+
+    .. code:: python
+
+        import sprockets_influxdb as influxdb
+
+        influxdb.add_measurements_columnar(
+            'example', 'measurement-name',
+            {'host': 'db-1', 'table': ['users', 'orders', 'users']},
+            {'duration': [0.05, 0.12, 0.08], 'rows': [10, 25, 3]},
+            timestamps=[1500000000.0, 1500000001.0, 1500000002.0])
+
+    :param str database: The database name to use when submitting
+    :param str name: The measurement name
+    :param dict tags: Tag values, either a single value used for every row
+        or a column with a value for each row. The base tags are included.
+    :param dict fields: A column of values for each field name
+    :param timestamps: The timestamp for each row in seconds since the
+        epoch, or a NumPy ``datetime64`` array. Defaults to the current time
+        for every row, so rows in the same series overwrite each other.
+    :raises: ValueError
+    :raises: RuntimeError
+
+    When called on a thread other than the IOLoop's, the measurements are
+    marshalled and added to the buffer on the IOLoop.
+
+    """
+    global _buffer_size
+
+    if not _enabled:
+        LOGGER.debug('Discarding columnar measurements for %s while not '
+                     'enabled', database)
+        return
+
     if _stopping:
-        LOGGER.warning('Discarding measurement for %s while stopping',
-                       measurement.database)
+        LOGGER.warning('Discarding columnar measurements for %s while '
+                       'stopping', database)
+        _stats['measurements_dropped'] += len(next(iter(fields.values()), ()))
         return
 
-    if _buffer_size > _max_buffer_size:
-        LOGGER.warning('Discarding measurement due to buffer size limit')
+    if not fields:
+        raise ValueError('Measurements do not contain a field')
+
+    lengths = set(len(values) for values in fields.values())
+    if timestamps is not None:
+        lengths.add(len(timestamps))
+    tags, values = dict(_base_tags), tags
+    tags.update(values or {})
+    columns = dict((key, value) for key, value in tags.items()
+                   if isinstance(value, (list, tuple)) or
+                   (numpy is not None and isinstance(value, numpy.ndarray)))
+    lengths.update(len(values) for values in columns.values())
+    if len(lengths) != 1:
+        raise ValueError('Columns must all be the same length')
+    count = lengths.pop()
+    if not count:
+        return
+    elif _install_thread is not None and \
+            _thread_ident() != _io_loop_thread and not _on_io_loop():
+        _io_loop.add_callback(functools.partial(
+            add_measurements_columnar, database, name, values, fields,
+            timestamps))
         return
 
-    if not measurement.fields:
-        raise ValueError('Measurement does not contain a field')
+    # Build the series key for each row, or once if the tags are constant
+    keys = _sorted_tag_keys(frozenset(tags))
+    if columns:
+        prefixes = [
+            _series_key(name, [(key, row[key] if key in row else tags[key])
+                               for key in keys])
+            for row in [dict(zip(columns, values))
+                        for values in zip(*columns.values())]]
+    else:
+        prefixes = _series_key(name, [(key, tags[key]) for key in keys])
+
+    divisor = _precision_divisors[_database_precisions.get(database,
+                                                           _precision)]
+    start = _timer()
+    lines = _columnar_lines(prefixes, fields, timestamps, count, divisor)
+    _record_duration('marshall', (_timer() - start) / count)
+    _stats['measurements_added'] += count
+
+    # Buffer as many rows as there is room for, spilling or discarding the
+    # rest, and spill every row if the database has spilled measurements
+    room = 0 if _spills.get(database) else \
+        max(min(count, _max_buffer_size - _buffer_size), 0)
+    if room:
+        _buffer_body(database,
+                     '\n'.join(lines[:room]).encode('utf-8') + b'\n')
+        _buffer_size += room
+    if room < count:
+        if not _spill_directory:
+            LOGGER.warning('Discarding %i measurements due to buffer size '
+                           'limit', count - room)
+            _stats['measurements_dropped'] += count - room
+        else:
+            for index, line in enumerate(lines[room:]):
+                if not _spill_measurement(database, line.encode('utf-8')):
+                    _stats['measurements_dropped'] += count - room - index
+                    break
 
-    if measurement.database not in _measurements:
-        _measurements[measurement.database] = []
+    _maybe_trigger_batch_write()
 
-    value = measurement.marshall()
-    _measurements[measurement.database].append(value)
 
-    # Ensure that len(measurements) < _trigger_size are written
-    if not _timeout:
-        if (_batch_future and _batch_future.done()) or not _batch_future:
-            _start_timeout()
+def circuit_state(url=None):
+    """Return the state of the circuit breaker for an InfluxDB endpoint,
+    one of :data:`CIRCUIT_CLOSED`, :data:`CIRCUIT_HALF_OPEN`, or
+    :data:`CIRCUIT_OPEN`.
 
-    # Check to see if the batch should be triggered
-    _buffer_size = _pending_measurements()
-    if _buffer_size >= _trigger_size:
-        _trigger_batch_write()
+    While the circuit is open, batch submission is paused. Once the backoff
+    interval has passed, the circuit is half-open and a single probe batch
+    is submitted, closing the circuit if it succeeds.
+
+    :param str url: The endpoint URL. Defaults to the configured base URL.
+    :rtype: str
+
+    """
+    return _circuit_breaker(url).state(ioloop.IOLoop.current().time())
 
 
 def flush():
@@ -235,13 +468,24 @@ def flush():
 def install(url=None, auth_username=None, auth_password=None,
             submission_interval=None, max_batch_size=None, max_clients=10,
             base_tags=None, max_buffer_size=None, trigger_size=None,
-            sample_probability=1.0):
+            sample_probability=1.0, max_inflight_batches=None,
+            compression=None, compression_threshold=None,
+            backoff_interval=None, max_backoff_interval=None,
+            failure_threshold=None, spill_directory=None,
+            max_spill_bytes=None, series_cache_size=None, precision=None,
+            aggregation_interval=None, stats_database=None,
+            stats_interval=None, http_backend=None, urls=None,
+            routing=None, replicas=None, max_latency=None):
     """Call this to install/setup the InfluxDB client collector. All arguments
     are optional.
 
     :param str url: The InfluxDB API URL. If URL is not specified, the
         ``INFLUXDB_SCHEME``, ``INFLUXDB_HOST`` and ``INFLUXDB_PORT``
-        environment variables will be used to construct the base URL. Default:
+        environment variables will be used to construct the base URL. Use a
+        ``udp://host:port`` URL to send measurements to an InfluxDB UDP
+        listener instead of the HTTP API, or a ``unix:///path`` URL to
+        forward measurements to a sender process started with
+        :meth:`~sprockets_influxdb.start_sender`. Default:
         ``http://localhost:8086/write``
     :param str auth_username: A username to use for InfluxDB authentication. If
         not specified, the ``INFLUXDB_USER`` environment variable will
@@ -265,6 +509,55 @@ def install(url=None, auth_username=None, auth_password=None,
         are in the buffer before a batch can be submitted. Default: ``5000``
     :param float sample_probability: Value between 0 and 1.0 specifying the
         probability that a batch will be submitted (0.25 == 25%)
+    :param int max_inflight_batches: The number of batch submissions for a
+        single database that may be made at any given time, bounded by
+        ``max_clients``. Default: ``10``
+    :param int|bool compression: The gzip compression level (``1`` - ``9``)
+        to compress batch submissions with, or :data:`True` to use the
+        default level of ``6``. Default: ``None`` (disabled)
+    :param int compression_threshold: The minimum size of a batch in bytes
+        before it is compressed. Default: ``1024``
+    :param int backoff_interval: The number of milliseconds to wait before
+        retrying after a failed batch submission, doubled for each
+        consecutive failure. Default: ``1000``
+    :param int max_backoff_interval: The maximum number of milliseconds to
+        wait before retrying after failed batch submissions.
+        Default: ``60000``
+    :param int failure_threshold: The number of consecutive failed batch
+        submissions that open the circuit breaker, pausing submission
+        until a probe batch succeeds. Default: ``3``
+    :param str spill_directory: A directory to spill measurements to when
+        the buffer is full, instead of discarding them. Default: ``None``
+    :param int max_spill_bytes: The maximum number of bytes of spilled
+        measurements on disk before new measurements are discarded.
+        Default: ``268435456``
+    :param int series_cache_size: The number of distinct measurement name
+        and tag combinations to cache the marshalled series key for.
+        Default: ``10000``
+    :param str precision: The precision of measurement timestamps, one of
+        ``s``, ``ms``, ``us`` or ``ns``. Default: ``ms``, or ``ns`` for a
+        ``udp://`` URL, since the InfluxDB UDP listener expects nanosecond
+        timestamps unless its ``precision`` setting is configured
+    :param int aggregation_interval: The number of milliseconds to aggregate
+        :class:`~sprockets_influxdb.InfluxDBMixin` request measurements over,
+        submitting one measurement per series for each interval. Default:
+        ``0`` (disabled)
+    :param str stats_database: The database to periodically add a
+        ``sprockets_influxdb`` measurement with the client stats to.
+        Default: ``None`` (disabled)
+    :param int stats_interval: The number of milliseconds between stats
+        measurements. Default: ``60000``
+    :param str http_backend: The HTTP client to submit batches with,
+        ``simple`` or ``curl`` for a pool of keep-alive connections. The
+        ``curl`` backend requires ``pycurl``. Default: ``simple``
+    :param list urls: The write URLs of multiple InfluxDB endpoints to shard
+        writes across instead of ``url``. Default: ``None``
+    :param str routing: How measurements are routed to the ``urls``,
+        ``database`` or ``series``. Default: ``database``
+    :param list replicas: The write URLs of replicas to fail writes over to
+        while ``url`` is degraded. Default: ``None``
+    :param int max_latency: The smoothed response latency in milliseconds
+        over which an endpoint is degraded. Default: ``0`` (disabled)
     :returns: :data:`True` if the client was installed by this call
         and :data:`False` otherwise.
 
@@ -272,9 +565,14 @@ def install(url=None, auth_username=None, auth_password=None,
     be masked in the Python process.
 
     """
-    global _base_tags, _base_url, _credentials, _enabled, _installed, \
+    global _aggregation_interval, _backoff_interval, _base_tags, _base_url, \
+        _compression_level, _compression_threshold, _credentials, _enabled, \
+        _failure_threshold, _http_backend, _installed, _max_backoff_interval, \
         _max_batch_size, _max_buffer_size, _max_clients, \
-        _sample_probability, _timeout, _timeout_interval, _trigger_size
+        _max_inflight_batches, _max_series_cache_size, _max_spill_bytes, \
+        _precision, _precision_configured, _sample_probability, \
+        _stats_database, _stats_interval, _timeout, _timeout_interval, \
+        _trigger_size
 
     _enabled = os.environ.get('INFLUXDB_ENABLED', 'true') == 'true'
     if not _enabled:
@@ -304,6 +602,9 @@ def install(url=None, auth_username=None, auth_password=None,
     _max_batch_size = max_batch_size or \
         int(os.environ.get('INFLUXDB_MAX_BATCH_SIZE', _max_batch_size))
     _max_clients = max_clients
+    _max_inflight_batches = max_inflight_batches or \
+        int(os.environ.get('INFLUXDB_MAX_INFLIGHT_BATCHES',
+                           _max_inflight_batches))
     _max_buffer_size = max_buffer_size or \
         int(os.environ.get('INFLUXDB_MAX_BUFFER_SIZE', _max_buffer_size))
     _sample_probability = sample_probability or \
@@ -311,8 +612,76 @@ def install(url=None, auth_username=None, auth_password=None,
                              _sample_probability))
     _trigger_size = trigger_size or \
         int(os.environ.get('INFLUXDB_TRIGGER_SIZE', _trigger_size))
-
-    # Set the base tags
+    if precision or os.environ.get('INFLUXDB_PRECISION'):
+        _precision = precision or os.environ['INFLUXDB_PRECISION']
+        _precision_configured = True
+    elif not _precision_configured:
+        _precision = _default_precision(_base_url)
+    if _precision not in _precision_divisors:
+        raise ValueError('Invalid precision: {!r}'.format(_precision))
+
+    # HTTP client
+    _http_backend = _http_backend_value(
+        http_backend or os.environ.get('INFLUXDB_HTTP_BACKEND', _http_backend))
+
+    # Batch compression
+    _compression_level = _compression_level_value(
+        compression if compression is not None else
+        os.environ.get('INFLUXDB_COMPRESSION', _compression_level))
+    _compression_threshold = compression_threshold or \
+        int(os.environ.get('INFLUXDB_COMPRESSION_THRESHOLD',
+                           _compression_threshold))
+
+    # Retry backoff and circuit breaker
+    _backoff_interval = backoff_interval or \
+        int(os.environ.get('INFLUXDB_BACKOFF_INTERVAL', _backoff_interval))
+    _max_backoff_interval = max_backoff_interval or \
+        int(os.environ.get('INFLUXDB_MAX_BACKOFF_INTERVAL',
+                           _max_backoff_interval))
+    _failure_threshold = failure_threshold or \
+        int(os.environ.get('INFLUXDB_FAILURE_THRESHOLD', _failure_threshold))
+
+    # Spilling measurements to disk when the buffer is full
+    _max_spill_bytes = max_spill_bytes or \
+        int(os.environ.get('INFLUXDB_MAX_SPILL_BYTES', _max_spill_bytes))
+    spill_directory = spill_directory or \
+        os.environ.get('INFLUXDB_SPILL_DIRECTORY')
+    if spill_directory:
+        set_spill_directory(spill_directory)
+
+    # Aggregating mixin request measurements
+    _aggregation_interval = aggregation_interval or \
+        int(os.environ.get('INFLUXDB_AGGREGATION_INTERVAL',
+                           _aggregation_interval))
+
+    # Reporting the client stats
+    _stats_database = stats_database or \
+        os.environ.get('INFLUXDB_STATS_DATABASE', _stats_database)
+    _stats_interval = stats_interval or \
+        int(os.environ.get('INFLUXDB_STATS_INTERVAL', _stats_interval))
+
+    # Sharding writes across multiple endpoints
+    urls = urls or [url for url in
+                    os.environ.get('INFLUXDB_URLS', '').split(',') if url]
+    if urls:
+        set_urls(urls, routing or os.environ.get('INFLUXDB_ROUTING'))
+
+    # Failing writes over to replicas
+    replicas = replicas or [
+        url for url in os.environ.get('INFLUXDB_REPLICAS', '').split(',')
+        if url]
+    if replicas:
+        set_replicas(replicas, max_latency or int(
+            os.environ.get('INFLUXDB_MAX_LATENCY', _max_latency)))
+
+    # Caching marshalled series keys
+    _max_series_cache_size = series_cache_size or \
+        int(os.environ.get('INFLUXDB_SERIES_CACHE_SIZE',
+                           _max_series_cache_size))
+
+    # Set the base tags, replacing the dict instead of changing it in place
+    # since measurements reference the base tags when they are created
+    _base_tags = dict(_base_tags)
     if os.environ.get('INFLUXDB_TAG_HOSTNAME', 'true') == 'true':
         _base_tags.setdefault('hostname', socket.gethostname())
     if os.environ.get('ENVIRONMENT'):
@@ -322,6 +691,9 @@ def install(url=None, auth_username=None, auth_password=None,
     # Seed the random number generator for batch sampling
     random.seed()
 
+    # Queue measurements added on other threads for the IOLoop that runs
+    set_io_loop()
+
     # Don't let this run multiple times
     _installed = True
 
@@ -331,6 +703,27 @@ def install(url=None, auth_username=None, auth_password=None,
     return True
 
 
+def set_aggregation_interval(milliseconds):
+    """Set the number of milliseconds to aggregate
+    :class:`~sprockets_influxdb.InfluxDBMixin` request measurements over.
+    Instead of submitting a measurement for each request, the count and the
+    sum, minimum, and maximum of each numeric field are kept for each series
+    and submitted as a single measurement at the end of the interval. Setting
+    the interval to ``0`` disables aggregation.
+
+    Requests handled on other threads, each with its own IOLoop, are
+    aggregated on the IOLoop set with
+    :meth:`~sprockets_influxdb.set_io_loop`, so the measurements of a series
+    are combined into a single rollup.
+
+    :param int milliseconds: The aggregation interval
+
+    """
+    global _aggregation_interval
+
+    _aggregation_interval = milliseconds
+
+
 def set_auth_credentials(username, password):
     """Override the default authentication credentials obtained from the
     environment variable configuration.
@@ -346,20 +739,126 @@ def set_auth_credentials(username, password):
     _dirty = True
 
 
+def set_backoff(interval, max_interval=None, failure_threshold=None):
+    """Set the retry backoff for failed batch submissions and the number of
+    consecutive failures that open the circuit breaker.
+
+    :param int interval: The number of milliseconds to wait before retrying
+        after a failed batch submission, doubled for each consecutive failure
+    :param int max_interval: The maximum number of milliseconds to wait
+    :param int failure_threshold: The number of consecutive failures that
+        open the circuit breaker
+
+    """
+    global _backoff_interval, _failure_threshold, _max_backoff_interval
+
+    LOGGER.debug('Setting backoff interval to %i ms', interval)
+    _backoff_interval = interval
+    if max_interval is not None:
+        LOGGER.debug('Setting maximum backoff interval to %i ms',
+                     max_interval)
+        _max_backoff_interval = max_interval
+    if failure_threshold is not None:
+        LOGGER.debug('Setting circuit breaker failure threshold to %i',
+                     failure_threshold)
+        _failure_threshold = failure_threshold
+
+
 def set_base_url(url):
     """Override the default base URL value created from the environment
     variable configuration.
 
-    :param str url: The base URL to use when submitting measurements
+    The InfluxDB UDP listener expects nanosecond timestamps unless its
+    ``precision`` setting is configured, so unless a precision was set, the
+    precision is ``ns`` for a ``udp://`` URL and ``ms`` otherwise.
+
+    :param str url: The base URL to use when submitting measurements, or a
+        ``udp://host:port`` URL for an InfluxDB UDP listener
 
     """
-    global _base_url, _dirty
+    global _base_url, _dirty, _precision
 
     LOGGER.debug('Setting base URL to %s', url)
     _base_url = url
+    if not _precision_configured:
+        _precision = _default_precision(url)
+    _dirty = True
+
+
+def set_compression(level, threshold=None):
+    """Set the gzip compression level used for batch submissions. A level
+    of ``0`` or :data:`False` disables compression.
+
+    :param int|bool level: The compression level (``1`` - ``9``), or
+        :data:`True` for the default level of ``6``
+    :param int threshold: The minimum size of a batch in bytes before it is
+        compressed
+    :raises: ValueError
+
+    """
+    global _compression_level, _compression_threshold
+
+    _compression_level = _compression_level_value(level)
+    LOGGER.debug('Setting compression level to %i', _compression_level)
+    if threshold is not None:
+        LOGGER.debug('Setting compression threshold to %i bytes', threshold)
+        _compression_threshold = threshold
+
+
+def set_http_backend(backend):
+    """Set the HTTP client used to submit batches, either ``simple`` for
+    Tornado's :class:`~tornado.simple_httpclient.SimpleAsyncHTTPClient`,
+    which opens a new connection for each request, or ``curl`` for
+    :class:`~tornado.curl_httpclient.CurlAsyncHTTPClient`, which keeps a pool
+    of up to ``max_clients`` keep-alive connections to InfluxDB and
+    pipelines requests on them where libcurl supports it. The ``curl``
+    backend requires :mod:`pycurl`.
+
+    The new client is used for the next batch that is submitted, while the
+    requests that are in flight are completed by the previous client.
+
+    :param str backend: The HTTP backend, ``simple`` or ``curl``
+    :raises: ValueError
+
+    """
+    global _dirty, _http_backend
+
+    _http_backend = _http_backend_value(backend)
+    LOGGER.debug('Setting HTTP backend to %s', _http_backend)
     _dirty = True
 
 
+def set_io_loop(io_loop=None):
+    """Set the IOLoop that measurements are buffered and submitted on. This
+    is invoked by :meth:`~sprockets_influxdb.install` without an IOLoop.
+
+    Measurements added on other threads, such as the workers of a
+    :class:`~concurrent.futures.ThreadPoolExecutor`, are appended to a
+    thread-safe queue that is drained on the IOLoop by a single callback,
+    so they are marshalled and buffered without locking the buffers.
+
+    The thread the IOLoop runs on is recorded once it is running. Without
+    an IOLoop, the current IOLoop is used if it is running, otherwise the
+    IOLoop that is running when measurements are first added or submitted
+    on it, such as the event loop started by :func:`asyncio.run`. Until
+    then, measurements may only be added on the thread this was invoked on,
+    and adding them on other threads raises :exc:`RuntimeError`. This is
+    also the case in child processes after a fork, where the IOLoop is
+    resolved again from the IOLoop that runs in the child.
+
+    :param tornado.ioloop.IOLoop io_loop: The IOLoop. Defaults to the
+        IOLoop that runs.
+
+    """
+    global _install_thread, _io_loop, _io_loop_thread
+
+    _install_thread = _thread_ident()
+    _io_loop = io_loop or ioloop.IOLoop.current(
+        instance=_tornado_version < (5, 0))
+    _io_loop_thread = None
+    _resolve_io_loop()
+
+
 def set_max_batch_size(limit):
     """Set a limit to the number of measurements that are submitted in
     a single batch that is submitted per databases.
@@ -401,6 +900,92 @@ def set_max_clients(limit):
     _max_clients = limit
 
 
+def set_max_inflight_batches(limit):
+    """Set the maximum number of simultaneous batch submissions that can
+    execute in parallel for a single database. The total number of
+    simultaneous batch submissions is still limited by
+    :meth:`~sprockets_influxdb.set_max_clients`.
+
+    :param int limit: The maximum number of simultaneous batch submissions
+        per database
+
+    """
+    global _max_inflight_batches
+
+    LOGGER.debug('Setting maximum in-flight batches per database to %i',
+                 limit)
+    _max_inflight_batches = limit
+
+
+def set_precision(precision, database=None):
+    """Set the precision of measurement timestamps, either for all databases
+    or for a single database. The precision is applied when a measurement is
+    added to the buffer, so it should be set before measurements are added.
+
+    :param str precision: One of ``s``, ``ms``, ``us`` or ``ns``
+    :param str database: The database to set the precision for. Defaults to
+        setting the precision for all databases without their own precision.
+    :raises: ValueError
+
+    """
+    global _precision, _precision_configured
+
+    if precision not in _precision_divisors:
+        raise ValueError('Invalid precision: {!r}'.format(precision))
+    elif database is None:
+        _precision = precision
+        _precision_configured = True
+    else:
+        _database_precisions[database] = precision
+
+
+def set_rejected_measurement_callback(callback):
+    """Set a callback to be invoked for each measurement that is rejected by
+    InfluxDB as invalid. The callback is invoked with the database name, the
+    marshalled measurement, and the body of the error response from
+    InfluxDB.
+
+    :param callable callback: The callback, or :data:`None` to remove it
+
+    """
+    global _rejected_callback
+
+    LOGGER.debug('Setting rejected measurement callback to %r', callback)
+    _rejected_callback = callback
+
+
+def set_replicas(urls, max_latency=None):
+    """Fail batches for the base URL over to replicas of the InfluxDB
+    database, or relays in front of them, while the base URL is degraded.
+    The health of each endpoint is tracked passively from the errors and
+    response latency of the batches submitted to it.
+
+    Once a batch submission to the base URL fails, or its response latency
+    is over ``max_latency``, the batches are submitted to the healthy
+    replicas, weighted by their response latency. Probe batches are still
+    submitted to the base URL, and batches are submitted to it again once a
+    probe batch shows it is healthy. Replicas are not used for sharded or
+    UDP writes.
+
+    :param list urls: The write URLs of the replicas, or :data:`None` to
+        disable failover
+    :param int max_latency: The smoothed response latency in milliseconds
+        over which an endpoint is degraded. Default: ``0`` (disabled)
+    :raises: ValueError
+
+    """
+    global _max_latency, _replicas
+
+    urls = list(urls or [])
+    if any(url.startswith(('udp://', 'unix://')) for url in urls):
+        raise ValueError('Writes can only fail over to HTTP endpoints')
+
+    LOGGER.debug('Failing writes over to %r', urls)
+    _replicas = urls
+    if max_latency is not None:
+        _max_latency = max_latency
+
+
 def set_sample_probability(probability):
     """Set the probability that a batch will be submitted to the InfluxDB
     server. This should be a value that is greater than or equal to ``0`` and
@@ -420,6 +1005,64 @@ def set_sample_probability(probability):
     _sample_probability = float(probability)
 
 
+def set_series_cache_size(limit):
+    """Set the number of distinct measurement name and tag combinations to
+    cache the marshalled series key for. Setting the limit to ``0`` disables
+    the cache.
+
+    :param int limit: The maximum number of cached series keys
+
+    """
+    global _max_series_cache_size
+
+    _max_series_cache_size = limit
+    while len(_series_cache) > max(limit, 0):
+        _series_cache.popitem(last=False)
+
+
+def set_spill_directory(directory, max_bytes=None):
+    """Set the directory that measurements are spilled to when the buffer is
+    full. Spilled measurements are appended to segment files on disk and are
+    added back to the buffer in order as batches are submitted. Measurements
+    left in the directory by a previous process are submitted as well.
+
+    :param str directory: The directory to spill measurements to, or
+        :data:`None` to discard measurements when the buffer is full
+    :param int max_bytes: The maximum number of bytes of spilled measurements
+        on disk before new measurements are discarded
+
+    """
+    global _max_spill_bytes, _spill_directory
+
+    LOGGER.debug('Setting spill directory to %s', directory)
+    _spill_directory = directory
+    if max_bytes is not None:
+        LOGGER.debug('Setting maximum spill size to %i bytes', max_bytes)
+        _max_spill_bytes = max_bytes
+    if directory:
+        _load_spills()
+
+
+def set_stats_reporting(database, interval=None):
+    """Periodically add a ``sprockets_influxdb`` measurement with the values
+    returned by :func:`~sprockets_influxdb.stats` to a database.
+
+    :param str database: The database to add the measurement to, or
+        :data:`None` to disable reporting
+    :param int interval: The number of milliseconds between measurements
+
+    """
+    global _stats_database, _stats_interval
+
+    LOGGER.debug('Setting stats reporting database to %s', database)
+    _stats_database = database
+    if interval is not None:
+        LOGGER.debug('Setting stats reporting interval to %i ms', interval)
+        _stats_interval = interval
+    _maybe_stop_stats_timeout()
+    _maybe_start_stats_timeout()
+
+
 def set_timeout(milliseconds):
     """Override the maximum duration to wait for submitting measurements to
     InfluxDB.
@@ -448,6 +1091,50 @@ def set_trigger_size(limit):
     _trigger_size = limit
 
 
+def set_urls(urls, routing=None):
+    """Shard writes across multiple InfluxDB endpoints, routing the
+    measurements for each database, or for each series with
+    :data:`ROUTING_SERIES`, to an endpoint with consistent hashing. Each
+    endpoint has its own buffers, HTTP client, ``max_clients`` limit, and
+    circuit breaker, so a slow endpoint does not hold up the others.
+
+    :param list urls: The write URLs of the endpoints, or :data:`None` to
+        write to the base URL
+    :param str routing: :data:`ROUTING_DATABASE` to route measurements by
+        database or :data:`ROUTING_SERIES` to route them by series key
+    :raises: ValueError
+
+    """
+    global _base_url, _dirty, _ring, _ring_points, _routing, _urls
+
+    urls = list(urls or [])
+    if routing not in (None, ROUTING_DATABASE, ROUTING_SERIES):
+        raise ValueError('Invalid routing policy: {!r}'.format(routing))
+    elif any(url.startswith(('udp://', 'unix://')) for url in urls):
+        raise ValueError('Writes can only be sharded across HTTP endpoints')
+
+    LOGGER.debug('Sharding writes across %r', urls)
+    _routing = routing or _routing
+    _urls = urls
+    if urls:
+        _base_url = urls[0]
+    _dirty = True
+
+    # Place each endpoint on the hash ring many times so measurements are
+    # spread evenly and only move off of an endpoint that is removed
+    points = sorted(
+        (zlib.crc32('{}#{}'.format(url, index).encode('utf-8')) & 0xffffffff,
+         url) for url in urls for index in range(0, 160))
+    _ring_points = [point for point, _url in points]
+    _ring = [url for _point, url in points]
+
+    # Move buffered measurements to the buffers they are now routed to
+    for key in list(_measurements):
+        buffered = _measurements.pop(key)
+        if buffered:
+            _buffer_body(_key_database(key), buffered.take(len(buffered))[0])
+
+
 def shutdown():
     """Invoke on shutdown of your application to stop the periodic
     callbacks and flush any remaining metrics.
@@ -464,207 +1151,1508 @@ def shutdown():
         LOGGER.warning('Already shutting down')
         return
 
+    _flush_rollups(True)
     _stopping = True
     _maybe_stop_timeout()
+    _maybe_stop_stats_timeout()
+    _maybe_stop_sender()
     return flush()
 
 
-def _create_http_client():
-    """Create the HTTP client with authentication credentials if required."""
-    global _http_client
+def start_sender(path):
+    """Listen for measurements forwarded by worker processes on a Unix
+    domain socket, adding them to the buffer of this process so they are
+    submitted to InfluxDB in batches across all of the workers.
 
-    defaults = {'user_agent': USER_AGENT}
-    auth_username, auth_password = _credentials
-    if auth_username and auth_password:
-        defaults['auth_username'] = auth_username
-        defaults['auth_password'] = auth_password
+    Worker processes forward their measurements to the sender by being
+    installed with a ``unix://`` URL for the socket, and should use the same
+    timestamp precision as the sender. A shorter ``submission_interval`` in
+    the workers lets the sender build batches sooner.
+
+    Example:
 
-    _http_client = httpclient.AsyncHTTPClient(
-        force_instance=True, defaults=defaults,
-        max_clients=_max_clients)
+    .. code:: python
 
+        import os
 
-def _flush_wait(flush_future, write_future):
-    """Pause briefly allowing any pending metric writes to complete before
-    shutting down.
+        import sprockets_influxdb as influxdb
+        from tornado import ioloop, process
 
-    :param tornado.concurrent.Future flush_future: The future to resolve
-        when the shutdown is complete.
-    :param tornado.concurrent.Future write_future: The future that is for the
-        current batch write operation.
+        path = '/tmp/influxdb-sender.sock'
+        if not os.fork():
+            influxdb.install(url='http://influxdb:8086/write')
+            influxdb.start_sender(path)
+            ioloop.IOLoop.current().start()
+        else:
+            process.fork_processes(4)
+            influxdb.install(url='unix://' + path, submission_interval=1000)
+
+    :param str path: The path of the Unix domain socket to listen on
 
     """
-    if write_future.done():
-        if not _pending_measurements():
-            flush_future.set_result(True)
-            return
-        else:
-            write_future = _write_measurements()
-    ioloop.IOLoop.current().add_timeout(
-        ioloop.IOLoop.current().time() + 0.25,
-        _flush_wait, flush_future, write_future)
+    global _sender_socket
 
+    LOGGER.info('Listening for worker measurements on %s', path)
+    _maybe_stop_sender()
+    _sender_socket = netutil.bind_unix_socket(path)
+    netutil.add_accept_handler(_sender_socket, _on_worker_connection)
 
-def _futures_wait(wait_future, futures):
-    """Waits for all futures to be completed. If the futures are not done,
-    wait 100ms and then invoke itself via the ioloop and check again. If
-    they are done, set a result on `wait_future` indicating the list of
-    futures are done.
 
-    :param wait_future: The future to complete when all `futures` are done
-    :type wait_future: tornado.concurrent.Future
-    :param list futures: The list of futures to watch for completion
+def stats():
+    """Return the client counters, gauges and latency quantiles as a flat
+    dictionary, suitable for exporting to a metrics system or logging.
+
+    Counters such as ``measurements_added``, ``measurements_dropped``,
+    ``batches_written`` and ``bytes_sent`` are totals since the client was
+    installed. Latencies are reported as ``<name>_duration_count`` and
+    ``<name>_duration_p50`` through ``<name>_duration_p999`` in seconds for
+    marshalling a measurement (``marshall``) and submitting a batch
+    (``batch``), covering the current stats reporting interval.
+
+    :rtype: dict
 
     """
-    global _buffer_size, _writing
+    values = {
+        'buffer_size': _buffer_size,
+        'in_flight': _in_flight_total,
+        'series_cache_hits': _series_cache_hits,
+        'series_cache_misses': _series_cache_misses,
+        'series_cache_size': len(_series_cache),
+        'spill_bytes': _spill_bytes,
+        'spill_size': _spill_size}
+    for name in ('batches_failed', 'batches_failed_over',
+                 'batches_submitted', 'batches_written', 'bytes_sent',
+                 'datagrams_dropped', 'datagrams_sent', 'measurements_added',
+                 'measurements_dropped', 'measurements_received',
+                 'measurements_rejected', 'measurements_requeued',
+                 'measurements_sampled_out', 'measurements_written'):
+        values[name] = _stats[name]
+    for name, sketch in _stats_durations.items():
+        prefix = '{}_duration'.format(name)
+        values['{}_count'.format(prefix)] = sketch.count
+        for suffix, quantile in _Rollup.QUANTILES:
+            values['{}_{}'.format(prefix, suffix)] = sketch.quantile(quantile)
+    return values
+
+
+def _add_from_thread(measurement, callback=None):
+    """Queue a measurement that was added on a thread other than the
+    IOLoop's, scheduling a callback to add the queued measurements to the
+    buffer on the IOLoop if one is not already scheduled.
 
-    remaining = []
-    for (future, batch, database, measurements) in futures:
+    :param :class:`~sprockets_influxdb.Measurement` measurement: The
+        measurement to add to the buffer
+    :param callable callback: The function to add the measurement with on
+        the IOLoop. Defaults to adding it to the buffer.
 
-        # If the future hasn't completed, add it to the remaining stack
-        if not future.done():
-            remaining.append((future, batch, database, measurements))
-            continue
+    """
+    global _thread_queue_scheduled
 
-        # Get the result of the HTTP request, processing any errors
-        error = future.exception()
-        if isinstance(error, httpclient.HTTPError):
-            if error.code == 400:
-                _write_error_batch(batch, database, measurements)
-            elif error.code >= 500:
-                _on_5xx_error(batch, error, database, measurements)
-            else:
-                LOGGER.error('Error submitting %s batch %s to InfluxDB (%s): '
-                             '%s', database, batch, error.code,
-                             error.response.body)
-        elif isinstance(error, (TimeoutError, OSError, socket.error,
-                                select.error, ssl.socket_error)):
-            _on_5xx_error(batch, error, database, measurements)
-
-    # If there are futures that remain, try again in 100ms.
-    if remaining:
-        return ioloop.IOLoop.current().add_timeout(
-            ioloop.IOLoop.current().time() + 0.1,
-            _futures_wait, wait_future, remaining)
-    else:  # Start the next timeout or trigger the next batch
-        _buffer_size = _pending_measurements()
-        LOGGER.debug('Batch submitted, %i measurements remain', _buffer_size)
-        if _buffer_size >= _trigger_size:
-            ioloop.IOLoop.current().add_callback(_trigger_batch_write)
-        elif _buffer_size:
-            _start_timeout()
+    if len(_thread_queue) >= _max_buffer_size:
+        LOGGER.warning('Discarding measurement due to thread queue size limit')
+        _io_loop.add_callback(_stats.update, ['measurements_dropped'])
+        return
 
-    _writing = False
-    wait_future.set_result(True)
+    # The flag is cleared before the queue is drained, so a measurement
+    # appended after the drain started schedules another callback
+    _thread_queue.append((callback or _buffer_measurement, measurement))
+    if not _thread_queue_scheduled:
+        _thread_queue_scheduled = True
+        _io_loop.add_callback(_drain_thread_queue)
 
 
-def _maybe_stop_timeout():
-    """If there is a pending timeout, remove it from the IOLoop and set the
-    ``_timeout`` global to None.
+def _after_fork():
+    """Invoked in a child process after a fork, resetting the buffers,
+    timeouts, HTTP clients and sockets inherited from the parent process.
+    Measurements buffered before the fork are left to the parent process to
+    submit, so they are not submitted once for each child.
+
+    Spilling is disabled in the child, since the spill directory belongs to
+    the parent process. Set a spill directory for each child process to
+    spill measurements in it. If the client is installed, the IOLoop is
+    resolved again from the IOLoop that runs in the child.
 
     """
-    global _timeout
+    global _batch_future, _buffer_size, _circuit_breakers, _http_client, \
+        _http_clients, _in_flight, _in_flight_total, _install_thread, \
+        _io_loop, _io_loop_thread, _measurements, _rollup_timeout, _rollups, \
+        _sender_socket, _sender_transport, _spill_bytes, _spill_directory, \
+        _spill_size, _spills, _stats_durations, _stats_timeout, \
+        _thread_queue_scheduled, _timeout, _udp_transport, _writing
+
+    if _buffer_size or _spill_directory:
+        LOGGER.debug('Discarding %i measurements and the spill directory '
+                     'inherited from the parent process', _buffer_size)
+    _batch_future = None
+    _buffer_size = 0
+    _circuit_breakers = {}
+    _endpoint_backlog.clear()
+    _endpoint_in_flight.clear()
+    _http_client = None
+    _http_client_requests.clear()
+    _http_clients = {}
+    _in_flight = {}
+    _in_flight_total = 0
+    if _install_thread is not None:
+        _install_thread = _thread_ident()
+    _io_loop = None
+    _io_loop_thread = None
+    _measurements = {}
+    _retired_http_clients.clear()
+    _rollup_timeout = None
+    _rollups = {}
+    _sender_socket = None
+    _sender_transport = None
+    _spill_bytes = 0
+    _spill_directory = None
+    _spill_size = 0
+    _spills = {}
+    _stats.clear()
+    _stats_durations = {}
+    _stats_timeout = None
+    _thread_queue.clear()
+    _thread_queue_scheduled = False
+    _timeout = None
+    _udp_transport = None
+    _writing = False
 
-    if _timeout is not None:
-        LOGGER.debug('Removing the pending timeout (%r)', _timeout)
-        ioloop.IOLoop.current().remove_timeout(_timeout)
-        _timeout = None
 
+def _aggregate_measurement(measurement):
+    """Add the fields of a measurement to the rollup for its series and the
+    aggregation interval its timestamp is in, starting a timeout to submit
+    the rollup at the end of the interval. Measurements aggregated on a
+    thread other than the IOLoop's are queued like added measurements, so
+    the rollups are only changed on the IOLoop.
 
-def _maybe_warn_about_buffer_size():
-    """Check the buffer size and issue a warning if it's too large and
-    a warning has not been issued for more than 60 seconds.
+    :param :class:`~sprockets_influxdb.Measurement` measurement: The
+        measurement to aggregate
+    :raises: ValueError
+    :raises: RuntimeError
 
     """
-    global _last_warning
+    if not measurement.fields:
+        raise ValueError('Measurement does not contain a field')
 
-    if not _last_warning:
-        _last_warning = time.time()
+    if _install_thread is not None and _thread_ident() != _io_loop_thread \
+            and not _on_io_loop():
+        return _add_from_thread(measurement, _aggregate_measurement)
 
-    if _buffer_size > _warn_threshold and (time.time() - _last_warning) > 120:
-        LOGGER.warning('InfluxDB measurement buffer has %i entries',
-                       _buffer_size)
+    interval = _aggregation_interval * 1000000
+    start = measurement._timestamp - measurement._timestamp % interval
+    key = (measurement.database, measurement.name,
+           tuple(measurement._tag_items()), start)
+    if key not in _rollups:
+        _rollups[key] = _Rollup(start + interval)
+    _rollups[key].add(measurement.fields, measurement._durations)
+    if not _rollup_timeout:
+        _start_rollup_timeout(start + interval)
 
 
-def _on_5xx_error(batch, error, database, measurements):
-    """Handle a batch submission error, logging the problem and adding the
-    measurements back to the stack.
+def _buffer_body(database, body):
+    """Add marshalled measurements for a database to the buffers they are
+    routed to, returning the number of measurements that were added.
 
-    :param str batch: The batch ID
-    :param mixed error: The error that was returned
-    :param str database: The database the submission failed for
-    :param list measurements: The measurements to add back to the stack
+    :param str database: The database name for the measurements
+    :param bytes body: The marshalled measurements, one per line
+    :rtype: int
 
     """
-    LOGGER.info('Appending %s measurements to stack due to batch %s %r',
-                database, batch, error)
-    _measurements[database] = _measurements[database] + measurements
+    if not _urls:
+        routed = [(database, body)]
+    elif _routing == ROUTING_DATABASE:
+        routed = [(_route(database, body), body)]
+    else:
+        lines = collections.OrderedDict()
+        for line in body.splitlines(True):
+            lines.setdefault(_route(database, line), []).append(line)
+        routed = [(key, b''.join(values)) for key, values in lines.items()]
 
+    count = 0
+    for key, value in routed:
+        if key not in _measurements:
+            _measurements[key] = _MeasurementBuffer()
+        length = len(_measurements[key])
+        _measurements[key].extend(value)
+        count += len(_measurements[key]) - length
+    return count
 
-def _on_timeout():
-    """Invoked periodically to ensure that metrics that have been collected
-    are submitted to InfluxDB.
 
-    :rtype: tornado.concurrent.Future or None
+def _buffer_measurement(measurement):
+    """Marshall a measurement and add it to the buffer, spilling it to disk
+    if the buffer is full, or discarding it if it can not be buffered.
+
+    :param :class:`~sprockets_influxdb.Measurement` measurement: The
+        measurement to add to the buffer
 
     """
     global _buffer_size
 
-    LOGGER.debug('No metrics submitted in the last %.2f seconds',
-                 _timeout_interval / 1000.0)
-    _buffer_size = _pending_measurements()
-    if _buffer_size:
-        return _trigger_batch_write()
-    _start_timeout()
+    if _stopping:
+        LOGGER.warning('Discarding measurement for %s while stopping',
+                       measurement.database)
+        _stats['measurements_dropped'] += 1
+        return
 
+    if _buffer_size >= _max_buffer_size and not _spill_directory:
+        LOGGER.warning('Discarding measurement due to buffer size limit')
+        _stats['measurements_dropped'] += 1
+        return
 
-def _pending_measurements():
-    """Return the number of measurements that have not been submitted to
-    InfluxDB.
+    start = _timer()
+    value = measurement.marshall(True)
+    _record_duration('marshall', _timer() - start)
+    _stats['measurements_added'] += 1
 
-    :rtype: int
+    # Once measurements for a database are spilled to disk, new measurements
+    # are spilled as well so they are replayed in order
+    if _buffer_size >= _max_buffer_size or _spills.get(measurement.database):
+        if not _spill_measurement(measurement.database, value):
+            _stats['measurements_dropped'] += 1
+            return
+    else:
+        key = _route(measurement.database, value)
+        if key not in _measurements:
+            _measurements[key] = _MeasurementBuffer()
+        _measurements[key].append(value)
+        _buffer_size += 1
 
-    """
-    return sum([len(_measurements[dbname]) for dbname in _measurements])
+    _maybe_trigger_batch_write()
 
 
-def _sample_batch():
-    """Determine if a batch should be processed and if not, pop off all of
-    the pending metrics for that batch.
+def _circuit_breaker(url=None):
+    """Return the circuit breaker for an InfluxDB endpoint, creating it if
+    it does not exist.
 
-    :rtype: bool
+    :param str url: The endpoint URL. Defaults to the configured base URL.
+    :rtype: _CircuitBreaker
 
     """
-    if _sample_probability == 1.0 or random.random() < _sample_probability:
-        return True
+    url = url or _base_url
+    if url not in _circuit_breakers:
+        _circuit_breakers[url] = _CircuitBreaker(url)
+    return _circuit_breakers[url]
+
+
+def _columnar_lines(prefixes, fields, timestamps, count, divisor):
+    """Return the marshalled line for each row of columnar measurements.
+    NumPy arrays are converted to lists of Python values first, so each
+    value is marshalled the same way as a list value.
+
+    :param str|list prefixes: The series key for every row, or a list with
+        the series key for each row
+    :param dict fields: A column of values for each field name
+    :param timestamps: The timestamp for each row in seconds, a
+        ``datetime64`` array, or None
+    :param int count: The number of rows
+    :param int divisor: The nanoseconds per unit of timestamp precision
+    :rtype: list
+    :raises: ValueError
 
-    # Pop off all the metrics for the batch
-    for database in _measurements:
-        _measurements[database] = _measurements[database][_max_batch_size:]
-    return False
+    """
+    if timestamps is None:
+        timestamps = [str(_time_ns() // divisor)] * count
+    elif (numpy is not None and isinstance(timestamps, numpy.ndarray) and
+            timestamps.dtype.kind == 'M'):
+        timestamps = [str(value // divisor) for value in timestamps.astype(
+            'datetime64[ns]').astype(numpy.int64).tolist()]
+    else:
+        timestamps = [str(int(round(value * 1000000000)) // divisor)
+                      for value in _column_values(timestamps)]
+    if not isinstance(prefixes, list):
+        prefixes = [prefixes] * count
+    columns = []
+    for key in fields:
+        values = [Measurement._marshall_field(value)
+                  for value in _column_values(fields[key])]
+        if None in values:
+            raise ValueError('Value must be a str, bool, integer, or float')
+        prefix = '{}='.format(Measurement._escape(key))
+        columns.append([prefix + value for value in values])
+    return [' '.join(values) for values in zip(
+        prefixes, [','.join(row) for row in zip(*columns)], timestamps)]
 
 
-def _start_timeout():
-    """Stop a running timeout if it's there, then create a new one."""
-    global _timeout
+def _column_values(column):
+    """Return the values of a column as Python values, converting NumPy
+    arrays with :meth:`numpy.ndarray.tolist`.
 
-    LOGGER.debug('Adding a new timeout in %i ms', _timeout_interval)
-    _maybe_stop_timeout()
-    _timeout = ioloop.IOLoop.current().add_timeout(
-        ioloop.IOLoop.current().time() + _timeout_interval / 1000.0,
-        _on_timeout)
+    :param list|tuple|numpy.ndarray column: The column
+    :rtype: list|tuple
 
+    """
+    if numpy is not None and isinstance(column, numpy.ndarray):
+        return column.tolist()
+    return column
 
-def _trigger_batch_write():
-    """Stop a timeout if it's running, and then write the measurements."""
-    global _batch_future
 
-    LOGGER.debug('Batch write triggered (%r/%r)',
-                 _buffer_size, _trigger_size)
+def _compression_level_value(value):
+    """Return the gzip compression level for a configuration value, which
+    may be a boolean, an integer level, or the string value of either.
+
+    :param int|bool|str value: The configuration value
+    :rtype: int
+    :raises: ValueError
+
+    """
+    if isinstance(value, str):
+        value = {'true': True, 'false': False}.get(value.lower(), value)
+    if value is True:
+        return 6
+    level = int(value or 0)
+    if not 0 <= level <= 9:
+        raise ValueError('Invalid compression level')
+    return level
+
+
+def _configure_curl_multi(client):
+    """Enable HTTP/1.1 pipelining and limit the number of connections to the
+    InfluxDB server for a curl client. libcurl 7.62 and newer no longer
+    pipeline HTTP/1.1 requests, but still reuse the pooled connections.
+
+    :param tornado.curl_httpclient.CurlAsyncHTTPClient client: The client
+
+    """
+    multi = getattr(client, '_multi', None)
+    if multi is None:
+        return
+    for option, value in [('M_PIPELINING', 1),
+                          ('M_MAX_HOST_CONNECTIONS', _max_clients)]:
+        if hasattr(pycurl, option):
+            try:
+                multi.setopt(getattr(pycurl, option), value)
+            except pycurl.error as error:
+                LOGGER.debug('Unable to set %s: %s', option, error)
+
+
+def _create_http_client():
+    """Create the HTTP client with authentication credentials if required,
+    a client for each endpoint when writes are sharded, and the UDP or
+    sender transport if the base URL is a ``udp://`` or ``unix://`` URL.
+
+    """
+    global _dirty, _http_client, _sender_transport, _udp_transport
+
+    defaults = {'user_agent': USER_AGENT}
+    auth_username, auth_password = _credentials
+    if auth_username and auth_password:
+        defaults['auth_username'] = auth_username
+        defaults['auth_password'] = auth_password
+    if _http_backend == 'curl':
+        defaults['prepare_curl_callback'] = _prepare_curl
+
+    # Close the previous clients once the requests they are making are done
+    for client in [_http_client] + list(_http_clients.values()):
+        if client is None:
+            continue
+        elif _http_client_requests[client]:
+            _retired_http_clients.add(client)
+        else:
+            client.close()
+
+    _http_client = _new_http_client(defaults)
+    _http_clients.clear()
+    for url in _urls:
+        _http_clients[url] = _new_http_client(defaults)
+
+    for transport in _sender_transport, _udp_transport:
+        if transport:
+            transport.close()
+    _sender_transport, _udp_transport = None, None
+    if _base_url.startswith('udp://'):
+        _udp_transport = _UDPTransport(_base_url)
+    elif _base_url.startswith('unix://'):
+        _sender_transport = _SenderTransport(_base_url)
+    _dirty = False
+
+
+def _default_precision(url):
+    """Return the timestamp precision to use for a base URL when a precision
+    is not set. The InfluxDB UDP listener expects nanosecond timestamps
+    unless its ``precision`` setting is configured.
+
+    :param str url: The base URL
+    :rtype: str
+
+    """
+    return 'ns' if url.startswith('udp://') else 'ms'
+
+
+def _drain_thread_queue():
+    """Add the measurements that were queued by other threads to the
+    buffer or to their rollups, invoked on the IOLoop.
+
+    """
+    global _thread_queue_scheduled
+
+    _resolve_io_loop()
+    _thread_queue_scheduled = False
+    for _iteration in range(0, len(_thread_queue)):
+        callback, measurement = _thread_queue.popleft()
+        callback(measurement)
+
+
+def _endpoint_buffer_size(endpoint):
+    """Return the number of measurements in the buffers for an endpoint of
+    a sharded write.
+
+    :param str endpoint: The endpoint URL
+    :rtype: int
+
+    """
+    return sum(len(_measurements[key]) for key in _measurements
+               if _key_endpoint(key) == endpoint)
+
+
+def _fetch(url, body, headers, endpoint=None):
+    """Submit measurements to InfluxDB with the current HTTP client for the
+    endpoint, tracking the requests each client has in flight so a client
+    that was replaced is only closed once its requests are done.
+
+    :param str url: The write URL
+    :param bytes body: The request body
+    :param dict headers: The request headers
+    :param str endpoint: The endpoint URL when writes are sharded
+    :rtype: tornado.concurrent.Future
+
+    """
+    client = _http_clients.get(endpoint, _http_client)
+    future = client.fetch(url, method='POST', body=body, headers=headers)
+    _http_client_requests[client] += 1
+    ioloop.IOLoop.current().add_future(
+        future, functools.partial(_release_http_client, client))
+    return future
+
+
+def _flush_rollups(force=False):
+    """Add a measurement for each rollup whose aggregation interval has ended
+    to the buffer, starting a timeout for the next interval to end if there
+    are rollups left.
+
+    :param bool force: Add measurements for all of the rollups, including
+        those whose interval has not ended
+
+    """
+    global _rollup_timeout
+
+    if _rollup_timeout:
+        ioloop.IOLoop.current().remove_timeout(_rollup_timeout)
+        _rollup_timeout = None
+
+    now = _time_ns()
+    for key in [key for key, rollup in _rollups.items()
+                if force or rollup.end <= now]:
+        database, name, tags, start = key
+        add_measurement(_rollups.pop(key).measurement(
+            database, name, tags, start))
+    if _rollups:
+        _start_rollup_timeout(min(rollup.end for rollup in _rollups.values()))
+
+
+def _flush_wait(flush_future, write_future):
+    """Wait for the current batch write to complete, writing another batch
+    when there are still measurements pending, and resolving the flush future
+    once the buffer is empty.
+
+    :param tornado.concurrent.Future flush_future: The future to resolve
+        when the shutdown is complete.
+    :param tornado.concurrent.Future write_future: The future that is for the
+        current batch write operation.
+
+    """
+    if write_future.done():
+        if not _pending_measurements():
+            flush_future.set_result(True)
+            return
+        elif _writing:
+            write_future = _batch_future
+        else:
+            # Wait for the retry backoff after failed submissions
+            delay = _retry_delay()
+            if delay:
+                ioloop.IOLoop.current().call_later(
+                    delay, _flush_wait, flush_future, write_future)
+                return
+            write_future = _write_measurements()
+    ioloop.IOLoop.current().add_future(
+        write_future, lambda _f: _flush_wait(flush_future, _f))
+
+
+def _new_http_client(defaults):
+    """Return a new HTTP client for the configured backend.
+
+    :param dict defaults: The default request arguments
+    :rtype: tornado.httpclient.AsyncHTTPClient
+
+    """
+    if _http_backend == 'curl':
+        client = curl_httpclient.CurlAsyncHTTPClient(
+            force_instance=True, defaults=defaults, max_clients=_max_clients)
+        _configure_curl_multi(client)
+        return client
+    return httpclient.AsyncHTTPClient(
+        force_instance=True, defaults=defaults, max_clients=_max_clients)
+
+
+def _on_batches_complete():
+    """Invoked when all of the in-flight batches for the current write are
+    done, start the next timeout or trigger the next batch. If submissions
+    have failed, the next batch is delayed by the retry backoff.
+
+    """
+    global _writing
+
+    _replay_spills()
+    LOGGER.debug('Batch submitted, %i measurements remain', _buffer_size)
+    delay = _retry_delay()
+    if _buffer_size and delay:
+        LOGGER.debug('Retrying batch submission in %.2f seconds', delay)
+        _start_timeout(delay * 1000)
+    elif _buffer_size >= _trigger_size:
+        ioloop.IOLoop.current().add_callback(_trigger_batch_write)
+    elif _buffer_size:
+        _start_timeout()
+
+    _writing = False
+    _batch_future.set_result(True)
+
+
+def _http_backend_value(value):
+    """Return the validated HTTP backend name.
+
+    :param str value: The HTTP backend, ``simple`` or ``curl``
+    :rtype: str
+    :raises: ValueError
+
+    """
+    if value not in ('curl', 'simple'):
+        raise ValueError('Invalid HTTP backend: {!r}'.format(value))
+    elif value == 'curl' and pycurl is None:
+        raise ValueError('The curl HTTP backend requires pycurl')
+    return value
+
+
+def _io_loop_running(io_loop):
+    """Return :data:`True` if the IOLoop is running.
+
+    :param tornado.ioloop.IOLoop io_loop: The IOLoop, or :data:`None`
+    :rtype: bool
+
+    """
+    if io_loop is None:
+        return False
+    elif hasattr(io_loop, 'asyncio_loop'):  # Tornado>=5 on Python 3
+        return io_loop.asyncio_loop.is_running()
+    return getattr(io_loop, '_running', False)
+
+
+def _key_database(key):
+    """Return the database name for a buffer key.
+
+    :param str|tuple key: The database name, or the database name and
+        endpoint URL when writes are sharded
+    :rtype: str
+
+    """
+    return key[0] if isinstance(key, tuple) else key
+
+
+def _key_endpoint(key):
+    """Return the endpoint URL for a buffer key, or :data:`None` for the
+    base URL when writes are not sharded.
+
+    :param str|tuple key: The database name, or the database name and
+        endpoint URL when writes are sharded
+    :rtype: str
+
+    """
+    return key[1] if isinstance(key, tuple) else None
+
+
+def _line_series(line):
+    """Return the series key of a marshalled measurement, the name and tags
+    before the first unescaped space.
+
+    :param bytes line: The marshalled measurement
+    :rtype: bytes
+
+    """
+    index = line.find(b' ')
+    while index > 0 and line[index - 1:index] == b'\\':
+        index = line.find(b' ', index + 1)
+    return line if index < 0 else line[:index]
+
+
+def _load_spills():
+    """Load the spill queues for any databases with measurements left in the
+    spill directory, so that they are submitted.
+
+    """
+    global _spill_bytes, _spill_size
+
+    if not os.path.isdir(_spill_directory):
+        return
+    for name in sorted(os.listdir(_spill_directory)):
+        try:
+            database = binascii.unhexlify(name.encode('ascii')).decode('utf-8')
+        except (TypeError, ValueError):
+            continue
+        if database in _spills:
+            continue
+        queue = _spill_queue(database)
+        if queue:
+            LOGGER.info('Loaded %i spilled %s measurements from %s',
+                        len(queue), database, queue.directory)
+        _spill_bytes += queue.size
+        _spill_size += len(queue)
+
+
+def _maybe_start_stats_timeout():
+    """Start the timeout for adding the stats measurement if stats reporting
+    is enabled and it is not already pending.
+
+    """
+    global _stats_timeout
+
+    if _stats_database and _stats_timeout is None and not _stopping:
+        _stats_timeout = ioloop.IOLoop.current().add_timeout(
+            ioloop.IOLoop.current().time() + _stats_interval / 1000.0,
+            _on_stats_timeout)
+
+
+def _maybe_stop_sender():
+    """Stop listening for measurements forwarded by worker processes."""
+    global _sender_socket
+
+    if _sender_socket is not None:
+        ioloop.IOLoop.current().remove_handler(_sender_socket)
+        _sender_socket.close()
+        _sender_socket = None
+
+
+def _maybe_stop_stats_timeout():
+    """If there is a pending stats timeout, remove it from the IOLoop."""
+    global _stats_timeout
+
+    if _stats_timeout is not None:
+        ioloop.IOLoop.current().remove_timeout(_stats_timeout)
+        _stats_timeout = None
+
+
+def _maybe_stop_timeout():
+    """If there is a pending timeout, remove it from the IOLoop and set the
+    ``_timeout`` global to None.
+
+    """
+    global _timeout
+
+    if _timeout is not None:
+        LOGGER.debug('Removing the pending timeout (%r)', _timeout)
+        ioloop.IOLoop.current().remove_timeout(_timeout)
+        _timeout = None
+
+
+def _maybe_trigger_batch_write():
+    """Start the timeout that ensures buffers with less than
+    ``_trigger_size`` measurements are written, and trigger a batch write if
+    there are at least ``_trigger_size`` measurements in the buffer. No
+    batch write is triggered while failed submissions are backing off, so
+    the timeout for the retry is left in place.
+
+    """
+    if not _timeout:
+        if (_batch_future and _batch_future.done()) or not _batch_future:
+            _start_timeout()
+    if _stats_timeout is None:
+        _maybe_start_stats_timeout()
+
+    # Check to see if the batch should be triggered
+    if _buffer_size >= _trigger_size and not _retry_delay():
+        _trigger_batch_write()
+
+
+def _maybe_warn_about_buffer_size():
+    """Check the buffer size and issue a warning if it's too large and
+    a warning has not been issued for more than 60 seconds.
+
+    """
+    global _last_warning
+
+    if not _last_warning:
+        _last_warning = time.time()
+
+    if _buffer_size > _warn_threshold and (time.time() - _last_warning) > 120:
+        LOGGER.warning('InfluxDB measurement buffer has %i entries',
+                       _buffer_size)
+
+
+def _on_5xx_error(batch, error, key, measurements, url):
+    """Handle a batch submission error, logging the problem, adding the
+    measurements back to the stack, and recording the failure with the
+    circuit breaker.
+
+    :param str batch: The batch ID
+    :param mixed error: The error that was returned
+    :param str|tuple key: The buffer key the submission failed for
+    :param bytes measurements: The marshalled measurements to add back to the
+        stack, one per line
+    :param str url: The endpoint URL the batch was submitted to
+
+    """
+    global _buffer_size
+
+    LOGGER.info('Appending %s measurements to stack due to batch %s %r',
+                _key_database(key), batch, error)
+    count = _buffer_body(_key_database(key), measurements)
+    _buffer_size += count
+    _stats['measurements_requeued'] += count
+    _circuit_breaker(url).on_failure(ioloop.IOLoop.current().time())
+
+
+def _on_io_loop():
+    """Return :data:`True` if measurements can be buffered on the current
+    thread, resolving the IOLoop from the IOLoop running on the thread if
+    the IOLoop's thread is not known yet. Until it is known, measurements
+    are only queued for the IOLoop if it is running.
+
+    :rtype: bool
+    :raises: RuntimeError
+
+    """
+    thread = _thread_ident()
+    _resolve_io_loop()
+    if thread == _io_loop_thread:
+        return True
+    elif _io_loop_thread is not None or _io_loop_running(_io_loop):
+        return False
+    elif thread == _install_thread:
+        return True
+    raise RuntimeError('Measurements can not be added on other threads until '
+                       'the IOLoop is running, see set_io_loop')
+
+
+def _on_rejected_measurement(batch, database, measurement, error):
+    """Invoked when a single measurement from a batch has been rejected by
+    InfluxDB, logging the measurement and passing it to the rejected
+    measurement callback if one is set.
+
+    :param str batch: The batch ID
+    :param str database: The database name for the measurement
+    :param bytes measurement: The marshalled measurement that was rejected
+    :param tornado.httpclient.HTTPError error: The error for the rejection
+
+    """
+    measurement = measurement.rstrip(b'\n').decode('utf-8')
+    body = error.response.body if error.response else None
+    _stats['measurements_rejected'] += 1
+    LOGGER.error('Error writing %s measurement from batch %s to InfluxDB '
+                 '(%s): %s', database, batch, error.code, body)
+    LOGGER.info('Bad %s measurement from batch %s: %s',
+                database, batch, measurement)
+    if _rejected_callback:
+        try:
+            _rejected_callback(database, measurement, body)
+        except Exception as error:
+            LOGGER.exception('Error invoking the rejected measurement '
+                             'callback: %s', error)
+
+
+def _on_request_done(future, batch, key, measurements, started, url):
+    """Invoked when the HTTP request for a batch is done, processing any
+    errors, submitting another batch in the freed slot, and completing the
+    current write once no batches are in flight.
+
+    :param tornado.concurrent.Future future: The AsyncHTTPClient request future
+    :param str batch: The batch ID
+    :param str|tuple key: The buffer key for the measurements
+    :param bytes measurements: The marshalled measurements that were
+        submitted, one per line
+    :param float started: When the request was made
+    :param str url: The endpoint URL the batch was submitted to
+
+    """
+    global _in_flight_total
+
+    _in_flight[key] -= 1
+    _in_flight_total -= 1
+    _endpoint_in_flight[_key_endpoint(key)] -= 1
+    latency = _timer() - started
+    _record_duration('batch', latency)
+
+    # Get the result of the HTTP request, processing any errors
+    breaker = _circuit_breaker(url)
+    error = future.exception()
+    if error is not None:
+        _stats['batches_failed'] += 1
+    if isinstance(error, httpclient.HTTPError):
+        if error.code == 400:
+            breaker.on_success()
+            _write_error_batch(batch, key, measurements, error, url)
+        elif error.code >= 500:
+            _on_5xx_error(batch, error, key, measurements, url)
+        else:
+            breaker.on_success()
+            LOGGER.error('Error submitting %s batch %s to InfluxDB (%s): '
+                         '%s', _key_database(key), batch, error.code,
+                         error.response.body)
+            _stats['measurements_dropped'] += measurements.count(b'\n')
+    elif isinstance(error, (TimeoutError, OSError, socket.error,
+                            select.error, ssl.socket_error,
+                            iostream.StreamClosedError)):
+        _on_5xx_error(batch, error, key, measurements, url)
+    elif error is None:
+        breaker.on_success(latency)
+        _stats['batches_written'] += 1
+        _stats['measurements_written'] += measurements.count(b'\n')
+
+        # Keep submitting the measurements that were pending when the write
+        # was triggered to the endpoint of a sharded write, so a slow
+        # endpoint does not hold up submitting batches to the others
+        endpoint = _key_endpoint(key)
+        if not _urls:
+            if _buffer_size >= _trigger_size:
+                _submit_batches()
+        elif (_endpoint_backlog[endpoint] or
+                _endpoint_buffer_size(endpoint) >= _trigger_size):
+            _submit_batches([endpoint])
+    else:
+        LOGGER.error('Error submitting %s batch %s to InfluxDB, discarding '
+                     '%i measurements: %r', _key_database(key), batch,
+                     measurements.count(b'\n'), error)
+        _stats['measurements_dropped'] += measurements.count(b'\n')
+
+    # Fail the requeued measurements over to a replica right away, instead
+    # of waiting for the next submission interval
+    if breaker.failures and _replicas and _key_endpoint(key) is None:
+        _submit_batches()
+
+    if _writing and not _in_flight_total:
+        _on_batches_complete()
+
+
+def _on_stats_timeout():
+    """Invoked periodically when stats reporting is enabled to add the
+    client stats as a measurement, resetting the latency quantiles for the
+    next interval.
+
+    """
+    global _stats_timeout
+
+    _stats_timeout = None
+    measurement = Measurement(_stats_database, 'sprockets_influxdb')
+    for name, value in stats().items():
+        measurement.set_field(name, value)
+    _stats_durations.clear()
+    add_measurement(measurement)
+
+
+def _on_timeout():
+    """Invoked periodically to ensure that metrics that have been collected
+    are submitted to InfluxDB.
+
+    :rtype: tornado.concurrent.Future or None
+
+    """
+    LOGGER.debug('No metrics submitted in the last %.2f seconds',
+                 _timeout_interval / 1000.0)
+    _resolve_io_loop()
+    if _pending_measurements():
+        return _trigger_batch_write()
+    _start_timeout()
+
+
+def _on_worker_connection(connection, address):
+    """Invoked when a worker process connects to the sender socket, reading
+    the measurements it forwards.
+
+    :param socket.socket connection: The worker connection
+    :param str address: The address of the worker
+
+    """
+    LOGGER.debug('Worker process connected to the sender')
+    _read_worker_stream(iostream.IOStream(connection))
+
+
+def _path_patterns(application, signature, routes):
+    """Return the path pattern for each handler class of the application
+    that is routed to by a single pattern, so the pattern for a request does
+    not need to be found by matching the request against every route. The
+    patterns are cached until the number of routes in the application
+    changes.
+
+    :param tornado.web.Application application: The application
+    :param tuple signature: The number of routes in the application
+    :param routes: The handler class and path pattern of each route
+    :type routes: iterator(tuple(class, str))
+    :rtype: dict
+
+    """
+    try:
+        cached, patterns = _route_patterns[application]
+    except KeyError:
+        cached, patterns = None, {}
+    if cached == signature:
+        return patterns
+
+    # Handler classes that are routed to by more than one pattern or used for
+    # unmatched requests are mapped to None
+    patterns = {application.settings.get('default_handler_class'): None}
+    for handler, pattern in routes:
+        patterns[handler] = \
+            pattern if patterns.get(handler, pattern) == pattern else None
+    _route_patterns[application] = signature, patterns
+    return patterns
+
+
+def _path_patterns_tornado4(application):
+    """Return the path pattern for each handler class of the application that
+    is routed to by a single pattern. (Tornado<4.5)
+
+    :param tornado.web.Application application: The application
+    :rtype: dict
+
+    """
+    return _path_patterns(
+        application,
+        tuple(len(handlers) for _host, handlers in application.handlers),
+        ((spec.handler_class, spec.regex.pattern)
+         for _host, handlers in application.handlers for spec in handlers))
+
+
+def _path_patterns_tornado45(application):
+    """Return the path pattern for each handler class of the application that
+    is routed to by a single pattern. (Tornado>=4.5)
+
+    :param tornado.web.Application application: The application
+    :rtype: dict
+
+    """
+    def routes(router):
+        for rule in router.rules:
+            if isinstance(rule.target, routing.Router):
+                for route in routes(rule.target):
+                    yield route
+            elif isinstance(rule.matcher, routing.PathMatches):
+                yield rule.target, rule.matcher.regex.pattern
+
+    return _path_patterns(
+        application,
+        (len(application.default_router.rules),
+         len(application.wildcard_router.rules)),
+        routes(application.default_router))
+
+
+def _pending_measurements():
+    """Return the number of measurements that have not been submitted to
+    InfluxDB, including measurements that have been spilled to disk. The
+    counts are maintained as measurements are added to and removed from the
+    buffer, so this does not need to walk each database's stack.
+
+    :rtype: int
+
+    """
+    return _buffer_size + _spill_size
+
+
+def _prepare_curl(curl):
+    """Enable TCP keep-alive for the pooled connections of the curl HTTP
+    backend.
+
+    :param pycurl.Curl curl: The curl handle for a request
+
+    """
+    if hasattr(pycurl, 'TCP_KEEPALIVE'):
+        curl.setopt(pycurl.TCP_KEEPALIVE, 1)
+
+
+@gen.coroutine
+def _read_worker_stream(stream):
+    """Read the measurements forwarded by a worker process until it
+    disconnects, adding them to the buffer.
+
+    :param tornado.iostream.IOStream stream: The worker connection
+
+    """
+    header = _SenderTransport.HEADER
+    try:
+        while True:
+            length, size = header.unpack(
+                (yield stream.read_bytes(header.size)))
+            database = yield stream.read_bytes(length)
+            body = yield stream.read_bytes(size)
+            _receive_measurements(database.decode('utf-8'), body)
+    except iostream.StreamClosedError:
+        LOGGER.debug('Worker process disconnected from the sender')
+
+
+def _receive_measurements(database, body):
+    """Add the measurements forwarded by a worker process to the buffer,
+    spilling them if the buffer is full.
+
+    :param str database: The database name for the measurements
+    :param bytes body: The marshalled measurements, one per line
+
+    """
+    global _buffer_size
+
+    count = body.count(b'\n')
+    _stats['measurements_received'] += count
+    if _stopping or (_buffer_size >= _max_buffer_size and
+                     not _spill_directory):
+        LOGGER.warning('Discarding %i forwarded %s measurements',
+                       count, database)
+        _stats['measurements_dropped'] += count
+        return
+
+    if _buffer_size >= _max_buffer_size or _spills.get(database):
+        for value in body.splitlines():
+            if not _spill_measurement(database, value):
+                _stats['measurements_dropped'] += 1
+    else:
+        _buffer_size += _buffer_body(database, body)
+
+    _maybe_trigger_batch_write()
+
+
+def _record_duration(name, seconds):
+    """Add a latency to the quantile sketch returned by
+    :func:`~sprockets_influxdb.stats` for ``name``.
+
+    :param str name: The name of the latency
+    :param float seconds: The latency in seconds
+
+    """
+    if name not in _stats_durations:
+        _stats_durations[name] = _QuantileSketch()
+    _stats_durations[name].add(seconds)
+
+
+def _release_http_client(client, future):
+    """Invoked when a request made by an HTTP client is done, closing the
+    client if it was replaced and has no more requests in flight.
+
+    :param tornado.httpclient.AsyncHTTPClient client: The client
+    :param tornado.concurrent.Future future: The request future
+
+    """
+    _http_client_requests[client] -= 1
+    if _http_client_requests[client] <= 0:
+        del _http_client_requests[client]
+        if client in _retired_http_clients:
+            _retired_http_clients.remove(client)
+            client.close()
+
+
+def _replay_spills():
+    """Move spilled measurements back into the buffer, in order, while the
+    buffer has room for them.
+
+    """
+    global _buffer_size, _spill_bytes, _spill_size
+
+    if not _spill_size:
+        return
+    for database in _spills:
+        queue = _spills[database]
+        room = _max_buffer_size - _buffer_size
+        if room <= 0:
+            break
+        elif not queue:
+            continue
+        size = queue.size
+        try:
+            body, count = queue.read(min(room, _max_batch_size))
+        except (IOError, OSError) as error:
+            LOGGER.error('Error reading spilled %s measurements from %s: %s',
+                         database, queue.directory, error)
+            continue
+        LOGGER.debug('Replaying %i spilled %s measurements', count, database)
+        _buffer_body(database, body)
+        _buffer_size += count
+        _spill_size -= count
+        _spill_bytes -= size - queue.size
+
+
+def _resolve_io_loop():
+    """Record the IOLoop running on the current thread as the IOLoop that
+    measurements are buffered and submitted on, if its thread is not known
+    yet. An IOLoop other than the one that was set is only used if that
+    IOLoop is not running, and the pending timeout is started again on it.
+
+    """
+    global _io_loop, _io_loop_thread
+
+    if _install_thread is None or _io_loop_thread is not None:
+        return
+    io_loop = _running_io_loop()
+    if io_loop is None or (io_loop is not _io_loop and
+                           _io_loop_running(_io_loop)):
+        return
+    LOGGER.debug('Buffering and submitting measurements on %r', io_loop)
+    io_loop, _io_loop = _io_loop, io_loop
+    _io_loop_thread = _thread_ident()
+    if _timeout is not None and io_loop is not _io_loop:
+        _start_timeout()
+
+
+def _retry_delay():
+    """Return the number of seconds to wait after failed submissions before
+    a batch can be submitted to an endpoint with pending measurements.
+
+    :rtype: float
+
+    """
+    now = ioloop.IOLoop.current().time()
+    endpoints = set(_key_endpoint(key) for key in _measurements
+                    if _measurements[key]) or {None}
+    if None in endpoints and _replicas:
+        endpoints.update(_replicas)
+    return min(_circuit_breaker(endpoint).delay(now)
+               for endpoint in endpoints)
+
+
+def _request_body(body):
+    """Return the request body and headers for submitting the measurements,
+    compressing the body if compression is enabled and the body is at least
+    ``_compression_threshold`` bytes.
+
+    :param bytes body: The marshalled measurements to submit, one per line
+    :rtype: tuple(bytes, dict)
+
+    """
+    if not _compression_level or len(body) < _compression_threshold:
+        return body, {}
+    compressor = zlib.compressobj(
+        _compression_level, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+    return (compressor.compress(body) + compressor.flush(),
+            {'Content-Encoding': 'gzip'})
+
+
+def _route(database, line):
+    """Return the key of the buffer for a marshalled measurement, the
+    database name, or the database name and the endpoint URL the
+    measurement is routed to by consistent hashing when writes are sharded.
+
+    :param str database: The database name for the measurement
+    :param bytes line: The marshalled measurement
+    :rtype: str|tuple
+
+    """
+    if not _urls:
+        return database
+    elif _routing == ROUTING_SERIES:
+        value = _line_series(line)
+    else:
+        value = database.encode('utf-8')
+    point = zlib.crc32(value) & 0xffffffff
+    return database, _ring[bisect.bisect(_ring_points, point) %
+                           len(_ring_points)]
+
+
+def _running_io_loop():
+    """Return the IOLoop that is running on the current thread, or
+    :data:`None` if there is not one.
+
+    :rtype: tornado.ioloop.IOLoop
+
+    """
+    if asyncio is not None and _tornado_version >= (5, 0):
+        # The current IOLoop is created for the asyncio event loop, which
+        # may not be running
+        if asyncio._get_running_loop() is None:
+            return None
+        return ioloop.IOLoop.current()
+    io_loop = ioloop.IOLoop.current(instance=False)
+    return io_loop if _io_loop_running(io_loop) else None
+
+
+def _sample_batch():
+    """Determine if a batch should be processed and if not, pop off all of
+    the pending metrics for that batch.
+
+    :rtype: bool
+
+    """
+    global _buffer_size
+
+    if _sample_probability == 1.0 or random.random() < _sample_probability:
+        return True
+
+    # Pop off all the metrics for the batch
+    for database in _measurements:
+        count = _measurements[database].take(_max_batch_size)[1]
+        _buffer_size -= count
+        _stats['measurements_sampled_out'] += count
+    return False
+
+
+def _select_url(endpoint, now):
+    """Return the URL to submit the next batch for an endpoint to, or
+    :data:`None` if no batch may be submitted to it yet.
+
+    Without replicas, this is the endpoint while its circuit breaker allows
+    submission. With replicas, batches are submitted to the base URL while
+    it is healthy. Once it is degraded, a single probe batch at a time is
+    submitted to it, and the other batches are submitted to a healthy
+    replica chosen at random, weighted by the inverse of its latency.
+
+    :param str endpoint: The endpoint URL, or :data:`None` for the base URL
+    :param float now: The current IOLoop time
+    :rtype: str
+
+    """
+    url = endpoint or _base_url
+    breaker = _circuit_breaker(url)
+    if endpoint is not None or not _replicas or not breaker.degraded():
+        return url if breaker.allow(now) else None
+    elif breaker.probe(now):
+        return url
+
+    breakers = [_circuit_breaker(replica) for replica in _replicas]
+    healthy = [replica for replica in breakers if not replica.degraded()]
+    if not healthy:
+        for replica in breakers:
+            if replica.probe(now):
+                return replica.url
+        return None
+
+    # Replicas without a latency yet are weighted by the average latency
+    latencies = [replica.latency for replica in healthy
+                 if replica.latency is not None]
+    default = sum(latencies) / len(latencies) if latencies else 1.0
+    weights = [1.0 / max(replica.latency if replica.latency is not None
+                         else default, 0.001) for replica in healthy]
+    value = random.uniform(0, sum(weights))
+    for replica, weight in zip(healthy, weights):
+        value -= weight
+        if value <= 0:
+            break
+    _stats['batches_failed_over'] += 1
+    return replica.url
+
+
+def _series_key(name, tags):
+    """Return the marshalled series key for a measurement name and its tags,
+    caching the most recently used keys so the name and tags of a series are
+    only escaped and joined once.
+
+    :param str name: The measurement name
+    :param list tags: The tag key/value pairs for the measurement
+    :rtype: str
+
+    """
+    global _series_cache_hits, _series_cache_misses
+
+    # Tag values that compare equal, such as 1, 1.0 and True, are
+    # marshalled differently, so the key includes the type of each value
+    key = name, tuple([(k, v, type(v)) for k, v in tags])
+    try:
+        value = _series_cache.pop(key)
+    except KeyError:
+        _series_cache_misses += 1
+        value = '{},{}'.format(
+            Measurement._escape(name),
+            ','.join(['{}={}'.format(Measurement._escape(k),
+                                     Measurement._escape(v))
+                      for k, v in tags]))
+        if _max_series_cache_size <= 0:
+            return value
+        elif len(_series_cache) >= _max_series_cache_size:
+            _series_cache.popitem(last=False)
+    else:
+        _series_cache_hits += 1
+    _series_cache[key] = value
+    return value
+
+
+def _sorted_tag_keys(keys):
+    """Return the tag keys in the order they are marshalled in. Tags are
+    written sorted by key, which InfluxDB can ingest without sorting them
+    itself, and the order is cached for each set of tag keys so the keys are
+    only sorted once.
+
+    :param frozenset keys: The tag keys for a measurement
+    :rtype: tuple
+
+    """
+    try:
+        return _tag_key_orders[keys]
+    except KeyError:
+        if len(_tag_key_orders) >= max(_max_series_cache_size, 1):
+            _tag_key_orders.clear()
+        _tag_key_orders[keys] = tuple(sorted(keys, key=str))
+        return _tag_key_orders[keys]
+
+
+def _spill_measurement(database, value):
+    """Append a marshalled measurement to the spill queue for the database,
+    discarding it if the spilled measurements are at the size limit.
+
+    :param str database: The database name for the measurement
+    :param bytes value: The marshalled measurement
+    :rtype: bool
+
+    """
+    global _spill_bytes, _spill_size
+
+    if _spill_bytes >= _max_spill_bytes:
+        LOGGER.warning('Discarding measurement due to spill size limit')
+        return False
+
+    queue = _spill_queue(database)
+    size = queue.size
+    try:
+        queue.append(value)
+    except (IOError, OSError) as error:
+        LOGGER.error('Error spilling %s measurement to %s: %s',
+                     database, queue.directory, error)
+        return False
+    _spill_bytes += queue.size - size
+    _spill_size += 1
+    return True
+
+
+def _spill_queue(database):
+    """Return the spill queue for a database, creating it if it does not
+    exist.
+
+    :param str database: The database name
+    :rtype: _SpillQueue
+
+    """
+    if database not in _spills:
+        _spills[database] = _SpillQueue(os.path.join(
+            _spill_directory,
+            binascii.hexlify(database.encode('utf-8')).decode('ascii')))
+    return _spills[database]
+
+
+def _start_rollup_timeout(end):
+    """Start a timeout to submit the rollups whose aggregation interval has
+    ended.
+
+    :param int end: The end of the interval in nanoseconds since the epoch
+
+    """
+    global _rollup_timeout
+
+    _rollup_timeout = ioloop.IOLoop.current().call_later(
+        max(end - _time_ns(), 0) / 1000000000.0, _flush_rollups)
+
+
+def _start_timeout(interval=None):
+    """Stop a running timeout if it's there, then create a new one.
+
+    :param int interval: The timeout in milliseconds. Defaults to the
+        submission interval.
+
+    """
+    global _timeout
+
+    interval = interval or _timeout_interval
+    LOGGER.debug('Adding a new timeout in %i ms', interval)
+    _maybe_stop_timeout()
+    _timeout = ioloop.IOLoop.current().add_timeout(
+        ioloop.IOLoop.current().time() + interval / 1000.0, _on_timeout)
+
+
+def _submit_batch(key, url):
+    """Take a batch of measurements for the buffer key off of the stack of
+    pending measurements and submit it to InfluxDB.
+
+    :param str|tuple key: The buffer key to submit a batch for
+    :param str url: The endpoint URL to submit the batch to
+    :returns: The request future and the callback that processes its result
+    :rtype: tuple
+
+    """
+    global _buffer_size, _in_flight_total
+
+    # Pop the measurements to submit off the stack of pending measurements
+    measurements, count = _measurements[key].take(_max_batch_size)
+    _buffer_size -= count
+    endpoint = _key_endpoint(key)
+    _endpoint_backlog[endpoint] = max(_endpoint_backlog[endpoint] - count, 0)
+
+    # Create the request future, or send the measurements with a transport
+    started = _timer()
+    transport = _udp_transport or _sender_transport
+    if transport:
+        LOGGER.debug('Sending %r measurements to %r', count, _base_url)
+        body = measurements
+        future = transport.write(key, body)
+    else:
+        write_url = _write_url(_key_database(key), url)
+        LOGGER.debug('Submitting %r measurements to %r', count, write_url)
+        body, headers = _request_body(measurements)
+        future = _fetch(write_url, body, headers, _key_endpoint(key))
+
+    _in_flight[key] = _in_flight.get(key, 0) + 1
+    _in_flight_total += 1
+    _endpoint_in_flight[endpoint] += 1
+    _stats['batches_submitted'] += 1
+    _stats['bytes_sent'] += len(body)
+
+    return future, functools.partial(
+        _on_request_done, batch=str(uuid.uuid4()), key=key,
+        measurements=measurements, started=started, url=url)
+
+
+def _submit_batches(endpoints=None):
+    """Submit batches of pending measurements while there are free slots,
+    keeping up to ``_max_inflight_batches`` batches in flight for each
+    database and ``_max_clients`` batches in flight for each endpoint. No
+    batches are submitted to an endpoint while its circuit breaker is open,
+    and only a single probe batch is submitted while it is half-open. When
+    replicas are set, batches for the base URL are routed with
+    :meth:`_select_url`.
+
+    :param list endpoints: Only submit batches to these endpoints of a
+        sharded write. Defaults to every endpoint.
+
+    """
+    completed = []
+    paused = set()
+    while True:
+        _replay_spills()
+        keys = [key for key in _measurements
+                if _measurements[key] and
+                (endpoints is None or _key_endpoint(key) in endpoints) and
+                _in_flight.get(key, 0) < _max_inflight_batches and
+                _key_endpoint(key) not in paused and
+                _endpoint_in_flight[_key_endpoint(key)] < _max_clients]
+        if not keys:
+            break
+        elif not _sample_batch():
+            LOGGER.debug('Skipping batch submission due to sampling')
+            continue
+        for key in keys:
+            endpoint = _key_endpoint(key)
+            if (endpoint in paused or not _measurements[key] or
+                    _endpoint_in_flight[endpoint] >= _max_clients):
+                continue
+            url = _select_url(endpoint, ioloop.IOLoop.current().time())
+            if url is None:
+                paused.add(endpoint)
+                continue
+            future, callback = _submit_batch(key, url)
+            if future.done():
+                completed.append((future, callback))
+            else:
+                ioloop.IOLoop.current().add_future(future, callback)
+
+    # Process requests that have already failed once all of the free slots
+    # are used, so their measurements are not resubmitted in this pass
+    for future, callback in completed:
+        callback(future)
+
+
+def _trigger_batch_write():
+    """Stop a timeout if it's running, and then write the measurements."""
+    LOGGER.debug('Batch write triggered (%r/%r)',
+                 _buffer_size, _trigger_size)
     _maybe_stop_timeout()
     _maybe_warn_about_buffer_size()
-    _batch_future = _write_measurements()
-    return _batch_future
+    return _write_measurements()
 
 
 def _write_measurements():
@@ -672,21 +2660,25 @@ def _write_measurements():
     returning a future that will indicate all metrics have been written
     when that future is done.
 
+    If measurements are already being written, batches are submitted for
+    any free slots as part of the current write, and the returned future
+    will have a result of :data:`False`.
+
     :rtype: tornado.concurrent.Future
 
     """
-    global _timeout, _writing
+    global _batch_future, _writing
 
+    _resolve_io_loop()
     future = concurrent.Future()
 
     if _writing:
-        LOGGER.warning('Currently writing measurements, skipping write')
+        LOGGER.debug('Currently writing measurements, adding batches to the '
+                     'current write')
+        _submit_batches()
         future.set_result(False)
     elif not _pending_measurements():
         future.set_result(True)
-    elif not _sample_batch():
-        LOGGER.debug('Skipping batch submission due to sampling')
-        future.set_result(True)
 
     # Exit early if there's an error condition
     if future.done():
@@ -695,119 +2687,772 @@ def _write_measurements():
     if not _http_client or _dirty:
         _create_http_client()
 
-    # Keep track of the futures for each batch submission
-    futures = []
+    # Note the measurements pending for each endpoint of a sharded write,
+    # to keep submitting them as the endpoint's batches complete
+    _endpoint_backlog.clear()
+    for key in _measurements if _urls else ():
+        _endpoint_backlog[_key_endpoint(key)] += len(_measurements[key])
 
-    # Submit a batch for each database
-    for database in _measurements:
-        url = '{}?db={}&precision=ms'.format(_base_url, database)
+    # Submit batches, completing the write when all of them are done
+    _batch_future = future
+    _writing = True
+    _submit_batches()
+    if _writing and not _in_flight_total:
+        _on_batches_complete()
 
-        # Get the measurements to submit
-        measurements = _measurements[database][:_max_batch_size]
+    return future
 
-        # Pop them off the stack of pending measurements
-        _measurements[database] = _measurements[database][_max_batch_size:]
 
-        # Create the request future
-        LOGGER.debug('Submitting %r measurements to %r',
-                     len(measurements), url)
-        request = _http_client.fetch(
-            url, method='POST', body='\n'.join(measurements).encode('utf-8'))
+def _write_error_batch(batch, key, measurements, error, url):
+    """Invoked when a batch submission is rejected by InfluxDB, this method
+    will split the measurements in half and submit each half concurrently.
+    Halves that are rejected are split again until the bad measurements are
+    isolated, so only ``O(k log n)`` requests are needed to find ``k`` bad
+    measurements in a batch of ``n``.
 
-        # Keep track of each request in our future stack
-        futures.append((request, str(uuid.uuid4()), database, measurements))
+    Each bad measurement is logged and passed to the callback set with
+    :meth:`~sprockets_influxdb.set_rejected_measurement_callback`. The
+    requests for the halves are counted as in flight, so the current write
+    is not complete until all of them are done.
 
-    # Start the wait cycle for all the requests to complete
-    _writing = True
-    _futures_wait(future, futures)
+    :param str batch: The batch ID for correlation purposes
+    :param str|tuple key: The buffer key for the measurements
+    :param bytes measurements: The marshalled measurements that failed to
+        write as a batch, one per line
+    :param tornado.httpclient.HTTPError error: The error for the rejection
+    :param str url: The endpoint URL the batch was submitted to
 
-    return future
+    """
+    global _in_flight_total
+
+    database = _key_database(key)
+    lines = measurements.splitlines(True)
+    if len(lines) == 1:
+        return _on_rejected_measurement(batch, database, lines[0], error)
+
+    LOGGER.debug('Splitting %i %s measurements from rejected batch %s',
+                 len(lines), database, batch)
+
+    write_url = _write_url(database, url)
+    middle = len(lines) // 2
+    for values in b''.join(lines[:middle]), b''.join(lines[middle:]):
+        body, headers = _request_body(values)
+        _stats['bytes_sent'] += len(body)
+        future = _fetch(write_url, body, headers, _key_endpoint(key))
+        _in_flight[key] = _in_flight.get(key, 0) + 1
+        _in_flight_total += 1
+        _endpoint_in_flight[_key_endpoint(key)] += 1
+        ioloop.IOLoop.current().add_future(
+            future, functools.partial(
+                _write_error_batch_wait, batch=batch, key=key,
+                measurements=values, url=url))
+
+
+def _write_error_batch_wait(future, batch, key, measurements, url):
+    """Invoked by the IOLoop when the HTTP request future created by
+    :meth:`_write_error_batch` is done, this method will evaluate the result,
+    splitting the measurements again if they were rejected, or adding them
+    back to the stack of pending measurements if the request failed.
+
+    :param tornado.concurrent.Future future: The AsyncHTTPClient request future
+    :param str batch: The batch ID
+    :param str|tuple key: The buffer key for the measurements
+    :param bytes measurements: The marshalled measurements the future is
+        for, one per line
+    :param str url: The endpoint URL the measurements were submitted to
 
+    """
+    global _in_flight_total
 
-def _write_error_batch(batch, database, measurements):
-    """Invoked when a batch submission fails, this method will submit one
-    measurement to InfluxDB. It then adds a timeout to the IOLoop which will
-    invoke :meth:`_write_error_batch_wait` which will evaluate the result and
-    then determine what to do next.
+    _in_flight[key] -= 1
+    _in_flight_total -= 1
+    _endpoint_in_flight[_key_endpoint(key)] -= 1
+
+    breaker = _circuit_breaker(url)
+    error = future.exception()
+    if isinstance(error, httpclient.HTTPError):
+        if error.code == 400:
+            breaker.on_success()
+            _write_error_batch(batch, key, measurements, error, url)
+        elif error.code >= 500:
+            _on_5xx_error(batch, error, key, measurements, url)
+        else:
+            LOGGER.error('Error submitting %i %s measurements from batch %s '
+                         'to InfluxDB (%s): %s', measurements.count(b'\n'),
+                         _key_database(key), batch, error.code,
+                         error.response.body)
+            _stats['measurements_dropped'] += measurements.count(b'\n')
+    elif isinstance(error, (TimeoutError, OSError, socket.error,
+                            select.error, ssl.socket_error,
+                            iostream.StreamClosedError)):
+        _on_5xx_error(batch, error, key, measurements, url)
+    elif error is None:
+        breaker.on_success()
+        LOGGER.debug('Wrote %i %s measurements from rejected batch %s',
+                     measurements.count(b'\n'), _key_database(key), batch)
+        _stats['measurements_written'] += measurements.count(b'\n')
+    else:
+        LOGGER.error('Error submitting %i %s measurements from batch %s '
+                     'to InfluxDB, discarding them: %r',
+                     measurements.count(b'\n'), _key_database(key), batch,
+                     error)
+        _stats['measurements_dropped'] += measurements.count(b'\n')
+
+    if _writing and not _in_flight_total:
+        _on_batches_complete()
 
-    :param str batch: The batch ID for correlation purposes
-    :param str database: The database name for the measurements
-    :param list measurements: The measurements that failed to write as a batch
+
+def _write_url(database, url=None):
+    """Return the URL for writing measurements to the database, with the
+    timestamp precision for the database.
+
+    :param str database: The database name
+    :param str url: The endpoint URL. Defaults to the configured base URL.
+    :rtype: str
 
     """
-    if not measurements:
-        LOGGER.info('All %s measurements from batch %s processed',
-                    database, batch)
-        return
+    precision = _database_precisions.get(database, _precision)
+    return '{}?db={}&precision={}'.format(
+        url or _base_url, database, 'u' if precision == 'us' else precision)
+
 
-    LOGGER.debug('Processing batch %s for %s by measurement, %i left',
-                 batch, database, len(measurements))
+class _CircuitBreaker(object):
+    """Tracks consecutive failed batch submissions for an InfluxDB endpoint,
+    calculating the retry backoff and opening the circuit once
+    ``_failure_threshold`` consecutive submissions have failed.
 
-    url = '{}?db={}&precision=ms'.format(_base_url, database)
+    The backoff is doubled for each consecutive failure up to
+    ``_max_backoff_interval``, with a random jitter of up to half of the
+    backoff so that clients do not retry in lockstep.
 
-    measurement = measurements.pop(0)
+    The response latency of successful submissions is smoothed with an
+    exponentially weighted moving average, so the health of the endpoint
+    can be tracked passively from the batches that are submitted to it.
 
-    # Create the request future
-    future = _http_client.fetch(
-        url, method='POST', body=measurement.encode('utf-8'))
+    :param str url: The endpoint URL, for logging
 
-    # Check in 25ms to see if it's done
-    ioloop.IOLoop.current().add_timeout(
-        ioloop.IOLoop.current().time() + 0.025,
-        _write_error_batch_wait, future, batch, database, measurement,
-        measurements)
+    """
+    SMOOTHING = 0.2
 
+    def __init__(self, url):
+        self.url = url
+        self.failures = 0
+        self.latency = None
+        self.probing = False
+        self.retry_at = 0
+        self._open = False
 
-def _write_error_batch_wait(future, batch, database, measurement,
-                            measurements):
-    """Invoked by the IOLoop, this method checks if the HTTP request future
-    created by :meth:`_write_error_batch` is done. If it's done it will
-    evaluate the result, logging any error and moving on to the next
-    measurement. If there are no measurements left in the `measurements`
-    argument, it will consider the batch complete.
+    def allow(self, now):
+        """Return :data:`True` if a batch may be submitted. No batches are
+        allowed until the retry backoff after a failed submission has
+        passed, and while the circuit is half-open only a single probe batch
+        is allowed.
 
+        :param float now: The current IOLoop time
+        :rtype: bool
 
-    :param tornado.concurrent.Future future: The AsyncHTTPClient request future
-    :param str batch: The batch ID
-    :param str database: The database name for the measurements
-    :param str measurement: The measurement the future is for
-    :param list measurements: The measurements that failed to write as a batch
+        """
+        state = self.state(now)
+        if state == CIRCUIT_CLOSED:
+            return now >= self.retry_at
+        elif state == CIRCUIT_HALF_OPEN and not self.probing:
+            LOGGER.info('Submitting probe batch to %s', self.url)
+            self.probing = True
+            return True
+        return False
+
+    def degraded(self):
+        """Return :data:`True` if the last submission failed, or the
+        smoothed response latency is over ``_max_latency``.
+
+        :rtype: bool
+
+        """
+        return bool(self.failures or (
+            _max_latency and self.latency is not None and
+            self.latency * 1000 > _max_latency))
+
+    def delay(self, now):
+        """Return the number of seconds to wait before retrying a failed
+        submission.
+
+        :param float now: The current IOLoop time
+        :rtype: float
+
+        """
+        return max(self.retry_at - now, 0)
+
+    def on_failure(self, now):
+        """Record a failed batch submission, opening the circuit if the
+        failure threshold is reached or a probe batch failed.
+
+        :param float now: The current IOLoop time
+
+        """
+        self.failures += 1
+        self.probing = False
+        backoff = min(_backoff_interval * 2 ** min(self.failures - 1, 32),
+                      _max_backoff_interval) / 1000.0
+        self.retry_at = now + backoff / 2 + random.uniform(0, backoff / 2)
+        if not self._open and self.failures >= _failure_threshold:
+            LOGGER.warning('Opening the circuit for %s after %i failed '
+                           'submissions', self.url, self.failures)
+            self._open = True
+
+    def on_success(self, latency=None):
+        """Record a successful batch submission, closing the circuit.
+
+        :param float latency: The response latency in seconds
+
+        """
+        if self._open:
+            LOGGER.info('Closing the circuit for %s', self.url)
+        self.failures = 0
+        self.probing = False
+        self.retry_at = 0
+        self._open = False
+        if latency is not None:
+            self.latency = latency if self.latency is None else \
+                self.latency + self.SMOOTHING * (latency - self.latency)
+
+    def probe(self, now):
+        """Return :data:`True` if a probe batch may be submitted to a
+        degraded endpoint, allowing a single probe batch at a time once the
+        retry backoff has passed.
+
+        :param float now: The current IOLoop time
+        :rtype: bool
+
+        """
+        if self.probing or now < self.retry_at:
+            return False
+        LOGGER.info('Submitting probe batch to %s', self.url)
+        self.probing = True
+        return True
+
+    def state(self, now):
+        """Return the state of the circuit.
+
+        :param float now: The current IOLoop time
+        :rtype: str
+
+        """
+        if not self._open:
+            return CIRCUIT_CLOSED
+        elif now < self.retry_at:
+            return CIRCUIT_OPEN
+        return CIRCUIT_HALF_OPEN
+
+
+class _MeasurementBuffer(object):
+    """A first-in, first-out stack of marshalled measurements for a single
+    database. Measurements are appended to :class:`bytearray` chunks along
+    with the offset of the end of each line, so a batch is taken off of the
+    front of the stack as :class:`memoryview` slices of the chunks and copied
+    once into the request body. A chunk is closed once it holds
+    ``_max_batch_size`` measurements or a batch has been taken from it, and
+    adding a failed batch back to the stack stores the body as-is.
 
     """
-    if not future.done():
-        ioloop.IOLoop.current().add_timeout(
-            ioloop.IOLoop.current().time() + 0.025,
-            _write_error_batch_wait, future, batch, database, measurement,
-            measurements)
-        return
+    def __init__(self):
+        self._chunks = collections.deque()
+        self._closed = True
+        self._length = 0
+        self._offset = 0
 
-    error = future.exception()
-    if isinstance(error, httpclient.HTTPError):
-        if error.code == 400:
-            LOGGER.error('Error writing %s measurement from batch %s to '
-                         'InfluxDB (%s): %s', database, batch, error.code,
-                         error.response.body)
-            LOGGER.info('Bad %s measurement from batch %s: %s',
-                        database, batch, measurement)
+    def __len__(self):
+        return self._length
+
+    def append(self, value):
+        """Add a marshalled measurement to the end of the stack.
+
+        :param bytes value: The marshalled measurement
+
+        """
+        if (self._closed or not self._chunks or
+                len(self._chunks[-1][1]) >= _max_batch_size):
+            self._chunks.append((bytearray(), []))
+            self._closed = False
+        data, ends = self._chunks[-1]
+        data += value
+        data += b'\n'
+        ends.append(len(data))
+        self._length += 1
+
+    def extend(self, body):
+        """Add a body of marshalled measurements to the end of the stack. The
+        body is stored as a chunk as-is.
+
+        :param bytes body: The marshalled measurements, one per line
+
+        """
+        ends = []
+        end = body.find(b'\n')
+        while end >= 0:
+            ends.append(end + 1)
+            end = body.find(b'\n', end + 1)
+        if ends:
+            self._chunks.append((body, ends))
+            self._closed = True
+            self._length += len(ends)
+
+    def take(self, count):
+        """Remove up to ``count`` measurements from the front of the stack,
+        returning them as a request body along with the number of
+        measurements in it.
+
+        :param int count: The maximum number of measurements to return
+        :rtype: tuple(bytes, int)
+
+        """
+        pieces = []
+        taken = 0
+        while taken < count and self._chunks:
+            data, ends = self._chunks[0]
+            first = self._offset
+            self._offset = min(first + count - taken, len(ends))
+            taken += self._offset - first
+            pieces.append(memoryview(data)[
+                ends[first - 1] if first else 0:ends[self._offset - 1]])
+            if self._offset == len(ends):
+                self._chunks.popleft()
+                self._offset = 0
+            elif len(self._chunks) == 1:
+                self._closed = True
+        self._length -= taken
+        if len(pieces) == 1:
+            return pieces[0].tobytes(), taken
+        try:
+            return b''.join(pieces), taken
+        except TypeError:  # Python<3 can not join memoryviews
+            return b''.join([piece.tobytes() for piece in pieces]), taken
+
+
+class _QuantileSketch(object):
+    """A streaming quantile sketch with bounded memory that can be merged
+    with other sketches. Values are counted in logarithmically sized buckets
+    so each quantile is within ``RELATIVE_ACCURACY`` of the actual value,
+    and the lowest buckets are collapsed if there are more than
+    ``MAX_BUCKETS``.
+
+    """
+    MAX_BUCKETS = 2048
+    MIN_VALUE = 1e-9
+    RELATIVE_ACCURACY = 0.01
+
+    _gamma = (1 + RELATIVE_ACCURACY) / (1 - RELATIVE_ACCURACY)
+    _log_gamma = math.log(_gamma)
+
+    __slots__ = ('buckets', 'count', 'zero_count')
+
+    def __init__(self):
+        self.buckets = {}
+        self.count = 0
+        self.zero_count = 0
+
+    def add(self, value):
+        """Add a value to the sketch.
+
+        :param int|float value: The value to add
+
+        """
+        self.count += 1
+        if value < self.MIN_VALUE:
+            self.zero_count += 1
+            return
+        index = int(math.ceil(math.log(value) / self._log_gamma))
+        self.buckets[index] = self.buckets.get(index, 0) + 1
+        if len(self.buckets) > self.MAX_BUCKETS:
+            self._collapse()
+
+    def merge(self, other):
+        """Add the values counted by another sketch to this sketch.
+
+        :param _QuantileSketch other: The sketch to merge
+
+        """
+        self.count += other.count
+        self.zero_count += other.zero_count
+        for index, count in other.buckets.items():
+            self.buckets[index] = self.buckets.get(index, 0) + count
+        if len(self.buckets) > self.MAX_BUCKETS:
+            self._collapse()
+
+    def quantile(self, quantile):
+        """Return the estimated value at a quantile.
+
+        :param float quantile: The quantile, from ``0`` to ``1``
+        :rtype: float
+
+        """
+        if not self.count:
+            return None
+        rank = quantile * (self.count - 1)
+        total = self.zero_count
+        if rank < total:
+            return 0.0
+        for index in sorted(self.buckets):
+            total += self.buckets[index]
+            if rank < total:
+                break
+        return 2 * self._gamma ** index / (self._gamma + 1)
+
+    def _collapse(self):
+        """Merge the lowest buckets into the lowest bucket that is kept."""
+        indexes = sorted(self.buckets)
+        keep = indexes[-self.MAX_BUCKETS]
+        for index in indexes[:-self.MAX_BUCKETS]:
+            self.buckets[keep] += self.buckets.pop(index)
+
+
+class _Rollup(object):
+    """The number of measurements for a series in an aggregation interval,
+    the sum, minimum, and maximum of each of their numeric fields, and a
+    quantile sketch for each of their timings.
+
+    :param int end: The end of the interval in nanoseconds since the epoch
+
+    """
+    QUANTILES = (('p50', 0.5), ('p90', 0.9), ('p99', 0.99), ('p999', 0.999))
+
+    __slots__ = ('count', 'end', 'fields', 'sketches')
+
+    def __init__(self, end):
+        self.count = 0
+        self.end = end
+        self.fields = {}
+        self.sketches = {}
+
+    def add(self, fields, durations=None):
+        """Add the fields of a measurement to the rollup. Fields that do not
+        have a numeric value are ignored.
+
+        :param dict fields: The measurement fields
+        :param set durations: The names of the fields that are timings
+
+        """
+        self.count += 1
+        for name, value in fields.items():
+            if isinstance(value, bool) or \
+                    not isinstance(value, (int, float)):
+                continue
+            elif name not in self.fields:
+                self.fields[name] = [value, value, value]
+            else:
+                values = self.fields[name]
+                values[0] += value
+                values[1] = min(values[1], value)
+                values[2] = max(values[2], value)
+            if durations and name in durations:
+                if name not in self.sketches:
+                    self.sketches[name] = _QuantileSketch()
+                self.sketches[name].add(value)
+
+    def measurement(self, database, name, tags, timestamp):
+        """Return the rollup as a measurement with a ``count`` field,
+        ``_sum``, ``_min``, and ``_max`` fields for each aggregated field,
+        and ``_p50``, ``_p90``, ``_p99``, and ``_p999`` fields for each
+        timing.
+
+        :param str database: The database name for the measurement
+        :param str name: The measurement name
+        :param tuple tags: The tag key/value pairs for the measurement
+        :param int timestamp: The start of the interval in nanoseconds
+        :rtype: :class:`~sprockets_influxdb.Measurement`
+
+        """
+        measurement = Measurement(database, name)
+        measurement.tags = dict(tags)
+        measurement._timestamp = timestamp
+        measurement.set_field('count', self.count)
+        for field, (total, minimum, maximum) in self.fields.items():
+            measurement.set_field('{}_sum'.format(field), total)
+            measurement.set_field('{}_min'.format(field), minimum)
+            measurement.set_field('{}_max'.format(field), maximum)
+        for field, sketch in self.sketches.items():
+            for suffix, quantile in self.QUANTILES:
+                measurement.set_field('{}_{}'.format(field, suffix),
+                                      sketch.quantile(quantile))
+        return measurement
+
+
+class _SenderTransport(object):
+    """Forward marshalled measurements to a sender process over a Unix
+    domain socket, so a single process submits the measurements of all of
+    the worker processes in batches. Each batch is sent as a frame with the
+    length of the database name and of the body, followed by both.
+
+    The connection is made the first time measurements are sent, and is
+    made again after it is closed. Batches that can not be sent are added
+    back to the buffer like failed HTTP submissions.
+
+    :param str url: The ``unix:///path`` URL of the sender socket
+
+    """
+    HEADER = struct.Struct('!II')
+
+    def __init__(self, url):
+        self.path = url[len('unix://'):]
+        self._connecting = None
+        self._stream = None
+
+    def close(self):
+        """Close the connection."""
+        if self._stream is not None:
+            self._stream.close()
+            self._stream = None
+
+    @gen.coroutine
+    def write(self, database, body):
+        """Send the measurements to the sender process, connecting to it if
+        there is no open connection.
+
+        :param str database: The database the measurements are for
+        :param bytes body: The marshalled measurements, one per line
+        :rtype: tornado.concurrent.Future
+
+        """
+        if self._stream is None or self._stream.closed():
+            self._stream = iostream.IOStream(
+                socket.socket(socket.AF_UNIX, socket.SOCK_STREAM))
+            self._connecting = self._stream.connect(self.path)
+        yield self._connecting
+        name = database.encode('utf-8')
+        yield self._stream.write(
+            self.HEADER.pack(len(name), len(body)) + name + body)
+
+
+class _SpillQueue(object):
+    """A first-in, first-out stack of marshalled measurements for a single
+    database that is stored on disk. Measurements are appended to segment
+    files, read back with :mod:`mmap`, and each segment file is removed once
+    all of its measurements have been read.
+
+    :param str directory: The directory to store the segment files in
+
+    """
+    READ_SIZE = 1048576
+    SEGMENT_SIZE = 4194304
+
+    def __init__(self, directory):
+        self.directory = directory
+        self.size = 0
+        self._length = 0
+        self._offset = 0
+        self._segments = collections.deque()
+        self._writer = None
+        if not os.path.isdir(directory):
+            os.makedirs(directory)
+        for name in sorted(os.listdir(directory)):
+            if name.endswith('.seg'):
+                path = os.path.join(directory, name)
+                with open(path, 'rb') as handle:
+                    data = handle.read(self.READ_SIZE)
+                    while data:
+                        self._length += data.count(b'\n')
+                        self.size += len(data)
+                        data = handle.read(self.READ_SIZE)
+                self._segments.append(path)
+
+    def __len__(self):
+        return self._length
+
+    def append(self, value):
+        """Add a marshalled measurement to the end of the stack.
+
+        :param bytes value: The marshalled measurement
+
+        """
+        if self._writer is None or self._writer.tell() >= self.SEGMENT_SIZE:
+            self._open_segment()
+        data = value + b'\n'
+        self._writer.write(data)
+        self.size += len(data)
+        self._length += 1
+
+    def close(self):
+        """Close the segment file that is being written to."""
+        if self._writer is not None:
+            self._writer.close()
+            self._writer = None
+
+    def read(self, count):
+        """Remove up to ``count`` measurements from the front of the stack,
+        returning them as a body of marshalled measurements along with the
+        number of measurements in it.
+
+        :param int count: The maximum number of measurements to return
+        :rtype: tuple(bytes, int)
+
+        """
+        pieces = []
+        taken = 0
+        while taken < count and self._segments:
+            path = self._segments[0]
+            writing = self._writer is not None and self._writer.name == path
+            if writing:
+                self._writer.flush()
+            length = os.path.getsize(path)
+            if self._offset < length:
+                with open(path, 'rb') as handle:
+                    view = mmap.mmap(handle.fileno(), 0,
+                                     access=mmap.ACCESS_READ)
+                    try:
+                        start = end = self._offset
+                        while taken < count and self._offset < length:
+                            end = view.find(b'\n', self._offset)
+                            if end < 0:
+                                break
+                            self._offset = end + 1
+                            taken += 1
+                        if self._offset > start:
+                            pieces.append(view[start:self._offset])
+                        if end < 0:  # Discard a partially written line
+                            self._offset = length
+                    finally:
+                        view.close()
+            if self._offset < length:
+                break
+
+            # Remove the segment once all of its measurements are read
+            if writing:
+                self.close()
+            os.unlink(path)
+            self._segments.popleft()
+            self._offset = 0
+            self.size -= length
+        self._length -= taken
+        return b''.join(pieces), taken
+
+    def _open_segment(self):
+        """Close the current segment file and open a new one to append
+        measurements to.
+
+        """
+        self.close()
+        number = 0
+        if self._segments:
+            number = int(os.path.basename(self._segments[-1])[:-4]) + 1
+        path = os.path.join(self.directory, '{:020d}.seg'.format(number))
+        self._segments.append(path)
+        self._writer = open(path, 'ab')
+
+
+class _UDPTransport(object):
+    """Send marshalled measurements to an InfluxDB UDP listener, packing the
+    lines for each batch into datagrams that fit in a single Ethernet frame.
+    The socket is non-blocking, and datagrams that can not be sent right
+    away are dropped and counted instead of blocking the IOLoop.
+
+    The UDP listener writes to the database and with the timestamp precision
+    configured for its port, so one URL should be used per database, and
+    the precision set with :meth:`~sprockets_influxdb.set_precision` must
+    match the listener's, which is nanoseconds by default.
+
+    :param str url: The ``udp://host:port`` URL of the UDP listener
+
+    """
+    DEFAULT_PORT = 8089
+    MTU = 1500
+
+    def __init__(self, url):
+        netloc = url[len('udp://'):].split('/', 1)[0]
+        host, port = httputil.split_host_and_port(netloc)
+        self.host = host.strip('[]')
+        self.port = port or self.DEFAULT_PORT
+        self.datagram_size = None
+        self._address = None
+        self._resolving = None
+        self._socket = None
+
+    def close(self):
+        """Close the socket."""
+        if self._socket is not None:
+            self._socket.close()
+            self._socket = None
+
+    @gen.coroutine
+    def write(self, database, body):
+        """Send the measurements, resolving the listener address the first
+        time measurements are sent.
+
+        :param str database: The database the measurements are for
+        :param bytes body: The marshalled measurements, one per line
+        :rtype: tornado.concurrent.Future
+
+        """
+        if self._socket is None:
+            yield self._connect()
+        self._send(database, body)
+
+    @gen.coroutine
+    def _connect(self):
+        """Resolve the listener address without blocking the IOLoop and
+        create the socket for its address family. IP addresses are used as
+        is, and host names are resolved in a thread, since the default
+        resolver blocks the IOLoop with Tornado < 5.
+
+        """
+        if netutil.is_valid_ip(self.host):
+            family = socket.AF_INET6 if ':' in self.host else socket.AF_INET
+            addresses = [(family, (self.host, self.port))]
         else:
-            LOGGER.error('Error submitting individual metric for %s from '
-                         'batch %s to InfluxDB (%s): %s',
-                         database, batch, error.code)
-            measurements = measurements + [measurement]
-    elif isinstance(error, (TimeoutError, OSError, socket.error,
-                            select.error, ssl.socket_error)):
-        LOGGER.error('Error submitting individual metric for %s from batch '
-                     '%s to InfluxDB (%s)', database, batch, error)
-        _write_error_batch(batch, database, measurements + [measurement])
-        measurements = measurements + [measurement]
-
-    if not measurements:
-        LOGGER.info('All %s measurements from batch %s processed',
-                    database, batch)
-        return
+            if self._resolving is None:
+                self._resolving = netutil.ThreadedResolver().resolve(
+                    self.host, self.port, socket.AF_UNSPEC)
+            try:
+                addresses = yield self._resolving
+            except Exception:
+                self._resolving = None
+                raise
+        if self._socket is None:
+            family, self._address = addresses[0]
+            self._socket = socket.socket(family, socket.SOCK_DGRAM)
+            self._socket.setblocking(False)
+            header = 40 if family == socket.AF_INET6 else 20
+            self.datagram_size = self.MTU - header - 8
+
+    def _datagrams(self, body):
+        """Yield the start and end offsets of the datagrams to send the lines
+        in, each up to ``datagram_size`` bytes. A line that is longer than a
+        datagram is sent on its own.
+
+        :param bytes body: The marshalled measurements, one per line
+        :rtype: iterator
 
-    # Continue writing measurements
-    _write_error_batch(batch, database, measurements)
+        """
+        start = end = 0
+        while end < len(body):
+            line_end = body.find(b'\n', end) + 1 or len(body)
+            if line_end - start > self.datagram_size and end > start:
+                yield start, end
+                start = end
+            end = line_end
+        if end > start:
+            yield start, end
+
+    def _send(self, database, body):
+        """Send the lines in datagrams, dropping the datagrams that can not
+        be sent.
+
+        :param str database: The database the measurements are for
+        :param bytes body: The marshalled measurements, one per line
+
+        """
+        view = memoryview(body)
+        dropped, error, sent = 0, None, 0
+        for start, end in self._datagrams(body):
+            try:
+                self._socket.sendto(view[start:end], self._address)
+            except (OSError, socket.error) as err:
+                dropped, error = dropped + 1, err
+            else:
+                sent += 1
+        _stats['datagrams_sent'] += sent
+        if dropped:
+            LOGGER.warning('Dropped %i of %i %s datagrams: %s',
+                           dropped, dropped + sent, database, error)
+            _stats['datagrams_dropped'] += dropped
 
 
 class Measurement(object):
@@ -831,12 +3476,52 @@ class Measurement(object):
     :param str name: The measurement name
 
     """
+    __slots__ = ('database', 'name', 'fields',
+                 '_base_tags', '_durations', '_tags', '_timestamp')
+
     def __init__(self, database, name):
         self.database = database
         self.name = name
         self.fields = {}
-        self.tags = dict(_base_tags)
-        self.timestamp = time.time()
+        self._base_tags = _base_tags
+        self._durations = None
+        self._tags = {}
+        self._timestamp = _time_ns()
+
+    @property
+    def tags(self):
+        """The tags for the measurement, including the base tags. The base
+        tags are shared by all measurements until the tags are accessed
+        through this property, which copies them into the measurement's own
+        tags so changes to the returned dict are kept.
+
+        :rtype: dict
+
+        """
+        if self._base_tags:
+            tags = dict(self._base_tags)
+            tags.update(self._tags)
+            self._base_tags, self._tags = {}, tags
+        return self._tags
+
+    @tags.setter
+    def tags(self, value):
+        self._base_tags, self._tags = {}, value
+
+    @property
+    def timestamp(self):
+        """The timestamp of the measurement in seconds since the epoch. The
+        timestamp is stored as integer nanoseconds and is written to InfluxDB
+        with the precision set for the measurement's database.
+
+        :rtype: float
+
+        """
+        return self._timestamp / 1000000000.0
+
+    @timestamp.setter
+    def timestamp(self, value):
+        self._timestamp = int(round(value * 1000000000))
 
     @contextlib.contextmanager
     def duration(self, name):
@@ -846,7 +3531,9 @@ class Measurement(object):
 
         This method returns a context manager that records the amount
         of time spent inside of the context, adding the timing to the
-        measurement.
+        measurement. When :class:`~sprockets_influxdb.InfluxDBMixin`
+        request measurements are aggregated, the p50, p90, p99, and p999
+        quantiles of the timing are submitted for each interval.
 
         """
         start = time.time()
@@ -854,19 +3541,22 @@ class Measurement(object):
             yield
         finally:
             self.set_field(name, max(time.time(), start) - start)
+            self._add_duration(name)
 
-    def marshall(self):
+    def marshall(self, as_bytes=False):
         """Return the measurement in the line protocol format.
 
-        :rtype: str
+        :param bool as_bytes: Return the measurement encoded as UTF-8 bytes,
+            ready to be added to a request body
+        :rtype: str|bytes
 
         """
-        return '{},{} {} {}'.format(
-            self._escape(self.name),
-            ','.join(['{}={}'.format(self._escape(k), self._escape(v))
-                      for k, v in self.tags.items()]),
+        value = '{} {} {}'.format(
+            _series_key(self.name, self._tag_items()),
             self._marshall_fields(),
-            int(self.timestamp * 1000))
+            self._timestamp // _precision_divisors[
+                _database_precisions.get(self.database, _precision)])
+        return value.encode('utf-8') if as_bytes else value
 
     def set_field(self, name, value):
         """Set the value of a field in the measurement.
@@ -891,7 +3581,7 @@ class Measurement(object):
         if one exists.
 
         """
-        self.tags[name] = value
+        self._tags[name] = value
 
     def set_tags(self, tags):
         """Set multiple tags for the measurement.
@@ -908,11 +3598,23 @@ class Measurement(object):
     def set_timestamp(self, value):
         """Override the timestamp of a measurement.
 
-        :param float value: The timestamp to assign to the measurement
+        :param float value: The timestamp to assign to the measurement, in
+            seconds since the epoch
 
         """
         self.timestamp = value
 
+    def _add_duration(self, name):
+        """Mark a field as a timing, so the quantiles of the field are
+        submitted when the measurement is aggregated.
+
+        :param str name: The field name
+
+        """
+        if self._durations is None:
+            self._durations = set()
+        self._durations.add(name)
+
     @staticmethod
     def _escape(value):
         """Escape a string (key or value) for InfluxDB's line protocol.
@@ -926,6 +3628,22 @@ class Measurement(object):
             value = value.replace(char, escaped)
         return value
 
+    def _tag_items(self):
+        """Return the tag key/value pairs for the measurement sorted by key,
+        merging the base tags and the measurement's own tags without copying
+        the base tags.
+
+        :rtype: list
+
+        """
+        base_tags, tags = self._base_tags, self._tags
+        if not base_tags:
+            keys = _sorted_tag_keys(frozenset(tags))
+            return [(key, tags[key]) for key in keys]
+        keys = _sorted_tag_keys(frozenset(tags).union(base_tags))
+        return [(key, tags[key] if key in tags else base_tags[key])
+                for key in keys]
+
     def _marshall_fields(self):
         """Convert the field dict into the string segment of field key/value
         pairs.
@@ -935,15 +3653,31 @@ class Measurement(object):
         """
         values = {}
         for key, value in self.fields.items():
-            if (isinstance(value, int) or
-                    (isinstance(value, str) and value.isdigit() and
-                     '.' not in value)):
-                values[key] = '{}i'.format(value)
-            elif isinstance(value, bool):
-                values[key] = self._escape(value)
-            elif isinstance(value, float):
-                values[key] = '{}'.format(value)
-            elif isinstance(value, str):
-                values[key] = '"{}"'.format(self._escape(value))
+            value = self._marshall_field(value)
+            if value is not None:
+                values[key] = value
         return ','.join(['{}={}'.format(self._escape(k), v)
                          for k, v in values.items()])
+
+    @classmethod
+    def _marshall_field(cls, value):
+        """Convert a field value into its line protocol representation.
+
+        :param int|float|bool|str value: The field value
+        :rtype: str or None
+
+        """
+        if (isinstance(value, int) or
+                (isinstance(value, str) and value.isdigit() and
+                 '.' not in value)):
+            return '{}i'.format(value)
+        elif isinstance(value, bool):
+            return cls._escape(value)
+        elif isinstance(value, float):
+            return '{}'.format(value)
+        elif isinstance(value, str):
+            return '"{}"'.format(cls._escape(value))
+
+
+if hasattr(os, 'register_at_fork'):  # Python>=3.7
+    os.register_at_fork(after_in_child=_after_fork)
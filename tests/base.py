@@ -22,32 +22,134 @@ FIELD_PATTERN = re.compile(r'(?P<key>(?:(?:\\ )|(?:\\,)|(?:\\")|(?:[\w\-_./]+)'
 
 
 Measurement = collections.namedtuple(
-    'measurement', ['db', 'timestamp', 'name', 'tags', 'fields', 'headers'])
+    'measurement', ['db', 'timestamp', 'name', 'tags', 'fields', 'headers',
+                    'precision'])
 
 measurements = collections.deque()
 
 
 def clear_influxdb_module():
     for variable in {'INFLUXDB_SCHEME', 'INFLUXDB_HOST', 'INFLUXDB_PORT',
-                     'INFLUXDB_USER', 'INFLUXDB_PASSWORD'}:
+                     'INFLUXDB_USER', 'INFLUXDB_PASSWORD',
+                     'INFLUXDB_COMPRESSION', 'INFLUXDB_HTTP_BACKEND',
+                     'INFLUXDB_MAX_LATENCY', 'INFLUXDB_PRECISION',
+                     'INFLUXDB_REPLICAS', 'INFLUXDB_ROUTING',
+                     'INFLUXDB_STATS_DATABASE', 'INFLUXDB_URLS'}:
         if variable in os.environ:
             del os.environ[variable]
+    influxdb._aggregation_interval = 0
+    influxdb._backoff_interval = 1000
     influxdb._base_tags = {}
     influxdb._base_url = 'http://localhost:8086/write'
+    influxdb._batch_future = None
+    influxdb._buffer_size = 0
+    influxdb._circuit_breakers = {}
+    influxdb._compression_level = 0
+    influxdb._compression_threshold = 1024
     influxdb._credentials = None, None
+    influxdb._database_precisions = {}
     influxdb._dirty = False
+    influxdb._endpoint_backlog.clear()
+    influxdb._endpoint_in_flight.clear()
+    influxdb._failure_threshold = 3
+    influxdb._http_backend = 'simple'
     influxdb._http_client = None
+    influxdb._http_client_requests.clear()
+    influxdb._http_clients = {}
+    influxdb._in_flight = {}
+    influxdb._in_flight_total = 0
+    influxdb._install_thread = None
     influxdb._installed = False
+    influxdb._io_loop = None
+    influxdb._io_loop_thread = None
     influxdb._last_warning = None
     influxdb._measurements = {}
+    influxdb._max_backoff_interval = 60000
     influxdb._max_batch_size = 5000
+    influxdb._max_buffer_size = 25000
     influxdb._max_clients = 10
+    influxdb._max_inflight_batches = 10
+    influxdb._max_latency = 0
+    influxdb._max_series_cache_size = 10000
+    influxdb._max_spill_bytes = 268435456
+    influxdb._precision = 'ms'
+    influxdb._precision_configured = False
+    influxdb._sample_probability = 1.0
+    influxdb._series_cache.clear()
+    influxdb._series_cache_hits = 0
+    influxdb._series_cache_misses = 0
+    influxdb._spill_bytes = 0
+    influxdb._spill_directory = None
+    influxdb._spill_size = 0
+    for queue in influxdb._spills.values():
+        queue.close()
+    influxdb._spills = {}
+    influxdb._rejected_callback = None
+    influxdb._replicas = []
+    influxdb._retired_http_clients.clear()
+    influxdb._ring = []
+    influxdb._ring_points = []
+    influxdb._routing = influxdb.ROUTING_DATABASE
+    influxdb._stats.clear()
+    influxdb._stats_database = None
+    influxdb._stats_durations = {}
+    influxdb._stats_interval = 60000
+    influxdb._stats_timeout = None
+    influxdb._rollup_timeout = None
+    influxdb._rollups = {}
+    influxdb._tag_key_orders.clear()
+    influxdb._thread_queue.clear()
+    influxdb._thread_queue_scheduled = False
     influxdb._timeout = None
+    influxdb._timeout_interval = 60000
+    influxdb._trigger_size = 5000
     influxdb._stopping = False
+    if influxdb._udp_transport:
+        influxdb._udp_transport.close()
+    influxdb._udp_transport = None
+    influxdb._urls = []
     influxdb._warn_threshold = 5000
     influxdb._writing = False
 
 
+def add_measurements(database, count, name='test-measurement', tags=None,
+                     start=0, invalid=(), timestamp=None):
+    """Add ``count`` measurements to the buffer, each with the ``test``
+    field set to its iteration number.
+
+    :param str database: The database to add the measurements to
+    :param int count: The number of measurements to add
+    :param str name: The measurement name
+    :param dict tags: Tags to set on each measurement
+    :param int start: The first iteration number
+    :param set invalid: Iterations to add with a name InfluxDB rejects
+    :param float timestamp: The timestamp to set on each measurement
+
+    """
+    for iteration in range(start, start + count):
+        measurement = influxdb.Measurement(
+            database, 'bad=name' if iteration in invalid else name)
+        for key, value in (tags or {}).items():
+            measurement.set_tag(key, value)
+        measurement.set_field('test', iteration)
+        if timestamp is not None:
+            measurement.set_timestamp(timestamp)
+        influxdb.add_measurement(measurement)
+
+
+@gen.coroutine
+def wait_for(condition, timeout=5):
+    """Run the IOLoop until the condition is true, since the number of
+    IOLoop iterations callbacks take differs between Tornado versions.
+
+    """
+    for _iteration in range(0, int(timeout * 1000)):
+        if condition():
+            return
+        yield gen.sleep(0.001)
+    raise AssertionError('Timed out waiting for {!r}'.format(condition))
+
+
 def _strip_backslashes(line):
     for sequence in {'\\ ', '\\,', '\\"'}:
         line = line.replace(sequence, sequence[-1])
@@ -92,6 +194,9 @@ class AsyncServerTestCase(testing.AsyncHTTPTestCase):
             self.io_loop.add_future(future, self.stop)
             self.wait()
 
+    def get_httpserver_options(self):
+        return {'decompress_request': True}
+
     def get_app(self):
         if not self.application:
             settings = {influxdb.REQUEST_DATABASE: 'database-name',
@@ -151,10 +256,16 @@ class FakeInfluxDBHandler(web.RequestHandler):
 
     def post(self, *args, **kwargs):
         db = self.get_query_argument('db')
+        precision = self.get_query_argument('precision')
         payload = self.request.body.decode('utf-8')
+        values = []
         for line in payload.splitlines():
             LOGGER.debug('Line: %r', line)
             parts = LINE_PATTERN.match(line)
+            if not parts:
+                self.set_status(400)
+                self.write({'error': 'unable to parse {!r}'.format(line)})
+                return
             name, tags_str, fields_str, timestamp = parts.groups()
 
             matches = TAG_PATTERN.findall(tags_str)
@@ -174,7 +285,8 @@ class FakeInfluxDBHandler(web.RequestHandler):
                 else:
                     fields[key] = float(value)
 
-            measurements.append(
+            values.append(
                 Measurement(db, int(timestamp), name, tags, fields,
-                            self.request.headers))
+                            self.request.headers, precision))
+        measurements.extend(values)
         self.set_status(204)
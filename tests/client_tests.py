@@ -1,9 +1,19 @@
 import base64
+import os
 import random
 import mock
+import shutil
+import socket
+import tempfile
+import threading
+import time
+import unittest
 import uuid
+import zlib
+from concurrent import futures
 
-from tornado import concurrent, gen, httpclient
+from tornado import (concurrent, gen, httpclient, ioloop, iostream, netutil,
+                     testing)
 
 import sprockets_influxdb as influxdb
 
@@ -112,6 +122,7 @@ class MeasurementTestCase(base.AsyncServerTestCase):
             future.set_exception(httpclient.HTTPError(599, 'TestError'))
             self.flush()
         self.assertEqual(influxdb._pending_measurements(), 1)
+        influxdb._circuit_breaker().retry_at = 0  # Skip the retry backoff
         self.flush()
         result = self.get_measurement()
         self.assertEqual(result.db, database)
@@ -133,6 +144,7 @@ class MeasurementTestCase(base.AsyncServerTestCase):
             fetch.return_value = future
             influxdb._on_timeout()
         self.assertEqual(influxdb._pending_measurements(), 1)
+        influxdb._circuit_breaker().retry_at = 0  # Skip the retry backoff
         self.flush()
         result = self.get_measurement()
         self.assertEqual(result.db, database)
@@ -222,3 +234,1742 @@ class SampleProbabilityTestCase(base.AsyncServerTestCase):
         result = influxdb._sample_batch()
         self.assertTrue(result)
         self.assertEqual(influxdb._pending_measurements(), 1000)
+
+
+class BufferSizeTestCase(base.AsyncServerTestCase):
+
+    def test_buffer_size_tracks_adds_across_databases(self):
+        base.add_measurements(str(uuid.uuid4()), 10, 'buffer-test')
+        base.add_measurements(str(uuid.uuid4()), 15, 'buffer-test')
+        self.assertEqual(influxdb._buffer_size, 25)
+        self.assertEqual(influxdb._pending_measurements(), 25)
+
+    def test_buffer_size_after_write(self):
+        influxdb.set_max_batch_size(10)
+        influxdb.set_max_inflight_batches(1)
+        base.add_measurements(str(uuid.uuid4()), 25, 'buffer-test')
+        self.flush()
+        self.assertEqual(influxdb._buffer_size, 15)
+
+    def test_buffer_size_after_requeue(self):
+        base.add_measurements(str(uuid.uuid4()), 5, 'buffer-test')
+        with mock.patch('tornado.httpclient.AsyncHTTPClient.fetch') as fetch:
+            future = concurrent.Future()
+            fetch.return_value = future
+            future.set_exception(httpclient.HTTPError(599, 'TestError'))
+            self.flush()
+        self.assertEqual(influxdb._buffer_size, 5)
+
+    def test_buffer_size_after_sampling_drop(self):
+        influxdb.set_max_batch_size(10)
+        influxdb.set_sample_probability(0.0)
+        base.add_measurements(str(uuid.uuid4()), 4, 'buffer-test')
+        base.add_measurements(str(uuid.uuid4()), 25, 'buffer-test')
+        influxdb._sample_batch()
+        self.assertEqual(influxdb._buffer_size, 15)
+
+    def test_measurements_discarded_at_max_buffer_size(self):
+        influxdb.set_max_buffer_size(20)
+        base.add_measurements(str(uuid.uuid4()), 30, 'buffer-test')
+        self.assertEqual(influxdb._buffer_size, 20)
+
+
+class BaseTagsTestCase(base.TestCase):
+
+    def setUp(self):
+        super(BaseTagsTestCase, self).setUp()
+        influxdb._base_tags = {'environment': 'testing', 'hostname': 'host'}
+        self.measurement = influxdb.Measurement('database', 'name')
+        self.measurement.set_field('value', 1)
+        self.measurement.set_timestamp(1.0)
+
+    def test_base_tags_are_not_copied(self):
+        self.assertIs(self.measurement._base_tags, influxdb._base_tags)
+        self.assertEqual(self.measurement._tags, {})
+
+    def test_measurement_has_no_instance_dict(self):
+        self.assertFalse(hasattr(self.measurement, '__dict__'))
+
+    def test_set_tag_overrides_base_tag(self):
+        self.measurement.set_tag('hostname', 'other')
+        self.measurement.set_tag('method', 'GET')
+        self.assertEqual(influxdb._base_tags['hostname'], 'host')
+        line = self.measurement.marshall()
+        self.assertIn('environment=testing', line)
+        self.assertIn('hostname=other', line)
+        self.assertIn('method=GET', line)
+        self.assertNotIn('hostname=host', line)
+
+    def test_tags_include_base_tags(self):
+        self.measurement.set_tag('method', 'GET')
+        self.assertEqual(self.measurement.tags,
+                         {'environment': 'testing', 'hostname': 'host',
+                          'method': 'GET'})
+
+    def test_tags_changes_are_kept(self):
+        self.measurement.tags['hostname'] = 'other'
+        del self.measurement.tags['environment']
+        self.assertEqual(influxdb._base_tags,
+                         {'environment': 'testing', 'hostname': 'host'})
+        self.assertEqual(self.measurement.marshall(),
+                         'name,hostname=other value=1i 1000')
+
+    def test_install_does_not_change_existing_base_tags(self):
+        influxdb.install(base_tags={'hostname': 'new-host'})
+        self.assertEqual(self.measurement.tags['hostname'], 'host')
+
+
+class SeriesKeyCacheTestCase(base.TestCase):
+
+    def setUp(self):
+        super(SeriesKeyCacheTestCase, self).setUp()
+        influxdb._base_tags = {'hostname': 'host'}
+
+    @staticmethod
+    def marshall(name, method='GET'):
+        measurement = influxdb.Measurement('database', name)
+        measurement.set_tag('method', method)
+        measurement.set_field('value', 1)
+        measurement.set_timestamp(1.0)
+        return measurement.marshall()
+
+    def test_repeated_series_key_is_cached(self):
+        for _iteration in range(0, 3):
+            self.assertEqual(
+                self.marshall('my name'),
+                'my\\ name,hostname=host,method=GET value=1i 1000')
+        self.assertEqual(influxdb._series_cache_misses, 1)
+        self.assertEqual(influxdb._series_cache_hits, 2)
+
+    def test_distinct_tags_are_cached_separately(self):
+        self.assertEqual(self.marshall('name', 'GET'),
+                         'name,hostname=host,method=GET value=1i 1000')
+        self.assertEqual(self.marshall('name', 'POST'),
+                         'name,hostname=host,method=POST value=1i 1000')
+        self.assertEqual(influxdb._series_cache_misses, 2)
+        self.assertEqual(len(influxdb._series_cache), 2)
+
+    def test_equal_tag_values_of_other_types_are_cached_separately(self):
+        for value in (1, True, 1.0):
+            self.assertEqual(
+                self.marshall('name', value),
+                'name,hostname=host,method={} value=1i 1000'.format(value))
+        self.assertEqual(influxdb._series_cache_misses, 3)
+
+    def test_least_recently_used_key_is_evicted(self):
+        influxdb.set_series_cache_size(2)
+        self.marshall('first')
+        self.marshall('second')
+        self.marshall('first')
+        self.marshall('third')
+        self.assertEqual([key[0] for key in influxdb._series_cache],
+                         ['first', 'third'])
+
+    def test_cache_disabled(self):
+        influxdb.set_series_cache_size(0)
+        self.assertEqual(self.marshall('name'),
+                         'name,hostname=host,method=GET value=1i 1000')
+        self.assertEqual(len(influxdb._series_cache), 0)
+        self.assertEqual(influxdb._series_cache_misses, 1)
+
+
+class SortedTagsTestCase(base.TestCase):
+
+    EXPECTATION = (b'name,endpoint=/,environment=testing,handler=handler,'
+                   b'hostname=host,method=GET value=1i 1000')
+
+    def setUp(self):
+        super(SortedTagsTestCase, self).setUp()
+        influxdb._base_tags = {'hostname': 'host', 'environment': 'testing'}
+
+    @staticmethod
+    def measurement():
+        measurement = influxdb.Measurement('database', 'name')
+        measurement.set_field('value', 1)
+        measurement.set_timestamp(1.0)
+        return measurement
+
+    def test_set_tags_order_does_not_change_output(self):
+        tags = [('method', 'GET'), ('handler', 'handler'), ('endpoint', '/')]
+        for order in (tags, list(reversed(tags)), tags[1:] + tags[:1]):
+            influxdb._series_cache.clear()
+            measurement = self.measurement()
+            for key, value in order:
+                measurement.set_tag(key, value)
+            self.assertEqual(measurement.marshall(True), self.EXPECTATION)
+
+    def test_base_tags_order_does_not_change_output(self):
+        influxdb._base_tags = {'environment': 'testing', 'hostname': 'host'}
+        first = self.measurement()
+        first.set_tags({'method': 'GET', 'handler': 'handler',
+                        'endpoint': '/'})
+        influxdb._base_tags = {'hostname': 'host', 'method': 'GET'}
+        second = self.measurement()
+        second.set_tags({'endpoint': '/', 'environment': 'testing',
+                         'handler': 'handler'})
+        self.assertEqual(first.marshall(True), self.EXPECTATION)
+        self.assertEqual(second.marshall(True), self.EXPECTATION)
+
+    def test_overridden_base_tag_is_sorted(self):
+        measurement = self.measurement()
+        measurement.set_tags({'method': 'GET', 'handler': 'handler',
+                              'endpoint': '/', 'hostname': 'other'})
+        self.assertEqual(measurement.marshall(True), self.EXPECTATION.replace(
+            b'hostname=host', b'hostname=other'))
+
+    def test_materialized_tags_are_sorted(self):
+        measurement = self.measurement()
+        measurement.tags['method'] = 'GET'
+        measurement.tags.update({'handler': 'handler', 'endpoint': '/'})
+        self.assertEqual(measurement.marshall(True), self.EXPECTATION)
+
+    def test_sort_order_is_cached_per_key_set(self):
+        for method in ('GET', 'POST'):
+            measurement = self.measurement()
+            measurement.set_tags({'method': method, 'handler': 'handler',
+                                  'endpoint': '/'})
+            measurement.marshall()
+        self.assertEqual(list(influxdb._tag_key_orders.values()),
+                         [('endpoint', 'environment', 'handler', 'hostname',
+                           'method')])
+
+
+class PrecisionTestCase(base.AsyncServerTestCase):
+
+    def setUp(self):
+        super(PrecisionTestCase, self).setUp()
+        base.measurements.clear()
+        self.database = str(uuid.uuid4())
+
+    def write_measurement(self, database=None):
+        base.add_measurements(database or self.database, 1, 'precision-test',
+                              timestamp=1500000000.123456789)
+        self.flush()
+        return self.get_measurement()
+
+    def test_default_precision_is_milliseconds(self):
+        result = self.write_measurement()
+        self.assertEqual(result.precision, 'ms')
+        self.assertEqual(result.timestamp, 1500000000123)
+
+    def test_precision(self):
+        for precision, timestamp in [('s', 1500000000),
+                                     ('u', 1500000000123456),
+                                     ('ns', 1500000000123456768)]:
+            influxdb.set_precision('us' if precision == 'u' else precision)
+            result = self.write_measurement()
+            self.assertEqual(result.precision, precision)
+            self.assertEqual(result.timestamp, timestamp)
+
+    def test_database_precision(self):
+        database = str(uuid.uuid4())
+        influxdb.set_precision('s', database)
+        result = self.write_measurement(database)
+        self.assertEqual(result.precision, 's')
+        self.assertEqual(result.timestamp, 1500000000)
+        result = self.write_measurement()
+        self.assertEqual(result.precision, 'ms')
+        self.assertEqual(result.timestamp, 1500000000123)
+
+    def test_invalid_precision_raises_value_error(self):
+        with self.assertRaises(ValueError):
+            influxdb.set_precision('m')
+        with self.assertRaises(ValueError):
+            influxdb.set_precision('h', self.database)
+
+    def test_timestamp_is_integer_nanoseconds(self):
+        start = time.time()
+        measurement = influxdb.Measurement(self.database, 'precision-test')
+        self.assertIsInstance(measurement._timestamp, int)
+        self.assertGreaterEqual(measurement.timestamp, start - 0.001)
+        self.assertLessEqual(measurement.timestamp, time.time() + 0.001)
+        measurement.timestamp = 1.5
+        self.assertEqual(measurement._timestamp, 1500000000)
+        self.assertEqual(measurement.timestamp, 1.5)
+
+
+class QuantileSketchTestCase(base.TestCase):
+
+    @staticmethod
+    def exact(values, quantile):
+        return sorted(values)[int(quantile * (len(values) - 1))]
+
+    def test_quantiles_are_within_relative_accuracy(self):
+        values = [random.lognormvariate(-3, 1) for _i in range(0, 10000)]
+        sketch = influxdb._QuantileSketch()
+        for value in values:
+            sketch.add(value)
+        self.assertEqual(sketch.count, 10000)
+        for quantile in (0.5, 0.9, 0.99, 0.999):
+            expectation = self.exact(values, quantile)
+            self.assertAlmostEqual(
+                sketch.quantile(quantile), expectation,
+                delta=expectation * influxdb._QuantileSketch.RELATIVE_ACCURACY)
+
+    def test_merged_sketches_match_a_single_sketch(self):
+        values = [random.random() for _i in range(0, 1000)]
+        first, second = influxdb._QuantileSketch(), influxdb._QuantileSketch()
+        combined = influxdb._QuantileSketch()
+        for index, value in enumerate(values):
+            (first if index % 2 else second).add(value)
+            combined.add(value)
+        first.merge(second)
+        self.assertEqual(first.count, combined.count)
+        self.assertEqual(first.buckets, combined.buckets)
+        self.assertEqual(first.quantile(0.99), combined.quantile(0.99))
+
+    def test_zero_values(self):
+        sketch = influxdb._QuantileSketch()
+        for value in (0, 0, 0, 1.0):
+            sketch.add(value)
+        self.assertEqual(sketch.quantile(0.5), 0.0)
+        self.assertAlmostEqual(sketch.quantile(1), 1.0, delta=0.01)
+
+    def test_empty_sketch(self):
+        self.assertIsNone(influxdb._QuantileSketch().quantile(0.5))
+
+    def test_buckets_are_bounded(self):
+        sketch = influxdb._QuantileSketch()
+        with mock.patch.object(influxdb._QuantileSketch, 'MAX_BUCKETS', 10):
+            for exponent in range(0, 100):
+                sketch.add(1.1 ** exponent)
+        self.assertEqual(len(sketch.buckets), 10)
+        self.assertEqual(sketch.count, 100)
+        self.assertAlmostEqual(sketch.quantile(1), 1.1 ** 99,
+                               delta=1.1 ** 99 * 0.01)
+
+    def test_duration_is_sketched_when_aggregated(self):
+        influxdb.set_aggregation_interval(60000)
+        for _iteration in range(0, 10):
+            measurement = influxdb.Measurement('database', 'name')
+            with measurement.duration('query'):
+                pass
+            measurement.set_field('rows', 10)
+            influxdb._aggregate_measurement(measurement)
+        rollup = list(influxdb._rollups.values())[0]
+        self.assertEqual(list(rollup.sketches), ['query'])
+        fields = rollup.measurement('database', 'name', (), 0).fields
+        for suffix in ('p50', 'p90', 'p99', 'p999'):
+            self.assertIn('query_{}'.format(suffix), fields)
+            self.assertNotIn('rows_{}'.format(suffix), fields)
+
+
+class ColumnarMeasurementsTestCase(base.AsyncServerTestCase):
+
+    def setUp(self):
+        super(ColumnarMeasurementsTestCase, self).setUp()
+        base.measurements.clear()
+        influxdb._base_tags = {'hostname': 'host'}
+        self.database = str(uuid.uuid4())
+        self.fields = {'duration': [0.5, 1.25, 0.125],
+                       'rows': [10, 20, 30],
+                       'query': ['select 1', 'select 2', 'select 3']}
+        self.timestamps = [1500000000.0, 1500000001.5, 1500000002.25]
+
+    def expectation(self, tags):
+        lines = []
+        for index, timestamp in enumerate(self.timestamps):
+            measurement = influxdb.Measurement(self.database, 'columnar')
+            for key, values in self.fields.items():
+                measurement.set_field(key, values[index])
+            for key, value in tags.items():
+                measurement.set_tag(
+                    key, value[index] if isinstance(value, list) else value)
+            measurement.set_timestamp(timestamp)
+            lines.append(measurement.marshall())
+        return lines
+
+    def buffered(self):
+        body, count = influxdb._measurements[self.database].take(100)
+        return body.decode('utf-8').splitlines()
+
+    def add(self, tags):
+        influxdb.add_measurements_columnar(
+            self.database, 'columnar', tags, self.fields, self.timestamps)
+
+    def test_lines_match_measurements(self):
+        tags = {'table': 'users', 'operation': 'select'}
+        with mock.patch('sprockets_influxdb.numpy', None):
+            self.add(tags)
+        self.assertEqual(influxdb._buffer_size, 3)
+        self.assertEqual(self.buffered(), self.expectation(tags))
+
+    def test_tag_columns(self):
+        tags = {'table': ['users', 'orders', 'users'], 'operation': 'select'}
+        with mock.patch('sprockets_influxdb.numpy', None):
+            self.add(tags)
+        self.assertEqual(self.buffered(), self.expectation(tags))
+
+    @unittest.skipIf(influxdb.numpy is None, 'NumPy is not installed')
+    def test_numpy_lines_match_measurements(self):
+        tags = {'table': 'users', 'operation': 'select'}
+        self.fields = {'duration': influxdb.numpy.array([0.5, 1.25, 0.125]),
+                       'rows': influxdb.numpy.array([10, 20, 30]),
+                       'query': ['select 1', 'select 2', 'select 3']}
+        self.add(tags)
+        self.fields = {'duration': [0.5, 1.25, 0.125],
+                       'rows': [10, 20, 30],
+                       'query': ['select 1', 'select 2', 'select 3']}
+        self.assertEqual(self.buffered(), self.expectation(tags))
+
+    def test_field_types_are_inferred_per_value(self):
+        self.fields = {'value': [1, 2.5]}
+        self.timestamps = self.timestamps[:2]
+        with mock.patch('sprockets_influxdb.numpy', None):
+            self.add({})
+        self.assertEqual(self.buffered(), self.expectation({}))
+
+    @unittest.skipIf(influxdb.numpy is None, 'NumPy is not installed')
+    def test_numpy_field_types_match_lists(self):
+        self.fields = {'value': influxdb.numpy.array([1, 2]),
+                       'ratio': influxdb.numpy.array([1.0, 2.5])}
+        self.timestamps = influxdb.numpy.array(self.timestamps[:2])
+        self.add({})
+        self.fields = {'value': [1, 2], 'ratio': [1.0, 2.5]}
+        self.timestamps = self.timestamps.tolist()
+        self.assertEqual(self.buffered(), self.expectation({}))
+
+    def test_invalid_values_raise_value_error(self):
+        self.fields = {'value': [1, None, 3]}
+        with self.assertRaises(ValueError):
+            self.add({})
+        self.assertEqual(influxdb._buffer_size, 0)
+
+    def test_measurements_are_submitted(self):
+        self.add({'table': 'users'})
+        self.flush()
+        self.assertEqual(len(base.measurements), 3)
+        result = base.measurements.popleft()
+        self.assertEqual(result.db, self.database)
+        self.assertEqual(result.name, 'columnar')
+        self.assertEqual(result.tags, {'hostname': 'host', 'table': 'users'})
+        self.assertEqual(result.fields, {'duration': 0.5, 'rows': 10,
+                                         'query': 'select 1'})
+        self.assertEqual(result.timestamp, 1500000000000)
+
+    def test_default_timestamp(self):
+        start = int(time.time() * 1000)
+        influxdb.add_measurements_columnar(
+            self.database, 'columnar', {}, {'rows': [1, 2]})
+        for line in self.buffered():
+            self.assertGreaterEqual(int(line.rsplit(' ', 1)[1]), start)
+
+    def test_columns_with_different_lengths_raise_value_error(self):
+        with self.assertRaises(ValueError):
+            influxdb.add_measurements_columnar(
+                self.database, 'columnar', {}, {'rows': [1, 2]}, [1.0])
+        with self.assertRaises(ValueError):
+            influxdb.add_measurements_columnar(
+                self.database, 'columnar', {'table': ['users']},
+                {'rows': [1, 2]})
+
+    def test_missing_fields_raise_value_error(self):
+        with self.assertRaises(ValueError):
+            influxdb.add_measurements_columnar(
+                self.database, 'columnar', {}, {})
+
+    def test_rows_discarded_at_max_buffer_size(self):
+        influxdb.set_max_buffer_size(2)
+        self.add({})
+        self.assertEqual(influxdb._buffer_size, 2)
+        self.assertEqual(self.buffered(), self.expectation({})[:2])
+
+
+class StatsTestCase(base.AsyncServerTestCase):
+
+    def setUp(self):
+        super(StatsTestCase, self).setUp()
+        base.measurements.clear()
+        self.database = str(uuid.uuid4())
+
+    def test_initial_stats(self):
+        stats = influxdb.stats()
+        self.assertEqual(stats['measurements_added'], 0)
+        self.assertEqual(stats['batches_written'], 0)
+        self.assertEqual(stats['buffer_size'], 0)
+        self.assertNotIn('batch_duration_count', stats)
+
+    @testing.gen_test
+    def test_written_batch_stats(self):
+        base.add_measurements(self.database, 10, 'stats-test')
+        yield influxdb.flush()
+        stats = influxdb.stats()
+        self.assertEqual(stats['measurements_added'], 10)
+        self.assertEqual(stats['measurements_written'], 10)
+        self.assertEqual(stats['batches_submitted'], 1)
+        self.assertEqual(stats['batches_written'], 1)
+        self.assertEqual(stats['batches_failed'], 0)
+        self.assertGreater(stats['bytes_sent'], 0)
+        self.assertEqual(stats['buffer_size'], 0)
+        self.assertEqual(stats['marshall_duration_count'], 10)
+        self.assertEqual(stats['batch_duration_count'], 1)
+        self.assertGreater(stats['batch_duration_p99'], 0)
+        self.assertLessEqual(stats['batch_duration_p50'],
+                             stats['batch_duration_p999'])
+
+    def test_dropped_measurement_stats(self):
+        influxdb.set_max_buffer_size(5)
+        base.add_measurements(self.database, 8, 'stats-test')
+        stats = influxdb.stats()
+        self.assertEqual(stats['measurements_added'], 5)
+        self.assertEqual(stats['measurements_dropped'], 3)
+        self.assertEqual(stats['buffer_size'], 5)
+
+    @testing.gen_test
+    def test_rejected_measurement_stats(self):
+        base.add_measurements(self.database, 3, 'stats-test')
+        base.add_measurements(self.database, 1, 'stats-test', invalid={0})
+        influxdb._on_timeout()
+        while (len(base.measurements) < 3 or
+               not influxdb.stats()['measurements_rejected']):
+            yield gen.sleep(0.01)
+        stats = influxdb.stats()
+        self.assertEqual(stats['batches_failed'], 1)
+        self.assertEqual(stats['measurements_rejected'], 1)
+        self.assertEqual(stats['measurements_written'], 3)
+
+    @testing.gen_test
+    def test_unexpected_error_stats(self):
+        base.add_measurements(self.database, 3, 'stats-test')
+        influxdb._create_http_client()
+        future = concurrent.Future()
+        future.set_exception(ValueError('Unexpected'))
+        with mock.patch.object(influxdb._http_client, 'fetch',
+                               return_value=future):
+            yield influxdb.flush()
+        stats = influxdb.stats()
+        self.assertEqual(stats['batches_failed'], 1)
+        self.assertEqual(stats['measurements_dropped'], 3)
+        self.assertEqual(influxdb._pending_measurements(), 0)
+
+    @testing.gen_test
+    def test_stats_reporting(self):
+        influxdb.set_stats_reporting('metrics', 10)
+        base.add_measurements(self.database, 2, 'stats-test')
+        self.assertIsNotNone(influxdb._stats_timeout)
+        while 'metrics' not in influxdb._measurements:
+            yield gen.sleep(0.01)
+        influxdb.set_stats_reporting(None)
+
+        # Only the stats measurement was marshalled since it was added
+        self.assertEqual(influxdb.stats()['marshall_duration_count'], 1)
+        yield influxdb.flush()
+        values = [value for value in base.measurements
+                  if value.db == 'metrics']
+        self.assertEqual(values[0].name, 'sprockets_influxdb')
+        self.assertEqual(values[0].fields['measurements_added'], 2)
+        self.assertEqual(values[0].fields['marshall_duration_count'], 2)
+
+    def test_stats_reporting_disabled(self):
+        influxdb.set_stats_reporting('metrics', 10)
+        influxdb.set_stats_reporting(None)
+        base.add_measurements(self.database, 1, 'stats-test')
+        self.assertIsNone(influxdb._stats_timeout)
+
+
+class UDPTransportTestCase(base.AsyncTestCase):
+
+    def setUp(self):
+        super(UDPTransportTestCase, self).setUp()
+        self.listener = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self.listener.bind(('127.0.0.1', 0))
+        self.listener.settimeout(1)
+        influxdb.install(url='udp://127.0.0.1:{}'.format(
+            self.listener.getsockname()[1]))
+        self.database = str(uuid.uuid4())
+
+    def tearDown(self):
+        self.listener.close()
+        super(UDPTransportTestCase, self).tearDown()
+
+    def receive(self, count):
+        datagrams = []
+        lines = []
+        while len(lines) < count:
+            datagrams.append(self.listener.recv(65536))
+            lines.extend(datagrams[-1].decode('utf-8').splitlines())
+        return datagrams, lines
+
+    def test_port_defaults_to_8089(self):
+        transport = influxdb._UDPTransport('udp://influxdb')
+        self.assertEqual(transport.host, 'influxdb')
+        self.assertEqual(transport.port, 8089)
+
+    def test_ipv6_address(self):
+        transport = influxdb._UDPTransport('udp://[::1]:9000')
+        self.assertEqual(transport.host, '::1')
+        self.assertEqual(transport.port, 9000)
+
+    @testing.gen_test
+    def test_measurements_packed_into_datagrams(self):
+        influxdb._create_http_client()
+        with mock.patch.object(influxdb._http_client, 'fetch') as fetch:
+            base.add_measurements(self.database, 500, 'udp-test')
+            result = yield influxdb.flush()
+        self.assertTrue(result)
+        fetch.assert_not_called()
+        datagrams, lines = self.receive(500)
+        self.assertEqual(
+            [int(line.split(' ')[1][5:-1]) for line in lines],
+            list(range(0, 500)))
+        self.assertGreater(len(datagrams), 1)
+        for datagram in datagrams:
+            self.assertLessEqual(len(datagram), 1472)
+            self.assertTrue(datagram.endswith(b'\n'))
+        self.assertEqual(influxdb.stats()['datagrams_sent'], len(datagrams))
+        self.assertEqual(influxdb.stats()['measurements_written'], 500)
+
+    @testing.gen_test
+    def test_long_line_sent_on_its_own(self):
+        measurement = influxdb.Measurement(self.database, 'udp-test')
+        measurement.set_field('test', 'x' * 2000)
+        influxdb.add_measurement(measurement)
+        base.add_measurements(self.database, 2, 'udp-test')
+        yield influxdb.flush()
+        datagrams, lines = self.receive(3)
+        self.assertEqual(len(datagrams), 2)
+        self.assertGreater(len(datagrams[0]), 2000)
+        self.assertEqual(len(lines), 3)
+
+    @testing.gen_test
+    def test_send_errors_drop_datagrams(self):
+        base.add_measurements(self.database, 10, 'udp-test')
+        with mock.patch('socket.socket') as socket_class:
+            socket_class.return_value.sendto.side_effect = socket.error(
+                11, 'Try again')
+            yield influxdb.flush()
+        self.assertEqual(influxdb._pending_measurements(), 0)
+        self.assertEqual(influxdb.stats()['datagrams_dropped'], 1)
+        self.assertEqual(influxdb.stats()['datagrams_sent'], 0)
+
+    @testing.gen_test
+    def test_ip_addresses_are_not_resolved(self):
+        base.add_measurements(self.database, 10, 'udp-test')
+        with mock.patch('tornado.netutil.ThreadedResolver') as resolver:
+            yield influxdb.flush()
+        resolver.assert_not_called()
+        datagrams, lines = self.receive(10)
+        self.assertEqual(len(lines), 10)
+
+    @testing.gen_test
+    def test_host_names_are_resolved_in_a_thread(self):
+        influxdb.set_base_url('udp://localhost:{}'.format(
+            self.listener.getsockname()[1]))
+        base.add_measurements(self.database, 10, 'udp-test')
+        with mock.patch('tornado.netutil.ThreadedResolver') as resolver:
+            resolve = concurrent.Future()
+            resolve.set_result(
+                [(socket.AF_INET, self.listener.getsockname())])
+            resolver.return_value.resolve.return_value = resolve
+            yield influxdb.flush()
+        resolver.return_value.resolve.assert_called_once_with(
+            'localhost', self.listener.getsockname()[1], socket.AF_UNSPEC)
+        datagrams, lines = self.receive(10)
+        self.assertEqual(len(lines), 10)
+
+    @testing.gen_test
+    def test_resolution_errors_requeue_measurements(self):
+        influxdb.set_base_url('udp://influxdb.invalid:8089')
+        influxdb.set_backoff(1000, 1000, 2)
+        influxdb._create_http_client()
+        resolve = concurrent.Future()
+        resolve.set_exception(socket.gaierror(-2, 'Name or service not known'))
+        with mock.patch('tornado.netutil.ThreadedResolver') as resolver:
+            resolver.return_value.resolve.return_value = resolve
+            base.add_measurements(self.database, 10, 'udp-test')
+            influxdb._on_timeout()
+            yield gen.sleep(0.01)
+        self.assertEqual(influxdb._pending_measurements(), 10)
+        self.assertEqual(influxdb.stats()['measurements_requeued'], 10)
+
+
+class HTTPBackendTestCase(base.AsyncServerTestCase):
+
+    def setUp(self):
+        super(HTTPBackendTestCase, self).setUp()
+        base.measurements.clear()
+        self.database = str(uuid.uuid4())
+
+    def test_invalid_backend(self):
+        with self.assertRaises(ValueError):
+            influxdb.set_http_backend('urllib')
+
+    def test_curl_backend_requires_pycurl(self):
+        with mock.patch('sprockets_influxdb.pycurl', None):
+            with self.assertRaises(ValueError):
+                influxdb.set_http_backend('curl')
+
+    @unittest.skipIf(influxdb.pycurl is None, 'pycurl is not installed')
+    @testing.gen_test
+    def test_curl_backend(self):
+        influxdb.set_http_backend('curl')
+        influxdb.set_max_batch_size(10)
+        base.add_measurements(self.database, 50, 'backend-test')
+        yield influxdb.flush()
+        self.assertIsInstance(influxdb._http_client,
+                              influxdb.curl_httpclient.CurlAsyncHTTPClient)
+        self.assertEqual(len(base.measurements), 50)
+
+    @testing.gen_test
+    def test_client_replaced_without_dropping_requests(self):
+        base.add_measurements(self.database, 10, 'backend-test')
+        influxdb._on_timeout()
+        previous = influxdb._http_client
+        self.assertEqual(influxdb._http_client_requests[previous], 1)
+
+        influxdb.set_auth_credentials('user', 'password')
+        with mock.patch.object(previous, 'close') as close:
+            influxdb._create_http_client()
+            self.assertIsNot(influxdb._http_client, previous)
+            self.assertIn(previous, influxdb._retired_http_clients)
+            close.assert_not_called()
+            while previous in influxdb._retired_http_clients:
+                yield gen.sleep(0.01)
+            close.assert_called_once_with()
+        self.assertEqual(len(base.measurements), 10)
+
+    def test_idle_client_closed_when_replaced(self):
+        influxdb._create_http_client()
+        previous = influxdb._http_client
+        with mock.patch.object(previous, 'close') as close:
+            influxdb._create_http_client()
+            close.assert_called_once_with()
+        self.assertFalse(influxdb._retired_http_clients)
+
+
+class ShardHandler(base.FakeInfluxDBHandler):
+
+    writes = []
+
+    def post(self, *args, **kwargs):
+        count = len(base.measurements)
+        super(ShardHandler, self).post(*args, **kwargs)
+        for _iteration in range(count, len(base.measurements)):
+            ShardHandler.writes.append(self.request.path)
+
+
+class ShardingTestCase(base.AsyncServerTestCase):
+
+    def setUp(self):
+        super(ShardingTestCase, self).setUp()
+        base.measurements.clear()
+        ShardHandler.writes = []
+        self.urls = [self.get_url('/shard0/write'),
+                     self.get_url('/shard1/write')]
+
+    def get_app(self):
+        application = super(ShardingTestCase, self).get_app()
+        application.add_handlers(
+            '.*', [('/shard[0-9]/write', ShardHandler)])
+        return application
+
+    def written(self):
+        written = {}
+        for path, value in zip(ShardHandler.writes, base.measurements):
+            written.setdefault(path, []).append(value)
+        return written
+
+    def test_invalid_routing(self):
+        with self.assertRaises(ValueError):
+            influxdb.set_urls(self.urls, 'random')
+
+    def test_udp_urls_not_sharded(self):
+        with self.assertRaises(ValueError):
+            influxdb.set_urls(['udp://host-a:8089', 'udp://host-b:8089'])
+
+    @testing.gen_test
+    def test_routing_by_database(self):
+        influxdb.set_urls(self.urls)
+        databases = [str(uuid.uuid4()) for _iteration in range(0, 20)]
+        for database in databases:
+            for host in range(0, 5):
+                base.add_measurements(database, 1, 'shard-test',
+                                      {'host': str(host)})
+        yield influxdb.flush()
+        written = self.written()
+        self.assertEqual(set(written), {'/shard0/write', '/shard1/write'})
+        for values in written.values():
+            for database in set(value.db for value in values):
+                self.assertEqual(
+                    len([value for value in values if value.db == database]),
+                    5)
+
+    @testing.gen_test
+    def test_routing_by_series(self):
+        influxdb.set_urls(self.urls, influxdb.ROUTING_SERIES)
+        for _iteration in range(0, 2):
+            for host in range(0, 50):
+                base.add_measurements('shard-db', 1, 'shard-test',
+                                      {'host': 'host-{}'.format(host)})
+        yield influxdb.flush()
+        written = self.written()
+        self.assertEqual(set(written), {'/shard0/write', '/shard1/write'})
+        hosts = [set(value.tags['host'] for value in values)
+                 for values in written.values()]
+        self.assertFalse(hosts[0] & hosts[1])
+        self.assertEqual(len(hosts[0] | hosts[1]), 50)
+
+    def test_adding_endpoint_only_moves_series_to_it(self):
+        influxdb.set_urls(self.urls, influxdb.ROUTING_SERIES)
+        lines = ['shard-test,host=host-{} test=1i'.format(index).encode(
+            'utf-8') for index in range(0, 1000)]
+        before = [influxdb._route('shard-db', line) for line in lines]
+        url = self.get_url('/shard2/write')
+        influxdb.set_urls(self.urls + [url])
+        after = [influxdb._route('shard-db', line) for line in lines]
+        moved = [key for old, key in zip(before, after) if old != key]
+        self.assertTrue(moved)
+        self.assertLess(len(moved), 600)
+        self.assertEqual(set(key[1] for key in moved), {url})
+
+    def test_buffered_measurements_rerouted(self):
+        for host in range(0, 10):
+            base.add_measurements('shard-db', 1, 'shard-test',
+                                  {'host': str(host)})
+        influxdb.set_urls(self.urls, influxdb.ROUTING_SERIES)
+        self.assertNotIn('shard-db', influxdb._measurements)
+        self.assertEqual(influxdb._pending_measurements(), 10)
+        self.assertEqual(set(key[1] for key in influxdb._measurements),
+                         set(self.urls))
+
+    @testing.gen_test
+    def test_slow_endpoint_does_not_block_others(self):
+        influxdb.set_urls(self.urls)
+        influxdb.set_max_clients(1)
+        influxdb._create_http_client()
+        slow = influxdb._http_clients[self.urls[0]]
+        future = concurrent.Future()
+        with mock.patch.object(slow, 'fetch', return_value=future):
+            databases = [str(uuid.uuid4()) for _iteration in range(0, 20)]
+            for database in databases:
+                base.add_measurements(database, 1, 'shard-test',
+                                      {'host': 'host'})
+            influxdb._on_timeout()
+            fast = [database for database in databases
+                    if influxdb._route(database, b'')[1] == self.urls[1]]
+            while len(base.measurements) < len(fast):
+                yield gen.sleep(0.01)
+        self.assertEqual(influxdb._endpoint_in_flight[self.urls[0]], 1)
+        self.assertEqual(set(value.db for value in base.measurements),
+                         set(fast))
+        self.assertEqual(influxdb._pending_measurements(),
+                         len(databases) - len(fast) - 1)
+
+        # Complete the slow request so the write does not outlive the test
+        future.set_result(None)
+        yield influxdb._batch_future
+        self.assertEqual(influxdb._pending_measurements(), 0)
+
+    @testing.gen_test
+    def test_measurements_added_while_writing_wait_for_the_interval(self):
+        influxdb.set_urls(self.urls)
+        database = str(uuid.uuid4())
+        base.add_measurements(database, 1, 'shard-test', {'host': 'host-a'})
+        future = influxdb._on_timeout()
+        base.add_measurements(database, 1, 'shard-test', {'host': 'host-b'})
+        yield future
+        self.assertEqual(len(base.measurements), 1)
+        self.assertEqual(influxdb._pending_measurements(), 1)
+        self.assertIsNotNone(influxdb._timeout)
+
+    @testing.gen_test
+    def test_measurements_triggered_while_writing_are_topped_up(self):
+        influxdb.set_urls(self.urls)
+        influxdb.set_max_clients(1)
+        influxdb.set_trigger_size(2)
+        database = str(uuid.uuid4())
+        base.add_measurements(database, 1, 'shard-test', {'host': 'host-a'})
+        future = influxdb._on_timeout()
+        base.add_measurements(database, 1, 'shard-test', {'host': 'host-b'})
+        base.add_measurements(database, 1, 'shard-test', {'host': 'host-c'})
+        self.assertEqual(influxdb._pending_measurements(), 2)
+        yield future
+        self.assertEqual(len(base.measurements), 3)
+        self.assertEqual(influxdb._pending_measurements(), 0)
+
+
+class UnavailableHandler(ShardHandler):
+
+    status = 503
+
+    def post(self, *args, **kwargs):
+        if UnavailableHandler.status != 204:
+            self.set_status(UnavailableHandler.status)
+            return
+        super(UnavailableHandler, self).post(*args, **kwargs)
+
+
+class FailoverTestCase(base.AsyncServerTestCase):
+
+    def setUp(self):
+        super(FailoverTestCase, self).setUp()
+        base.measurements.clear()
+        ShardHandler.writes = []
+        UnavailableHandler.status = 503
+        influxdb.set_base_url(self.get_url('/primary/write'))
+        influxdb.set_max_batch_size(5)
+        self.replicas = [self.get_url('/replica0/write'),
+                         self.get_url('/replica1/write')]
+        influxdb.set_replicas(self.replicas)
+
+    def get_app(self):
+        application = super(FailoverTestCase, self).get_app()
+        application.add_handlers(
+            '.*', [('/primary/write', UnavailableHandler),
+                   ('/replica[0-9]/write', ShardHandler)])
+        return application
+
+    def test_udp_replicas_rejected(self):
+        with self.assertRaises(ValueError):
+            influxdb.set_replicas(['udp://replica:8089'])
+
+    @testing.gen_test
+    def test_fails_over_within_one_write(self):
+        base.add_measurements('failover-db', 20, 'failover')
+        yield influxdb._on_timeout()
+        self.assertEqual(influxdb._pending_measurements(), 0)
+        self.assertEqual(len(base.measurements), 20)
+        self.assertTrue(set(ShardHandler.writes) <=
+                        {'/replica0/write', '/replica1/write'})
+        self.assertTrue(influxdb._circuit_breaker().degraded())
+        self.assertEqual(influxdb.stats()['batches_failed_over'], 4)
+
+    @testing.gen_test
+    def test_returns_to_primary_after_probe_success(self):
+        base.add_measurements('failover-db', 5, 'failover')
+        yield influxdb._on_timeout()
+        self.assertEqual(len(base.measurements), 5)
+        UnavailableHandler.status = 204
+        influxdb._circuit_breaker().retry_at = 0
+        base.add_measurements('failover-db', 10, 'failover')
+        yield influxdb._on_timeout()
+        self.assertFalse(influxdb._circuit_breaker().degraded())
+        self.assertEqual(ShardHandler.writes[5:10], ['/primary/write'] * 5)
+        base.add_measurements('failover-db', 10, 'failover')
+        yield influxdb._on_timeout()
+        self.assertEqual(ShardHandler.writes[15:], ['/primary/write'] * 10)
+
+    def test_slow_primary_is_degraded(self):
+        influxdb.set_replicas(self.replicas, 100)
+        influxdb._circuit_breaker().on_success(0.5)
+        now = self.io_loop.time()
+        self.assertEqual(influxdb._select_url(None, now),
+                         influxdb._base_url)
+        self.assertIn(influxdb._select_url(None, now), self.replicas)
+        influxdb._circuit_breaker().on_success(0.01)
+        self.assertTrue(influxdb._circuit_breaker().degraded())
+        for _iteration in range(0, 20):
+            influxdb._circuit_breaker().on_success(0.01)
+        self.assertFalse(influxdb._circuit_breaker().degraded())
+        for _iteration in range(0, 2):
+            self.assertEqual(influxdb._select_url(None, now),
+                             influxdb._base_url)
+
+    def test_replicas_weighted_by_latency(self):
+        influxdb._circuit_breaker().on_failure(self.io_loop.time())
+        influxdb._circuit_breaker(self.replicas[0]).on_success(0.001)
+        influxdb._circuit_breaker(self.replicas[1]).on_success(0.1)
+        now = self.io_loop.time()
+        selected = [influxdb._select_url(None, now)
+                    for _iteration in range(0, 1000)]
+        self.assertGreater(selected.count(self.replicas[0]), 900)
+        self.assertTrue(selected.count(self.replicas[1]))
+
+    def test_pauses_when_no_endpoint_is_healthy(self):
+        now = self.io_loop.time()
+        for url in [influxdb._base_url] + self.replicas:
+            influxdb._circuit_breaker(url).on_failure(now)
+        self.assertIsNone(influxdb._select_url(None, now))
+        self.assertGreater(influxdb._retry_delay(), 0)
+
+
+class SenderTestCase(base.AsyncServerTestCase):
+
+    def setUp(self):
+        super(SenderTestCase, self).setUp()
+        base.measurements.clear()
+        self.directory = tempfile.mkdtemp()
+        self.path = os.path.join(self.directory, 'sender.sock')
+
+    def tearDown(self):
+        influxdb._maybe_stop_sender()
+        shutil.rmtree(self.directory)
+        super(SenderTestCase, self).tearDown()
+
+    @gen.coroutine
+    def wait_for_received(self, count):
+        while influxdb.stats()['measurements_received'] < count:
+            yield gen.sleep(0.01)
+
+    @testing.gen_test
+    def test_forwarded_measurements_are_submitted(self):
+        influxdb.start_sender(self.path)
+        transport = influxdb._SenderTransport('unix://' + self.path)
+        body = b''.join('sender-test,worker=0 value={}i 1000\n'.format(
+            value).encode('utf-8') for value in range(0, 3))
+        yield transport.write('sender-db', body)
+        yield self.wait_for_received(3)
+        self.assertEqual(influxdb._pending_measurements(), 3)
+        yield influxdb.flush()
+        transport.close()
+        self.assertEqual(len(base.measurements), 3)
+        self.assertEqual(set(value.db for value in base.measurements),
+                         {'sender-db'})
+
+    @testing.gen_test
+    def test_worker_forwards_batches(self):
+        frames = []
+        listener = netutil.bind_unix_socket(self.path)
+
+        def on_connection(connection, address):
+            stream = iostream.IOStream(connection)
+            stream.read_until_close().add_done_callback(
+                lambda future: frames.append(future.result()))
+
+        netutil.add_accept_handler(listener, on_connection)
+        influxdb.set_base_url('unix://' + self.path)
+        base.add_measurements('worker-db', 3, 'sender-test', {'worker': '0'})
+        yield influxdb._on_timeout()
+        influxdb._sender_transport.close()
+        while not frames:
+            yield gen.sleep(0.01)
+        self.io_loop.remove_handler(listener)
+        listener.close()
+
+        header = influxdb._SenderTransport.HEADER
+        length, size = header.unpack(frames[0][:header.size])
+        self.assertEqual(frames[0][header.size:header.size + length],
+                         b'worker-db')
+        self.assertEqual(len(frames[0]), header.size + length + size)
+        self.assertEqual(frames[0].count(b'\n'), 3)
+        self.assertEqual(influxdb.stats()['batches_written'], 1)
+
+    @testing.gen_test
+    def test_unreachable_sender_requeues(self):
+        influxdb.set_base_url('unix://' + self.path)
+        base.add_measurements('worker-db', 2, 'sender-test', {'worker': '0'})
+        yield influxdb._on_timeout()
+        self.assertEqual(influxdb._pending_measurements(), 2)
+        self.assertEqual(influxdb.stats()['batches_failed'], 1)
+
+    def test_shutdown_stops_sender(self):
+        influxdb.start_sender(self.path)
+        influxdb.shutdown()
+        self.assertIsNone(influxdb._sender_socket)
+
+    def test_after_fork_resets_state(self):
+        influxdb.set_max_batch_size(1)
+        base.add_measurements('fork-db', 2, 'sender-test', {'worker': '0'})
+        timeout = influxdb._timeout
+        influxdb._after_fork()
+        self.io_loop.remove_timeout(timeout)
+        self.assertEqual(influxdb._pending_measurements(), 0)
+        self.assertEqual(influxdb._measurements, {})
+        self.assertIsNone(influxdb._timeout)
+        self.assertIsNone(influxdb._http_client)
+        self.assertEqual(influxdb.stats()['measurements_added'], 0)
+
+    def run_worker(self, worker):
+        status = 1
+        try:
+            influxdb.set_base_url('unix://' + self.path)
+            io_loop = ioloop.IOLoop(make_current=False)
+
+            def write():
+                base.add_measurements('fork-db', 5, 'sender-test',
+                                      {'worker': str(worker)})
+                return influxdb._on_timeout()
+
+            io_loop.run_sync(write)
+            status = 0 if influxdb.stats()['batches_written'] == 1 else 2
+        finally:
+            os._exit(status)
+
+    @unittest.skipUnless(hasattr(os, 'register_at_fork'),
+                         'Requires os.register_at_fork')
+    def test_forked_workers_share_sender(self):
+        influxdb.start_sender(self.path)
+        base.add_measurements('fork-db', 1, 'sender-test',
+                              {'worker': 'parent'})
+        pids = []
+        for worker in range(0, 3):
+            pid = os.fork()
+            if not pid:
+                self.run_worker(worker)
+            pids.append(pid)
+        for pid in pids:
+            self.assertEqual(os.waitpid(pid, 0)[1], 0)
+
+        self.io_loop.run_sync(lambda: self.wait_for_received(15))
+        self.flush()
+        workers = [value.tags['worker'] for value in base.measurements]
+        self.assertEqual(len(workers), 16)
+        self.assertEqual(workers.count('parent'), 1)
+        for worker in range(0, 3):
+            self.assertEqual(workers.count(str(worker)), 5)
+
+
+class ThreadedIngestionTestCase(base.AsyncServerTestCase):
+
+    def setUp(self):
+        super(ThreadedIngestionTestCase, self).setUp()
+        base.measurements.clear()
+
+    def run_thread(self, target, *args):
+        thread = threading.Thread(target=target, args=args)
+        thread.start()
+        thread.join()
+
+    @gen.coroutine
+    def wait_for_buffer(self, count):
+        while influxdb._buffer_size < count:
+            yield gen.sleep(0.001)
+
+    @testing.gen_test
+    def test_measurements_are_buffered_on_io_loop(self):
+        self.run_thread(base.add_measurements, 'thread-db', 3, 'thread-test',
+                        {'thread': '0'})
+        self.assertEqual(influxdb._buffer_size, 0)
+        self.assertEqual(len(influxdb._thread_queue), 3)
+        yield self.wait_for_buffer(3)
+        self.assertEqual(len(influxdb._thread_queue), 0)
+        self.assertEqual(influxdb.stats()['measurements_added'], 3)
+
+    @testing.gen_test
+    def test_columnar_measurements_from_thread(self):
+        self.run_thread(influxdb.add_measurements_columnar, 'thread-db',
+                        'thread-test', {'thread': 'columnar'},
+                        {'value': [1, 2, 3]})
+        self.assertEqual(influxdb._buffer_size, 0)
+        yield self.wait_for_buffer(3)
+
+    @testing.gen_test
+    def test_aggregated_measurements_from_threads(self):
+        influxdb.set_aggregation_interval(60000)
+        timestamp = time.time()
+
+        def aggregate(count):
+            for value in range(0, count):
+                measurement = influxdb.Measurement('thread-db', 'rollup')
+                measurement.set_field('value', value)
+                measurement.set_timestamp(timestamp)
+                influxdb._aggregate_measurement(measurement)
+
+        threads = [threading.Thread(target=aggregate, args=(100, ))
+                   for _thread in range(0, 4)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(influxdb._rollups, {})
+        self.assertIsNone(influxdb._rollup_timeout)
+        yield base.wait_for(lambda: not influxdb._thread_queue)
+        rollup, = influxdb._rollups.values()
+        self.assertEqual(rollup.count, 400)
+        self.assertIsNotNone(influxdb._rollup_timeout)
+        influxdb._flush_rollups(True)
+
+    @testing.gen_test
+    def test_thread_queue_size_limit(self):
+        influxdb.set_max_buffer_size(2)
+        self.run_thread(base.add_measurements, 'thread-db', 3, 'thread-test',
+                        {'thread': '0'})
+        self.assertEqual(len(influxdb._thread_queue), 2)
+        yield self.wait_for_buffer(2)
+        self.assertEqual(influxdb.stats()['measurements_dropped'], 1)
+
+    def test_invalid_measurement_raises_in_thread(self):
+        errors = []
+
+        def add():
+            try:
+                influxdb.add_measurement(
+                    influxdb.Measurement('thread-db', 'thread-test'))
+            except ValueError as error:
+                errors.append(error)
+
+        self.run_thread(add)
+        self.assertEqual(len(errors), 1)
+        self.assertEqual(len(influxdb._thread_queue), 0)
+
+    @testing.gen_test(timeout=60)
+    def test_no_measurements_lost_or_duplicated(self):
+        influxdb.set_max_buffer_size(100000)
+        influxdb.set_max_batch_size(1000)
+        influxdb.set_trigger_size(1000)
+        executor = futures.ThreadPoolExecutor(8)
+        results = [executor.submit(base.add_measurements, 'thread-db', 2000,
+                                   'thread-test', {'thread': str(thread)})
+                   for thread in range(0, 8)]
+        for value in range(0, 10):
+            base.add_measurements('thread-db', 50, 'thread-test',
+                                  {'thread': 'loop-{}'.format(value)})
+            yield gen.moment
+        while (not all(result.done() for result in results) or
+               influxdb._thread_queue):
+            yield gen.sleep(0.01)
+        executor.shutdown()
+        for result in results:
+            result.result()
+        yield influxdb.flush()
+
+        written = [(value.tags['thread'], value.fields['test'])
+                   for value in base.measurements]
+        expected = set((str(thread), value) for thread in range(0, 8)
+                       for value in range(0, 2000))
+        expected.update(('loop-{}'.format(thread), value)
+                        for thread in range(0, 10) for value in range(0, 50))
+        self.assertEqual(len(written), len(expected))
+        self.assertEqual(set(written), expected)
+        self.assertEqual(influxdb._pending_measurements(), 0)
+
+
+class IOLoopResolutionTestCase(base.TestCase):
+
+    def setUp(self):
+        super(IOLoopResolutionTestCase, self).setUp()
+        self.io_loop = ioloop.IOLoop(make_current=False)
+
+    def tearDown(self):
+        influxdb._maybe_stop_timeout()
+        self.io_loop.close(all_fds=True)
+        super(IOLoopResolutionTestCase, self).tearDown()
+
+    def run_thread(self, target, *args):
+        errors = []
+
+        def run():
+            try:
+                target(*args)
+            except RuntimeError as error:
+                errors.append(error)
+
+        thread = threading.Thread(target=run)
+        thread.start()
+        thread.join()
+        return errors
+
+    def test_running_io_loop_is_resolved(self):
+        influxdb.install()
+
+        @gen.coroutine
+        def add():
+            base.add_measurements('thread-db', 1, 'thread-test')
+            self.run_thread(base.add_measurements, 'thread-db', 100,
+                            'thread-test')
+            while influxdb._buffer_size < 101:
+                yield gen.sleep(0.001)
+
+        self.io_loop.run_sync(add, timeout=5)
+        self.assertIs(influxdb._io_loop, self.io_loop)
+        self.assertEqual(influxdb._io_loop_thread,
+                         threading.current_thread().ident)
+        self.assertEqual(len(influxdb._thread_queue), 0)
+
+    def test_adding_on_thread_before_io_loop_runs_raises(self):
+        influxdb.install()
+        errors = self.run_thread(base.add_measurements, 'thread-db', 1,
+                                 'thread-test')
+        self.assertEqual(len(errors), 1)
+        self.assertEqual(len(influxdb._thread_queue), 0)
+
+    def test_adding_on_install_thread_before_io_loop_runs(self):
+        influxdb.install()
+        base.add_measurements('thread-db', 2, 'thread-test')
+        self.assertEqual(influxdb._buffer_size, 2)
+
+    def test_set_io_loop_records_io_loop_thread(self):
+        running = threading.Event()
+        self.io_loop.add_callback(running.set)
+        thread = threading.Thread(target=self.io_loop.start)
+        thread.start()
+        try:
+            running.wait(5)
+            influxdb.set_io_loop(self.io_loop)
+            base.add_measurements('thread-db', 3, 'thread-test')
+            for _iteration in range(0, 500):
+                if influxdb._buffer_size == 3:
+                    break
+                time.sleep(0.01)
+        finally:
+            self.io_loop.add_callback(self.io_loop.stop)
+            thread.join()
+        self.assertEqual(influxdb._buffer_size, 3)
+        self.assertEqual(influxdb._io_loop_thread, thread.ident)
+
+    def test_after_fork_resolves_io_loop_again(self):
+        influxdb.install()
+        self.io_loop.run_sync(lambda: base.add_measurements(
+            'thread-db', 1, 'thread-test'))
+        influxdb._after_fork()
+        self.assertIsNone(influxdb._io_loop_thread)
+        errors = self.run_thread(base.add_measurements, 'thread-db', 1,
+                                 'thread-test')
+        self.assertEqual(len(errors), 1)
+        self.io_loop.run_sync(lambda: base.add_measurements(
+            'thread-db', 1, 'thread-test'))
+        self.assertIs(influxdb._io_loop, self.io_loop)
+        self.assertEqual(influxdb._buffer_size, 1)
+
+
+class MeasurementBufferTestCase(base.TestCase):
+
+    def setUp(self):
+        super(MeasurementBufferTestCase, self).setUp()
+        influxdb.set_max_batch_size(1000)
+        self.buffer = influxdb._MeasurementBuffer()
+        self.values = [str(uuid.uuid4()).encode('utf-8')
+                       for _i in range(0, 2500)]
+        for value in self.values:
+            self.buffer.append(value)
+
+    @staticmethod
+    def body(values):
+        return b''.join(value + b'\n' for value in values)
+
+    def test_length(self):
+        self.assertEqual(len(self.buffer), 2500)
+
+    def test_take_preserves_order_across_chunks(self):
+        self.assertEqual(self.buffer.take(700),
+                         (self.body(self.values[:700]), 700))
+        self.assertEqual(self.buffer.take(1000),
+                         (self.body(self.values[700:1700]), 1000))
+        self.assertEqual(self.buffer.take(5000),
+                         (self.body(self.values[1700:]), 800))
+        self.assertEqual(len(self.buffer), 0)
+        self.assertEqual(self.buffer.take(10), (b'', 0))
+
+    def test_append_after_partial_take(self):
+        self.buffer.take(2400)
+        self.buffer.append(b'foo')
+        self.assertEqual(self.buffer.take(200),
+                         (self.body(self.values[2400:] + [b'foo']), 101))
+
+    def test_append_after_taking_from_last_chunk(self):
+        self.buffer.take(2450)
+        self.buffer.append(b'foo')
+        self.assertEqual(self.buffer.take(10),
+                         (self.body(self.values[2450:2460]), 10))
+        self.assertEqual(self.buffer.take(100),
+                         (self.body(self.values[2460:] + [b'foo']), 41))
+
+    def test_extend_adds_to_end(self):
+        body, count = self.buffer.take(100)
+        self.buffer.extend(body)
+        self.assertEqual(len(self.buffer), 2500)
+        self.assertEqual(self.buffer.take(2500),
+                         (self.body(self.values[100:] + self.values[:100]),
+                          2500))
+
+
+class BatchCompletionTestCase(base.AsyncServerTestCase):
+
+    @testing.gen_test
+    def test_next_batch_starts_when_response_arrives(self):
+        influxdb.set_max_batch_size(10)
+        influxdb.set_trigger_size(10)
+        influxdb._create_http_client()
+        fetch = influxdb._http_client.fetch
+        requests, responses = [], []
+
+        def record_fetch(*args, **kwargs):
+            requests.append(time.time())
+            future = fetch(*args, **kwargs)
+            future.add_done_callback(lambda _f: responses.append(time.time()))
+            return future
+
+        database = str(uuid.uuid4())
+        with mock.patch.object(influxdb._http_client, 'fetch',
+                               side_effect=record_fetch):
+            for iteration in range(0, 20):
+                measurement = influxdb.Measurement(database, 'gap-test')
+                measurement.set_field('test', iteration)
+                influxdb.add_measurement(measurement)
+            while len(responses) < 2:
+                yield gen.sleep(0.001)
+
+        self.assertEqual(influxdb._pending_measurements(), 0)
+        self.assertLess(requests[1] - responses[0], 0.05)
+
+
+class PipelinedBatchTestCase(base.AsyncServerTestCase):
+
+    def setUp(self):
+        super(PipelinedBatchTestCase, self).setUp()
+        influxdb.set_max_batch_size(10)
+        influxdb.set_trigger_size(10)
+        influxdb._create_http_client()
+        self.requests = []
+
+    def pending_fetch(self, *args, **kwargs):
+        future = concurrent.Future()
+        self.requests.append(future)
+        return future
+
+    @testing.gen_test
+    def test_batches_in_flight_limited_per_database(self):
+        influxdb.set_max_inflight_batches(3)
+        with mock.patch.object(influxdb._http_client, 'fetch',
+                               side_effect=self.pending_fetch):
+            base.add_measurements(str(uuid.uuid4()), 60, 'pipeline-test')
+            self.assertEqual(len(self.requests), 3)
+            self.assertEqual(influxdb._pending_measurements(), 30)
+
+            # A new batch is submitted as soon as a slot frees up
+            self.requests[0].set_result(None)
+            yield base.wait_for(lambda: len(self.requests) == 4)
+            self.assertEqual(influxdb._pending_measurements(), 20)
+            self.assertEqual(influxdb._in_flight_total, 3)
+
+            for request in self.requests:
+                if not request.done():
+                    request.set_result(None)
+            yield base.wait_for(lambda: len(self.requests) == 6)
+
+    @testing.gen_test
+    def test_batches_in_flight_limited_by_max_clients(self):
+        influxdb.set_max_clients(4)
+        influxdb._create_http_client()
+        with mock.patch.object(influxdb._http_client, 'fetch',
+                               side_effect=self.pending_fetch):
+            base.add_measurements(str(uuid.uuid4()), 30, 'pipeline-test')
+            base.add_measurements(str(uuid.uuid4()), 30, 'pipeline-test')
+            self.assertEqual(len(self.requests), 4)
+            self.assertEqual(influxdb._in_flight_total, 4)
+
+    def test_write_completes_when_all_batches_are_done(self):
+        influxdb.set_trigger_size(5000)
+        base.measurements.clear()
+        database = str(uuid.uuid4())
+        base.add_measurements(database, 35, 'pipeline-test')
+        self.flush()
+        self.assertEqual(influxdb._pending_measurements(), 0)
+        self.assertFalse(influxdb._writing)
+        self.assertEqual(len(base.measurements), 35)
+
+
+class CompressionTestCase(base.AsyncServerTestCase):
+
+    def test_batch_is_compressed(self):
+        influxdb.set_compression(6)
+        database = str(uuid.uuid4())
+        base.add_measurements(database, 100, 'compression-test',
+                              {'endpoint': '/compression/test'})
+        self.flush()
+        result = self.get_measurement()
+        self.assertEqual(result.db, database)
+        self.assertEqual(
+            result.headers.get('X-Consumed-Content-Encoding'), 'gzip')
+
+    def test_small_batch_is_not_compressed(self):
+        influxdb.set_compression(6, 100000)
+        base.add_measurements(str(uuid.uuid4()), 100, 'compression-test',
+                              {'endpoint': '/compression/test'})
+        self.flush()
+        result = self.get_measurement()
+        self.assertIsNone(result.headers.get('X-Consumed-Content-Encoding'))
+
+    def test_batch_is_not_compressed_by_default(self):
+        base.add_measurements(str(uuid.uuid4()), 100, 'compression-test',
+                              {'endpoint': '/compression/test'})
+        self.flush()
+        result = self.get_measurement()
+        self.assertIsNone(result.headers.get('X-Consumed-Content-Encoding'))
+
+    def test_request_body(self):
+        influxdb.set_compression(True, 0)
+        measurements = b'foo bar=1i 1000\nfoo bar=2i 2000\n'
+        body, headers = influxdb._request_body(measurements)
+        self.assertEqual(headers, {'Content-Encoding': 'gzip'})
+        self.assertEqual(zlib.decompress(body, 16 + zlib.MAX_WBITS),
+                         measurements)
+
+
+class RejectedBatchTestCase(base.AsyncServerTestCase):
+
+    def setUp(self):
+        super(RejectedBatchTestCase, self).setUp()
+        base.measurements.clear()
+        influxdb.set_max_batch_size(1000)
+        self.database = str(uuid.uuid4())
+        self.rejected = []
+        influxdb.set_rejected_measurement_callback(self.on_rejected)
+
+    def on_rejected(self, database, measurement, body):
+        self.rejected.append((database, measurement, body))
+
+    @testing.gen_test
+    def test_bad_measurements_are_isolated(self):
+        influxdb._create_http_client()
+        fetch = influxdb._http_client.fetch
+        with mock.patch.object(influxdb._http_client, 'fetch',
+                               side_effect=fetch) as request:
+            base.add_measurements(self.database, 1000, 'rejected-test',
+                                  invalid={10, 700})
+            influxdb._on_timeout()
+            while len(base.measurements) < 998 or len(self.rejected) < 2:
+                yield gen.sleep(0.01)
+
+        # 1 batch and 2 requests per level of the tree for each bad line
+        self.assertLessEqual(request.call_count, 1 + 2 * 2 * 10)
+        self.assertEqual(len(base.measurements), 998)
+        self.assertEqual(sorted(int(value.fields['test'])
+                                for value in base.measurements),
+                         [value for value in range(0, 1000)
+                          if value not in {10, 700}])
+        self.assertEqual(len(self.rejected), 2)
+        for database, measurement, body in self.rejected:
+            self.assertEqual(database, self.database)
+            self.assertTrue(measurement.startswith('bad=name'))
+            self.assertIn(b'unable to parse', body)
+
+    @testing.gen_test
+    def test_flush_waits_for_split_requests(self):
+        base.add_measurements(self.database, 100, 'rejected-test',
+                              invalid={50})
+        yield influxdb.flush()
+        self.assertEqual(len(base.measurements), 99)
+        self.assertEqual(len(self.rejected), 1)
+        self.assertEqual(influxdb._in_flight_total, 0)
+        self.assertEqual(influxdb._in_flight[self.database], 0)
+
+    @testing.gen_test
+    def test_single_bad_measurement(self):
+        base.add_measurements(self.database, 1, 'rejected-test', invalid={0})
+        influxdb._on_timeout()
+        while not self.rejected:
+            yield gen.sleep(0.01)
+        self.assertEqual(len(base.measurements), 0)
+        self.assertEqual(influxdb._pending_measurements(), 0)
+
+    @testing.gen_test
+    def test_rejected_half_requeued_on_server_error(self):
+        base.add_measurements(self.database, 4, 'rejected-test', invalid={0})
+        influxdb._create_http_client()
+        with mock.patch.object(influxdb._http_client, 'fetch') as fetch:
+            error = concurrent.Future()
+            error.set_exception(httpclient.HTTPError(400, 'Bad Request'))
+            unavailable = concurrent.Future()
+            unavailable.set_exception(httpclient.HTTPError(503, 'Error'))
+            success = concurrent.Future()
+            success.set_result(None)
+            fetch.side_effect = [error, error, unavailable, success, error]
+            influxdb._on_timeout()
+            while len(self.rejected) < 1:
+                yield gen.moment
+        self.assertEqual(fetch.call_count, 5)
+        self.assertEqual(influxdb._pending_measurements(), 2)
+
+
+class CircuitBreakerTestCase(base.AsyncServerTestCase):
+
+    def setUp(self):
+        super(CircuitBreakerTestCase, self).setUp()
+        base.measurements.clear()
+        influxdb.set_backoff(20, 100, 2)
+        influxdb._create_http_client()
+        self.requests = []
+
+    @staticmethod
+    def unavailable(*args, **kwargs):
+        future = concurrent.Future()
+        future.set_exception(httpclient.HTTPError(503, 'Unavailable'))
+        return future
+
+    def pending_fetch(self, *args, **kwargs):
+        future = concurrent.Future()
+        self.requests.append(future)
+        return future
+
+    def open_circuit(self):
+        base.add_measurements(str(uuid.uuid4()), 1, 'circuit-test')
+        with mock.patch.object(influxdb._http_client, 'fetch',
+                               side_effect=self.unavailable) as fetch:
+            influxdb._on_timeout()
+            self.assertEqual(influxdb.circuit_state(), influxdb.CIRCUIT_CLOSED)
+            influxdb._circuit_breaker().retry_at = 0
+            influxdb._on_timeout()
+            self.assertEqual(fetch.call_count, 2)
+        self.assertEqual(influxdb.circuit_state(), influxdb.CIRCUIT_OPEN)
+
+        # Stop the timeout that will submit the probe batch
+        influxdb._maybe_stop_timeout()
+
+    def test_backoff_is_exponential_with_jitter(self):
+        breaker = influxdb._CircuitBreaker(influxdb._base_url)
+        for low, high in [(0.01, 0.02), (0.02, 0.04), (0.04, 0.08),
+                          (0.05, 0.1), (0.05, 0.1)]:
+            breaker.on_failure(100)
+            self.assertGreaterEqual(breaker.delay(100), low)
+            self.assertLessEqual(breaker.delay(100), high)
+        breaker.on_success()
+        self.assertEqual(breaker.delay(100), 0)
+
+    def test_retry_is_delayed_after_failure(self):
+        base.add_measurements(str(uuid.uuid4()), 1, 'circuit-test')
+        with mock.patch.object(influxdb._http_client, 'fetch',
+                               side_effect=self.unavailable):
+            influxdb._on_timeout()
+        self.assertEqual(influxdb.circuit_state(), influxdb.CIRCUIT_CLOSED)
+        self.assertGreater(influxdb._circuit_breaker().delay(
+            self.io_loop.time()), 0)
+        self.assertIsNotNone(influxdb._timeout)
+
+    def test_retry_waits_for_backoff_below_threshold(self):
+        base.add_measurements(str(uuid.uuid4()), 1, 'circuit-test')
+        with mock.patch.object(influxdb._http_client, 'fetch',
+                               side_effect=self.unavailable) as fetch:
+            influxdb._on_timeout()
+            influxdb._on_timeout()
+            self.assertEqual(fetch.call_count, 1)
+        self.assertEqual(influxdb.circuit_state(), influxdb.CIRCUIT_CLOSED)
+        self.assertEqual(influxdb._pending_measurements(), 1)
+
+    def test_trigger_size_does_not_cancel_backoff(self):
+        influxdb.set_trigger_size(1)
+        with mock.patch.object(influxdb._http_client, 'fetch',
+                               side_effect=self.unavailable) as fetch:
+            base.add_measurements(str(uuid.uuid4()), 1, 'circuit-test')
+            timeout = influxdb._timeout
+            for _iteration in range(0, 5):
+                base.add_measurements(str(uuid.uuid4()), 1, 'circuit-test')
+            self.assertEqual(fetch.call_count, 1)
+        self.assertIs(influxdb._timeout, timeout)
+        self.assertEqual(influxdb._pending_measurements(), 6)
+
+    def test_submission_paused_while_open(self):
+        self.open_circuit()
+        influxdb._circuit_breaker().retry_at = self.io_loop.time() + 60
+        with mock.patch.object(influxdb._http_client, 'fetch') as fetch:
+            influxdb._on_timeout()
+            fetch.assert_not_called()
+        self.assertEqual(influxdb._pending_measurements(), 1)
+
+    @testing.gen_test
+    def test_half_open_submits_single_probe(self):
+        self.open_circuit()
+        base.add_measurements(str(uuid.uuid4()), 1, 'circuit-test')
+        yield gen.sleep(0.1)
+        self.assertEqual(influxdb.circuit_state(),
+                         influxdb.CIRCUIT_HALF_OPEN)
+        with mock.patch.object(influxdb._http_client, 'fetch',
+                               side_effect=self.pending_fetch):
+            future = influxdb._on_timeout()
+            self.assertEqual(len(self.requests), 1)
+            self.requests[0].set_result(None)
+            yield future  # Done once the probe's result is processed
+        self.assertEqual(influxdb.circuit_state(), influxdb.CIRCUIT_CLOSED)
+
+    @testing.gen_test
+    def test_failed_probe_reopens_circuit(self):
+        self.open_circuit()
+        yield gen.sleep(0.1)
+        with mock.patch.object(influxdb._http_client, 'fetch',
+                               side_effect=self.unavailable):
+            influxdb._on_timeout()
+        self.assertEqual(influxdb.circuit_state(), influxdb.CIRCUIT_OPEN)
+        self.assertEqual(influxdb._circuit_breaker().failures, 3)
+
+    @testing.gen_test
+    def test_probe_submitted_when_circuit_half_opens(self):
+        self.open_circuit()
+        influxdb._start_timeout(
+            influxdb._circuit_breaker().delay(self.io_loop.time()) * 1000)
+        while influxdb._pending_measurements() or influxdb._writing:
+            yield gen.sleep(0.01)
+        self.assertEqual(influxdb.circuit_state(), influxdb.CIRCUIT_CLOSED)
+        self.assertEqual(len(base.measurements), 1)
+
+    @testing.gen_test
+    def test_flush_waits_for_circuit(self):
+        self.open_circuit()
+        base.add_measurements(str(uuid.uuid4()), 1, 'circuit-test')
+        result = yield influxdb.flush()
+        self.assertTrue(result)
+        self.assertEqual(influxdb._pending_measurements(), 0)
+        self.assertEqual(influxdb.circuit_state(), influxdb.CIRCUIT_CLOSED)
+        self.assertEqual(len(base.measurements), 2)
+
+
+class SpillTestCase(base.AsyncServerTestCase):
+
+    def setUp(self):
+        super(SpillTestCase, self).setUp()
+        base.measurements.clear()
+        self.directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.directory)
+        influxdb.set_max_buffer_size(10)
+        influxdb.set_max_batch_size(10)
+        influxdb.set_spill_directory(self.directory)
+        self.database = str(uuid.uuid4())
+
+    def test_measurements_spilled_when_buffer_is_full(self):
+        base.add_measurements(self.database, 35, 'spill-test')
+        self.assertEqual(influxdb._buffer_size, 10)
+        self.assertEqual(influxdb._spill_size, 25)
+        self.assertEqual(influxdb._pending_measurements(), 35)
+        self.assertGreater(influxdb._spill_bytes, 0)
+        self.assertTrue(os.listdir(self.directory))
+
+    @testing.gen_test
+    def test_spilled_measurements_replayed_in_order(self):
+        influxdb.set_max_inflight_batches(1)
+        base.add_measurements(self.database, 35, 'spill-test')
+        yield influxdb.flush()
+        self.assertEqual(influxdb._pending_measurements(), 0)
+        self.assertEqual(influxdb._spill_bytes, 0)
+        self.assertEqual([value.fields['test'] for value in base.measurements],
+                         list(range(0, 35)))
+
+    def test_new_measurements_spilled_while_spill_has_measurements(self):
+        base.add_measurements(self.database, 15, 'spill-test')
+        influxdb._buffer_size = 0
+        base.add_measurements(self.database, 1, 'spill-test', start=15)
+        self.assertEqual(influxdb._spill_size, 6)
+
+    def test_measurements_discarded_at_max_spill_bytes(self):
+        influxdb.set_spill_directory(self.directory, 1)
+        base.add_measurements(self.database, 15, 'spill-test')
+        self.assertEqual(influxdb._pending_measurements(), 11)
+
+    def test_spilled_measurements_loaded_from_directory(self):
+        base.add_measurements(self.database, 30, 'spill-test')
+        for queue in influxdb._spills.values():
+            queue.close()
+        base.clear_influxdb_module()
+        influxdb.set_spill_directory(self.directory)
+        self.assertEqual(influxdb._spill_size, 20)
+        self.assertEqual(influxdb._pending_measurements(), 20)
+
+    def test_spill_queue_segments(self):
+        queue = influxdb._SpillQueue(os.path.join(self.directory, 'queue'))
+        queue.SEGMENT_SIZE = 100
+        values = [str(uuid.uuid4()).encode('utf-8')
+                  for _iteration in range(0, 20)]
+        for value in values:
+            queue.append(value)
+        self.assertEqual(len(queue), 20)
+        self.assertGreater(len(os.listdir(queue.directory)), 1)
+        self.assertEqual(queue.read(7),
+                         (b''.join(v + b'\n' for v in values[:7]), 7))
+        self.assertEqual(queue.read(100),
+                         (b''.join(v + b'\n' for v in values[7:]), 13))
+        self.assertEqual(len(queue), 0)
+        self.assertEqual(queue.size, 0)
+        self.assertEqual(os.listdir(queue.directory), [])
+
+    def test_spill_queue_loads_segments_in_chunks(self):
+        directory = os.path.join(self.directory, 'queue')
+        queue = influxdb._SpillQueue(directory)
+        values = [str(uuid.uuid4()).encode('utf-8')
+                  for _iteration in range(0, 20)]
+        for value in values:
+            queue.append(value)
+        queue.close()
+        with mock.patch.object(influxdb._SpillQueue, 'READ_SIZE', 7):
+            queue = influxdb._SpillQueue(directory)
+        self.assertEqual(len(queue), 20)
+        self.assertEqual(queue.size, sum(len(v) + 1 for v in values))
+        self.assertEqual(queue.read(100),
+                         (b''.join(v + b'\n' for v in values), 20))
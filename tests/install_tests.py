@@ -44,6 +44,68 @@ class InstallDefaultsTestCase(base.TestCase):
     def test_set_submission_interval(self):
         self.assertEqual(influxdb._timeout_interval, 60000)
 
+    def test_compression_disabled(self):
+        self.assertEqual(influxdb._compression_level, 0)
+
+
+class InstallCompressionTestCase(base.TestCase):
+
+    def test_compression_level(self):
+        influxdb.install(compression=9, compression_threshold=512)
+        self.assertEqual(influxdb._compression_level, 9)
+        self.assertEqual(influxdb._compression_threshold, 512)
+
+    def test_compression_from_environment_variable(self):
+        os.environ['INFLUXDB_COMPRESSION'] = 'true'
+        influxdb.install()
+        self.assertEqual(influxdb._compression_level, 6)
+
+    def test_compression_level_from_environment_variable(self):
+        os.environ['INFLUXDB_COMPRESSION'] = '3'
+        influxdb.install()
+        self.assertEqual(influxdb._compression_level, 3)
+
+
+class InstallPrecisionTestCase(base.TestCase):
+
+    def test_default_precision(self):
+        influxdb.install()
+        self.assertEqual(influxdb._precision, 'ms')
+
+    def test_precision(self):
+        influxdb.install(precision='ns')
+        self.assertEqual(influxdb._precision, 'ns')
+
+    def test_precision_from_environment_variable(self):
+        os.environ['INFLUXDB_PRECISION'] = 's'
+        influxdb.install()
+        self.assertEqual(influxdb._precision, 's')
+
+    def test_invalid_precision_raises_value_error(self):
+        with self.assertRaises(ValueError):
+            influxdb.install(precision='minutes')
+
+    def test_udp_default_precision(self):
+        influxdb.install(url='udp://localhost:8089')
+        self.assertEqual(influxdb._precision, 'ns')
+
+    def test_udp_precision(self):
+        influxdb.install(url='udp://localhost:8089', precision='s')
+        self.assertEqual(influxdb._precision, 's')
+
+    def test_set_base_url_udp_default_precision(self):
+        influxdb.install()
+        influxdb.set_base_url('udp://localhost:8089')
+        self.assertEqual(influxdb._precision, 'ns')
+        influxdb.set_base_url('http://localhost:8086/write')
+        self.assertEqual(influxdb._precision, 'ms')
+
+    def test_set_base_url_keeps_set_precision(self):
+        influxdb.set_precision('s')
+        influxdb.install()
+        influxdb.set_base_url('udp://localhost:8089')
+        self.assertEqual(influxdb._precision, 's')
+
 
 class InstallCredentialsTestCase(base.TestCase):
 
@@ -92,6 +154,13 @@ class SetConfigurationTestCase(base.AsyncTestCase):
         self.assertEqual(influxdb._credentials, expectation)
         self.assertTrue(influxdb._dirty)
 
+    def test_set_backoff(self):
+        influxdb.install()
+        influxdb.set_backoff(250, 5000, 5)
+        self.assertEqual(influxdb._backoff_interval, 250)
+        self.assertEqual(influxdb._max_backoff_interval, 5000)
+        self.assertEqual(influxdb._failure_threshold, 5)
+
     def test_set_base_url(self):
         influxdb.install()
         expectation = 'https://influxdb.com:8086/write'
@@ -112,6 +181,85 @@ class SetConfigurationTestCase(base.AsyncTestCase):
         self.assertEqual(influxdb._max_clients, expectation)
         self.assertTrue(influxdb._dirty)
 
+    def test_set_max_inflight_batches(self):
+        influxdb.install()
+        expectation = random.randint(1, 100)
+        influxdb.set_max_inflight_batches(expectation)
+        self.assertEqual(influxdb._max_inflight_batches, expectation)
+
+    def test_set_aggregation_interval(self):
+        influxdb.install(aggregation_interval=1000)
+        self.assertEqual(influxdb._aggregation_interval, 1000)
+        influxdb.set_aggregation_interval(5000)
+        self.assertEqual(influxdb._aggregation_interval, 5000)
+
+    def test_set_stats_reporting(self):
+        influxdb.install(stats_database='metrics', stats_interval=1000)
+        self.assertEqual(influxdb._stats_database, 'metrics')
+        self.assertEqual(influxdb._stats_interval, 1000)
+        influxdb.set_stats_reporting('other', 5000)
+        self.assertEqual(influxdb._stats_database, 'other')
+        self.assertEqual(influxdb._stats_interval, 5000)
+        self.assertIsNotNone(influxdb._stats_timeout)
+        influxdb.set_stats_reporting(None)
+        self.assertIsNone(influxdb._stats_timeout)
+
+    def test_invalid_http_backend(self):
+        with self.assertRaises(ValueError):
+            influxdb.install(http_backend='urllib')
+
+    def test_set_http_backend(self):
+        influxdb.install()
+        self.assertEqual(influxdb._http_backend, 'simple')
+        influxdb.set_http_backend('simple')
+        self.assertTrue(influxdb._dirty)
+
+    def test_set_urls(self):
+        urls = ['http://influxdb-{}:8086/write'.format(index)
+                for index in range(0, 3)]
+        influxdb.install(urls=urls, routing=influxdb.ROUTING_SERIES)
+        self.assertEqual(influxdb._urls, urls)
+        self.assertEqual(influxdb._routing, influxdb.ROUTING_SERIES)
+        self.assertEqual(influxdb._base_url, urls[0])
+        self.assertEqual(set(influxdb._ring), set(urls))
+        influxdb.set_urls(None)
+        self.assertEqual(influxdb._urls, [])
+        self.assertEqual(influxdb._route('database', b''), 'database')
+
+    def test_urls_from_environment(self):
+        os.environ['INFLUXDB_URLS'] = 'http://a:8086/write,http://b:8086/write'
+        os.environ['INFLUXDB_ROUTING'] = 'series'
+        influxdb.install()
+        self.assertEqual(influxdb._urls, ['http://a:8086/write',
+                                          'http://b:8086/write'])
+        self.assertEqual(influxdb._routing, influxdb.ROUTING_SERIES)
+
+    def test_set_replicas(self):
+        replicas = ['http://replica-a:8086/write',
+                    'http://replica-b:8086/write']
+        influxdb.install(replicas=replicas, max_latency=250)
+        self.assertEqual(influxdb._replicas, replicas)
+        self.assertEqual(influxdb._max_latency, 250)
+        influxdb.set_replicas(None)
+        self.assertEqual(influxdb._replicas, [])
+        self.assertEqual(influxdb._max_latency, 250)
+
+    def test_replicas_from_environment(self):
+        os.environ['INFLUXDB_REPLICAS'] = 'http://a:8086/write'
+        os.environ['INFLUXDB_MAX_LATENCY'] = '500'
+        influxdb.install()
+        self.assertEqual(influxdb._replicas, ['http://a:8086/write'])
+        self.assertEqual(influxdb._max_latency, 500)
+
+    def test_set_series_cache_size(self):
+        influxdb.install(series_cache_size=100)
+        self.assertEqual(influxdb._max_series_cache_size, 100)
+        for key in range(0, 100):
+            influxdb._series_key('name', [('key', key)])
+        influxdb.set_series_cache_size(10)
+        self.assertEqual(influxdb._max_series_cache_size, 10)
+        self.assertEqual(len(influxdb._series_cache), 10)
+
     @testing.gen_test()
     def test_set_timeout(self):
         influxdb.install()
@@ -125,6 +273,20 @@ class SetConfigurationTestCase(base.AsyncTestCase):
         influxdb.set_sample_probability(expectation)
         self.assertEqual(influxdb._sample_probability, expectation)
 
+    def test_set_compression(self):
+        influxdb.install()
+        influxdb.set_compression(4, 2048)
+        self.assertEqual(influxdb._compression_level, 4)
+        self.assertEqual(influxdb._compression_threshold, 2048)
+        influxdb.set_compression(False)
+        self.assertEqual(influxdb._compression_level, 0)
+        self.assertEqual(influxdb._compression_threshold, 2048)
+
+    def test_set_invalid_compression(self):
+        influxdb.install()
+        with self.assertRaises(ValueError):
+            influxdb.set_compression(10)
+
     def test_set_invalid_sample_probability(self):
         influxdb.install()
         with self.assertRaises(ValueError):
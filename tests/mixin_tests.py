@@ -5,6 +5,8 @@ import unittest
 
 import tornado
 
+import sprockets_influxdb as influxdb
+
 from . import base
 
 
@@ -132,3 +134,106 @@ class MeasurementTestCase(base.AsyncServerTestCase):
 
         self.assertEqual(0, mock_4.call_count)
         self.assertEqual(1, mock_45.call_count)
+
+
+@unittest.skipIf(tornado.version_info < (4, 5),
+                 'routing module introduced in tornado 4.5')
+class PathPatternCacheTestCase(base.AsyncServerTestCase):
+
+    def test_path_pattern_is_cached_per_handler_class(self):
+        self.fetch('/param/100')
+        self.assertEqual(self.get_measurement().tags['endpoint'],
+                         r'/param/(?P<id>\d+)')
+        signature, patterns = influxdb._route_patterns[self.application]
+        self.assertEqual(patterns[base.ParamRequestHandler],
+                         r'/param/(?P<id>\d+)$')
+        self.fetch('/param/200')
+        self.assertEqual(self.get_measurement().tags['endpoint'],
+                         r'/param/(?P<id>\d+)')
+        self.assertIs(influxdb._route_patterns[self.application][1],
+                      patterns)
+
+    def test_handler_class_with_multiple_patterns_is_matched(self):
+        self.application.add_handlers(
+            'some_host', [(r'/host/(?P<id>\d+)', base.ParamRequestHandler)])
+        self.fetch('/param/100')
+        self.assertEqual(self.get_measurement().tags['endpoint'],
+                         r'/param/(?P<id>\d+)')
+        self.fetch('/host/100', headers={'Host': 'some_host'})
+        self.assertEqual(self.get_measurement().tags['endpoint'],
+                         r'/host/(?P<id>\d+)')
+
+    def test_cache_is_rebuilt_when_routes_are_added(self):
+        self.fetch('/param/100')
+        self.get_measurement()
+        self.application.add_handlers(
+            '.*$', [(r'/other/(?P<id>\d+)', base.ParamRequestHandler)])
+        self.fetch('/other/100')
+        self.assertEqual(self.get_measurement().tags['endpoint'],
+                         r'/other/(?P<id>\d+)')
+
+
+class AggregationTestCase(base.AsyncServerTestCase):
+
+    def setUp(self):
+        super(AggregationTestCase, self).setUp()
+        base.measurements.clear()
+        influxdb.set_aggregation_interval(60000)
+
+    def test_requests_are_aggregated_per_series(self):
+        for _iteration in range(0, 3):
+            self.assertEqual(self.fetch('/').code, 200)
+        self.assertEqual(self.fetch('/param/100').code, 200)
+        self.assertEqual(influxdb._pending_measurements(), 0)
+        self.assertEqual(len(influxdb._rollups), 2)
+
+        influxdb._flush_rollups(True)
+        self.flush()
+        measurements = {measurement.tags['endpoint']: measurement
+                        for measurement in base.measurements}
+        self.assertEqual(len(measurements), 2)
+        measurement = measurements['/']
+        self.assertEqual(measurement.name, 'my-service')
+        self.assertEqual(measurement.tags['status_code'], '200')
+        self.assertNotIn('remote_ip', measurement.tags)
+        self.assertEqual(measurement.fields['count'], 3)
+        self.assertEqual(measurement.fields['content_length_sum'], 48)
+        self.assertEqual(measurement.fields['content_length_min'], 16)
+        self.assertEqual(measurement.fields['content_length_max'], 16)
+        self.assertLessEqual(measurement.fields['duration_min'],
+                             measurement.fields['duration_max'])
+        self.assertGreaterEqual(measurement.fields['duration_sum'],
+                                measurement.fields['duration_max'])
+        for suffix in ('p50', 'p90', 'p99', 'p999'):
+            self.assertAlmostEqual(
+                measurement.fields['duration_{}'.format(suffix)],
+                measurement.fields['duration_max'], delta=0.01)
+        self.assertNotIn('content_length_p50', measurement.fields)
+        self.assertEqual(measurement.timestamp % 60000, 0)
+        self.assertEqual(measurements[r'/param/(?P<id>\d+)'].fields['count'],
+                         1)
+
+    def test_rollups_are_submitted_at_the_end_of_the_interval(self):
+        influxdb.set_aggregation_interval(50)
+        self.assertEqual(self.fetch('/').code, 200)
+        self.io_loop.call_later(0.1, self.stop)
+        self.wait()
+        self.assertEqual(influxdb._rollups, {})
+        self.assertIsNone(influxdb._rollup_timeout)
+        self.flush()
+        self.assertEqual(self.get_measurement().fields['count'], 1)
+
+    def test_rollups_are_submitted_on_shutdown(self):
+        self.assertEqual(self.fetch('/').code, 200)
+        self.io_loop.add_future(influxdb.shutdown(), self.stop)
+        self.wait()
+        measurement = self.get_measurement()
+        self.assertEqual(measurement.fields['count'], 1)
+        self.assertEqual(influxdb._rollups, {})
+
+    def test_non_numeric_fields_are_ignored(self):
+        rollup = influxdb._Rollup(0)
+        rollup.add({'duration': 0.5, 'ok': True, 'name': 'foo'})
+        rollup.add({'duration': 1.5})
+        self.assertEqual(rollup.count, 2)
+        self.assertEqual(rollup.fields, {'duration': [2.0, 0.5, 1.5]})